@@ -1,60 +1,189 @@
 from django.contrib import admin
-from .models import Company, Storage, Supplier, Product, Supply, SupplyProduct, Sale, ProductSale
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from .models import (Company, Storage, Supplier, Product, Supply, SupplyProduct, Buyer, Sale, ProductSale,
+                     StockTransfer, StockTransferProduct)
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор для больших таблиц: без фильтров берет оценку числа строк
+    из статистики БД вместо полного COUNT(*).
+    """
+    ESTIMATE_THRESHOLD = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = self._estimate(queryset)
+            if estimate is not None and estimate > self.ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def _estimate(queryset):
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+                row = cursor.fetchone()
+            return row[0] if row and row[0] > 0 else None
+
+        if connection.vendor == 'mysql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT table_rows FROM information_schema.tables '
+                    'WHERE table_schema = DATABASE() AND table_name = %s',
+                    [table]
+                )
+                row = cursor.fetchone()
+            return row[0] if row else None
+
+        if connection.vendor == 'sqlite':
+            # Статистика ANALYZE: первое число stat - строк в таблице. Без нее
+            # оценки нет, и считается настоящий COUNT(*). max(id) не годится:
+            # после архивации и в шардах с блоками id он далек от числа строк
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+                if cursor.fetchone() is None:
+                    return None
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+                row = cursor.fetchone()
+            return int(row[0].split()[0]) if row else None
+
+        return None
+
+
+class RelatedStrAdmin(admin.ModelAdmin):
+    """
+    Для моделей, чей __str__ читает связанные объекты: list_select_related
+    применяется ко всем запросам админки, включая автодополнение.
+    """
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(*self.list_select_related)
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
 
 @admin.register(Company)
 class CompanyAdmin(admin.ModelAdmin):
-    list_display = ('title', 'INN', 'created_at', 'updated_at')
+    list_display = ('title', 'INN', 'shard', 'created_at', 'updated_at')
+    list_filter = ('shard',)
     search_fields = ('title', 'INN')
 
 
 @admin.register(Storage)
-class StorageAdmin(admin.ModelAdmin):
+class StorageAdmin(RelatedStrAdmin):
     list_display = ('company', 'address')
     list_filter = ('company',)
+    list_select_related = ('company',)
+    search_fields = ('address', 'company__title')
+    autocomplete_fields = ('company',)
+    ordering = ('id',)
 
 
 @admin.register(Supplier)
-class SupplierAdmin(admin.ModelAdmin):
+class SupplierAdmin(RelatedStrAdmin):
     list_display = ('name', 'company', 'contact_person', 'phone')
     list_filter = ('company',)
+    list_select_related = ('company',)
     search_fields = ('name', 'contact_person', 'phone')
+    autocomplete_fields = ('company',)
+    ordering = ('id',)
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
+class ProductAdmin(LargeTableAdmin):
     list_display = ('title', 'storage', 'quantity', 'purchase_price', 'selling_price')
-    list_filter = ('storage__company', 'storage')
+    list_filter = ('company', 'storage')
+    list_select_related = ('storage__company',)
     search_fields = ('title', 'description')
+    readonly_fields = ('company',)
+    autocomplete_fields = ('storage',)
 
 
 @admin.register(Supply)
-class SupplyAdmin(admin.ModelAdmin):
+class SupplyAdmin(RelatedStrAdmin, LargeTableAdmin):
     list_display = ('id', 'supplier', 'storage', 'created_at')
-    list_filter = ('storage__company', 'supplier')
+    list_filter = ('company', 'supplier')
+    list_select_related = ('supplier__company', 'storage__company')
+    search_fields = ('=id', 'supplier__name')
     date_hierarchy = 'created_at'
+    readonly_fields = ('company',)
+    autocomplete_fields = ('supplier', 'storage', 'created_by')
+    ordering = ('-created_at',)
 
 
 @admin.register(SupplyProduct)
-class SupplyProductAdmin(admin.ModelAdmin):
+class SupplyProductAdmin(LargeTableAdmin):
     list_display = ('supply', 'product', 'quantity', 'purchase_price')
-    list_filter = ('supply__storage__company',)
+    list_filter = ('supply__company',)
+    list_select_related = ('supply__supplier__company', 'product')
+    autocomplete_fields = ('supply', 'product')
+
+
+class StockTransferProductInLine(admin.TabularInline):
+    model = StockTransferProduct
+    extra = 0
+    fields = ('source_product', 'destination_product', 'quantity')
+    readonly_fields = fields
+
+
+@admin.register(StockTransfer)
+class StockTransferAdmin(LargeTableAdmin):
+    list_display = ('id', 'source_storage', 'destination_storage', 'created_at')
+    list_filter = ('company',)
+    list_select_related = ('source_storage__company', 'destination_storage__company')
+    date_hierarchy = 'created_at'
+    inlines = [StockTransferProductInLine]
+    ordering = ('-created_at',)
+
+    # Остатки меняет только transfer_stock, поэтому документ в админке только просматривается
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 class ProductSaleInLine(admin.TabularInline):
     model = ProductSale
     extra = 0
-    readonly_fields = ('price', 'created_at')
-    fields = ('product', 'quantity', 'price', 'created_at')
+    readonly_fields = ('price', 'cost_price', 'total_amount', 'created_at')
+    fields = ('product', 'quantity', 'price', 'cost_price', 'total_amount', 'created_at')
+    autocomplete_fields = ('product',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
+
+
+@admin.register(Buyer)
+class BuyerAdmin(RelatedStrAdmin, LargeTableAdmin):
+    list_display = ('name', 'company', 'created_at')
+    list_filter = ('company',)
+    list_select_related = ('company',)
+    search_fields = ('name',)
+    # Покупатели создаются по продажам; переименование разошлось бы с кэшем id по имени
+    readonly_fields = ('company', 'name', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
 
 
 @admin.register(Sale)
-class SaleAdmin(admin.ModelAdmin):
+class SaleAdmin(LargeTableAdmin):
     list_display = ('id', 'company', 'total_amount', 'created_at')
     list_filter = ('company', 'created_at')
+    list_select_related = ('company',)
     search_fields = ('buyer_name',)
+    date_hierarchy = 'sale_date'
     inlines = [ProductSaleInLine]
-    readonly_fields = ('total_amount', 'created_at', 'updated_at')
-
-    def get_queryset(self, request):
-        qs = super().get_queryset(request)
-        return qs.select_related('company', 'created_by').prefetch_related('product_sales__product')
\ No newline at end of file
+    readonly_fields = ('buyer', 'total_amount', 'created_at', 'updated_at')
+    autocomplete_fields = ('company', 'created_by')
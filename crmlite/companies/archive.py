@@ -0,0 +1,176 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.functional import cached_property
+
+from .models import Company, Sale, ProductSale, ArchivedSale, ArchivedProductSale, SalesReport, PRODUCT_SALE_PROFIT
+from .sharding import current_shard
+
+SALE_FIELDS = ('id', 'company_id', 'buyer_name', 'buyer_name_lower', 'buyer_id', 'sale_date',
+               'created_at', 'updated_at', 'total_amount', 'created_by_id')
+PRODUCT_SALE_FIELDS = ('id', 'sale_id', 'product_id', 'quantity', 'price',
+                       'cost_price', 'total_amount', 'created_at')
+
+
+def archive_boundary(company):
+    """
+    Граница архива компании: продажи раньше нее лежат в архиве, и период
+    закрыт. None, если архива нет.
+    """
+    if company.archived_before:
+        return company.archived_before
+    # Архив, перенесенный до появления Company.archived_before:
+    # граница - полночь после последней архивной продажи
+    last = ArchivedSale.objects.filter(company=company).aggregate(last=Max('sale_date'))['last']
+    if last is None:
+        return None
+    return timezone.make_aware(datetime.combine(timezone.localtime(last).date() + timedelta(days=1), time.min))
+
+
+def to_datetime(value):
+    """Приводит строку/дату из параметров запроса к aware datetime."""
+    if value is None or isinstance(value, datetime):
+        parsed = value
+    else:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            parsed = datetime.combine(date, time.min) if date else None
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def reaches_archive(company, date_from):
+    """Нужно ли читать архив для выборки, начинающейся с date_from."""
+    boundary = archive_boundary(company)
+    if boundary is None:
+        return False
+    date_from = to_datetime(date_from)
+    return date_from is None or date_from < boundary
+
+
+def sale_sources(company, date_from=None):
+    """
+    Пары (продажи, позиции продаж) для аналитики: горячие таблицы
+    и, если период заходит в архив, архивные.
+    """
+    sources = [(Sale.objects.filter(company=company), ProductSale.objects)]
+    if reaches_archive(company, date_from):
+        sources.append((ArchivedSale.objects.filter(company=company), ArchivedProductSale.objects))
+    return sources
+
+
+class SaleChain:
+    """
+    Горячие продажи, за которыми следуют архивные. Архив содержит только
+    продажи старше любой горячей, поэтому сортировка по -sale_date
+    сохраняется при простой конкатенации.
+    """
+    ordered = True
+
+    def __init__(self, hot, archived):
+        self.hot = hot
+        self.archived = archived
+
+    @cached_property
+    def hot_count(self):
+        return self.hot.count()
+
+    def count(self):
+        return self.hot_count + self.archived.count()
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        yield from self.hot
+        yield from self.archived
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            if item < self.hot_count:
+                return self.hot[item]
+            return self.archived[item - self.hot_count]
+
+        start = item.start or 0
+        stop = item.stop if item.stop is not None else self.count()
+        result = list(self.hot[start:stop]) if start < self.hot_count else []
+        if stop > self.hot_count:
+            result += list(self.archived[max(start - self.hot_count, 0):stop - self.hot_count])
+        return result
+
+
+def rollup_sales_reports(sales):
+    """Записывает дневные SalesReport по переданным продажам."""
+    profits = {
+        (row['sale__company_id'], row['day']): row['profit']
+        for row in ProductSale.objects.filter(sale__in=sales).annotate(
+            day=TruncDate('sale__sale_date')
+        ).values('sale__company_id', 'day').annotate(profit=Sum(PRODUCT_SALE_PROFIT))
+    }
+    totals = sales.annotate(
+        day=TruncDate('sale_date')
+    ).values('company_id', 'day').annotate(total=Sum('total_amount'))
+
+    for row in totals:
+        SalesReport.objects.update_or_create(
+            company_id=row['company_id'],
+            report_date=row['day'],
+            period='day',
+            defaults={
+                'total_sales': row['total'] or 0,
+                'net_profit': profits.get((row['company_id'], row['day'])) or 0,
+            }
+        )
+
+
+def archive_sales(before, batch_size=1000):
+    """
+    Переносит продажи до даты before в архивные таблицы пачками.
+    Каждая пачка переносится в отдельной транзакции. Возвращает
+    количество перенесенных продаж.
+
+    Сначала закрывается период: компаниям шарда записывается граница
+    before, и продажи раньше нее больше не создаются и не переносятся
+    в горячие таблицы задним числом.
+    """
+    from .cache import bump_version  # Ленивый импорт
+
+    companies = Company.objects.filter(shard=current_shard()).filter(
+        Q(archived_before__isnull=True) | Q(archived_before__lt=before)
+    )
+    company_ids = list(companies.values_list('id', flat=True))
+    companies.update(archived_before=before)
+    for company_id in company_ids:
+        bump_version(company_id)
+
+    rollup_sales_reports(Sale.objects.filter(sale_date__lt=before))
+
+    moved = 0
+    while True:
+        with transaction.atomic(using=current_shard()):
+            sale_ids = list(
+                Sale.objects.filter(sale_date__lt=before)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not sale_ids:
+                break
+
+            ArchivedSale.objects.bulk_create(
+                ArchivedSale(**row)
+                for row in Sale.objects.filter(id__in=sale_ids).values(*SALE_FIELDS)
+            )
+            ArchivedProductSale.objects.bulk_create(
+                ArchivedProductSale(**row)
+                for row in ProductSale.objects.filter(sale_id__in=sale_ids).values(*PRODUCT_SALE_FIELDS)
+            )
+            ProductSale.objects.filter(sale_id__in=sale_ids).delete()
+            Sale.objects.filter(id__in=sale_ids).delete()
+        moved += len(sale_ids)
+    return moved
@@ -0,0 +1,104 @@
+"""
+Read-through кэш справочных данных компании: Company, Storage, Supplier
+и id покупателей по имени.
+
+Ключи содержат версию компании, которую сигналы post_save/post_delete
+меняют после коммита любого изменения. Старые ключи не удаляются, а просто
+перестают читаться и истекают по таймауту. Работает с локальным и
+файловым бэкендами Django, Redis не нужен.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from .models import Buyer, Company, Storage, Supplier, normalize_buyer_name
+from .sharding import shard_for_company
+
+
+def _cache():
+    return caches[settings.REFERENCE_CACHE_ALIAS]
+
+
+def _version_key(company_id):
+    return f'companies:{company_id}:version'
+
+
+def _new_version():
+    # Случайная, а не следующая по счету: после вытеснения ключа версии
+    # не прочитать данные, закэшированные под старыми номерами, а две
+    # одновременные смены не дадут одну и ту же версию (incr файлового
+    # кэша - это get и set без блокировки)
+    return uuid.uuid4().hex
+
+
+def company_version(company_id):
+    version = _cache().get(_version_key(company_id))
+    if version is None:
+        _cache().add(_version_key(company_id), _new_version(), timeout=None)
+        version = _cache().get(_version_key(company_id))
+    return version
+
+
+def bump_version(company_id):
+    _cache().set(_version_key(company_id), _new_version(), timeout=None)
+
+
+def _read_through(company_id, name, loader):
+    key = f'companies:{company_id}:v{company_version(company_id)}:{name}'
+    value = _cache().get(key)
+    if value is None:
+        value = loader()
+        _cache().set(key, value, timeout=settings.REFERENCE_CACHE_TIMEOUT)
+    return value
+
+
+def get_company(company_id):
+    if company_id is None:
+        return None
+    return _read_through(
+        company_id, 'company',
+        lambda: Company.objects.filter(id=company_id).first()
+    )
+
+
+def get_storages(company_id):
+    """Сериализованные склады компании: {id: данные} в порядке id."""
+    from .serializers import StorageSerializer  # Ленивый импорт
+
+    return _read_through(company_id, 'storages', lambda: {
+        storage.id: dict(StorageSerializer(storage).data)
+        for storage in Storage.objects.filter(company_id=company_id).order_by('id')
+    })
+
+
+def get_suppliers(company_id):
+    """Сериализованные поставщики компании: {id: данные} в порядке id."""
+    from .serializers import SupplierSerializer  # Ленивый импорт
+
+    return _read_through(company_id, 'suppliers', lambda: {
+        supplier.id: dict(SupplierSerializer(supplier).data)
+        for supplier in Supplier.objects.filter(company_id=company_id).order_by('id')
+    })
+
+
+def get_buyer_id(company_id, name):
+    """id покупателя компании с таким именем; если его нет, покупатель создается."""
+    normalized = normalize_buyer_name(name)
+    digest = hashlib.sha256(normalized.encode()).hexdigest()[:32]
+    key = f'companies:{company_id}:v{company_version(company_id)}:buyer:{digest}'
+    buyer_id = _cache().get(key)
+    if buyer_id is None:
+        using = shard_for_company(company_id)
+        buyer, _ = Buyer.objects.using(using).get_or_create(
+            company_id=company_id, normalized_name=normalized,
+            defaults={'name': ' '.join(name.split())}
+        )
+        buyer_id = buyer.id
+        # После коммита: при откате транзакции созданного покупателя не будет
+        transaction.on_commit(
+            lambda: _cache().set(key, buyer_id, timeout=settings.REFERENCE_CACHE_TIMEOUT), using=using
+        )
+    return buyer_id
@@ -0,0 +1,94 @@
+"""
+Аналитика по покупателям: лучшие покупатели, доля повторных, LTV.
+
+Продажи группируются по целочисленному buyer_id, а не по строке
+buyer_name, и читаются только из индекса (company, buyer, sale_date,
+total_amount). Горячие и архивные продажи складываются.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, Max, Min, Sum
+
+from .archive import sale_sources
+from .models import Buyer
+
+CENTS = Decimal('0.01')
+TOP_BUYERS_LIMIT = 10
+TOP_BUYERS_MAX = 100
+TOP_BUYERS_ORDERING = ('revenue', 'sales_count')
+
+
+def _period(start, end):
+    period = {}
+    if start:
+        period['sale_date__gte'] = start
+    if end:
+        period['sale_date__lt'] = end
+    return period
+
+
+def _money(value):
+    # SQLite суммирует DecimalField как float
+    return Decimal(value or 0).quantize(CENTS)
+
+
+def buyer_totals(company, start=None, end=None):
+    """{buyer_id: [продаж, выручка]} за период [start, end)."""
+    totals = {}
+    for sales, _ in sale_sources(company, start):
+        rows = sales.filter(buyer__isnull=False, **_period(start, end)).values_list('buyer_id').annotate(
+            Count('id'), Sum('total_amount')
+        ).order_by()
+        for buyer_id, sales_count, revenue in rows:
+            merged = totals.setdefault(buyer_id, [0, 0])
+            merged[0] += sales_count
+            merged[1] += revenue or 0
+    return totals
+
+
+def top_buyers(company, start=None, end=None, limit=TOP_BUYERS_LIMIT, ordering='revenue'):
+    """Лучшие покупатели за период с датами первой и последней покупки."""
+    if ordering == 'revenue':
+        key = lambda item: (item[1][1], item[1][0])
+    else:
+        key = lambda item: item[1]
+    top = sorted(buyer_totals(company, start, end).items(), key=key, reverse=True)[:limit]
+    buyer_ids = [buyer_id for buyer_id, _ in top]
+    names = dict(Buyer.objects.filter(id__in=buyer_ids).values_list('id', 'name'))
+
+    # Даты нужны только лучшим покупателям
+    dates = {}
+    for sales, _ in sale_sources(company, start):
+        rows = sales.filter(buyer__in=buyer_ids, **_period(start, end)).values_list('buyer_id').annotate(
+            Min('sale_date'), Max('sale_date')
+        ).order_by()
+        for buyer_id, first_sale, last_sale in rows:
+            known = dates.get(buyer_id)
+            dates[buyer_id] = (first_sale, last_sale) if known is None else (
+                min(known[0], first_sale), max(known[1], last_sale)
+            )
+
+    return [
+        {'buyer_id': buyer_id, 'name': names.get(buyer_id),
+         'sales_count': sales_count, 'revenue': _money(revenue),
+         'first_sale': dates[buyer_id][0], 'last_sale': dates[buyer_id][1]}
+        for buyer_id, (sales_count, revenue) in top
+    ]
+
+
+def customer_summary(company, start=None, end=None):
+    """Покупатели за период, доля купивших повторно и средняя выручка на покупателя (LTV)."""
+    totals = buyer_totals(company, start, end).values()
+    buyers = len(totals)
+    repeat_buyers = sum(1 for sales_count, _ in totals if sales_count > 1)
+    sales_count = sum(sales_count for sales_count, _ in totals)
+    revenue = _money(sum(revenue for _, revenue in totals))
+    return {
+        'buyers': buyers,
+        'repeat_buyers': repeat_buyers,
+        'repeat_rate': round(repeat_buyers / buyers, 4) if buyers else 0,
+        'sales_count': sales_count,
+        'revenue': revenue,
+        'average_ltv': _money(revenue / buyers) if buyers else _money(0),
+        'average_sales_per_buyer': round(sales_count / buyers, 2) if buyers else 0,
+    }
@@ -0,0 +1,68 @@
+"""
+Массовое добавление сотрудников: все пользователи ищутся одним запросом
+и прикрепляются к компании одним UPDATE.
+"""
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+
+User = get_user_model()
+
+# Записей в одном запросе на добавление
+EMPLOYEES_BULK_MAX = 1000
+
+ADDED = 'added'
+NOT_FOUND = 'not_found'
+COMPANY_OWNER = 'company_owner'
+ALREADY_MEMBER = 'already_member'
+OTHER_COMPANY = 'other_company'
+
+
+def attach_employees(company, emails=(), user_ids=()):
+    """
+    Прикрепляет к компании пользователей по email и id. Возвращает
+    результаты в порядке входных записей: сначала emails, затем user_ids.
+    """
+    users = User.objects.filter(
+        Q(email__in=emails) | Q(id__in=user_ids)
+    ).only('id', 'email', 'username', 'company_id', 'is_company_owner')
+    by_email = {}
+    by_id = {}
+    for user in users:
+        by_email[user.email] = by_id[user.id] = user
+
+    entries = [('email', email, by_email.get(email)) for email in emails]
+    entries += [('user_id', user_id, by_id.get(user_id)) for user_id in user_ids]
+
+    statuses = {}
+    for _, _, user in entries:
+        if user is None or user.id in statuses:
+            continue
+        if user.is_company_owner:
+            statuses[user.id] = COMPANY_OWNER
+        elif user.company_id == company.id:
+            statuses[user.id] = ALREADY_MEMBER
+        elif user.company_id:
+            statuses[user.id] = OTHER_COMPANY
+        else:
+            statuses[user.id] = ADDED
+
+    eligible = [user_id for user_id, user_status in statuses.items() if user_status == ADDED]
+    if eligible:
+        # Условия повторяются в UPDATE: пользователя могли прикрепить параллельно
+        updated = User.objects.filter(
+            id__in=eligible, company__isnull=True, is_company_owner=False
+        ).update(company=company)
+        if updated != len(eligible):
+            attached = set(
+                User.objects.filter(id__in=eligible, company=company).values_list('id', flat=True)
+            )
+            for user_id in set(eligible) - attached:
+                statuses[user_id] = OTHER_COMPANY
+
+    results = []
+    for key, value, user in entries:
+        result = {key: value, 'status': statuses[user.id] if user else NOT_FOUND}
+        if user:
+            result['user'] = {'id': user.id, 'email': user.email, 'username': user.username}
+        results.append(result)
+    return results
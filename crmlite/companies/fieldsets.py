@@ -0,0 +1,77 @@
+"""
+Разреженные наборы полей для GET-запросов.
+
+?fields=id,total_amount оставляет в ответе только перечисленные поля,
+?expand=products,supplier раскрывает связанные объекты, которые по
+умолчанию отдаются как id или не отдаются вовсе. View по итоговому
+набору полей сериализатора решают, что загружать: нераскрытые связи
+не читаются из БД, а лишние колонки отсекаются через only().
+"""
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import permissions
+
+FIELDS_PARAMETER = OpenApiParameter(
+    name='fields',
+    required=False,
+    type=str,
+    description='Поля ответа через запятую, например id,total_amount'
+)
+EXPAND_PARAMETER = OpenApiParameter(
+    name='expand',
+    required=False,
+    type=str,
+    description='Связанные объекты для раскрытия через запятую'
+)
+SPARSE_PARAMETERS = [FIELDS_PARAMETER, EXPAND_PARAMETER]
+
+
+def query_list(request, name):
+    value = request.query_params.get(name, '')
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+class SparseFieldsetMixin:
+    """
+    collapsed_fields: поле -> фабрика свернутого представления
+    (None - поле не выводится, пока его не раскроют).
+    expanded_fields: поле -> фабрика раскрытого представления.
+
+    Без запроса в контексте (outbox, ответ на создание) и для
+    небезопасных методов сериализатор работает как обычно.
+    """
+    collapsed_fields = {}
+    expanded_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return
+
+        fields = query_list(request, 'fields')
+        expand = query_list(request, 'expand')
+        # Скрытое по умолчанию поле, явно перечисленное в fields, раскрывается
+        expand |= {
+            name for name in fields
+            if name in self.collapsed_fields and self.collapsed_fields[name] is None
+        }
+
+        for name in set(self.collapsed_fields) | set(self.expanded_fields):
+            if name in expand:
+                if name in self.expanded_fields:
+                    self.fields[name] = self.expanded_fields[name]()
+            elif name in self.collapsed_fields:
+                if self.collapsed_fields[name] is None:
+                    self.fields.pop(name, None)
+                else:
+                    self.fields[name] = self.collapsed_fields[name]()
+
+        if fields:
+            for name in set(self.fields) - fields:
+                self.fields.pop(name)
+
+
+def only_fields(model, names, *required):
+    """Колонки модели для only(): поля ответа, которые есть в таблице, и обязательные."""
+    concrete = {field.name for field in model._meta.concrete_fields}
+    return [model._meta.pk.name, *sorted((set(names) | set(required)) & concrete)]
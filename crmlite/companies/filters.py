@@ -1,11 +1,37 @@
 import django_filters
+from django.db.models import Exists, OuterRef
+
 from .models import Sale
 
 
 class SaleFilter(django_filters.FilterSet):
     start_date = django_filters.DateTimeFilter(field_name='sale_date', lookup_expr='gte')
     end_date = django_filters.DateTimeFilter(field_name='sale_date', lookup_expr='lte')
+    buyer_name = django_filters.CharFilter(method='filter_buyer_name', label='Начало имени покупателя')
+    product = django_filters.NumberFilter(method='filter_product', label='ID товара в продаже')
+    buyer = django_filters.NumberFilter(field_name='buyer', label='ID покупателя')
+    created_by = django_filters.NumberFilter(field_name='created_by')
+    min_amount = django_filters.NumberFilter(field_name='total_amount', lookup_expr='gte')
+    max_amount = django_filters.NumberFilter(field_name='total_amount', lookup_expr='lte')
 
     class Meta:
         model = Sale
-        fields = ['start_date', 'end_date']
\ No newline at end of file
+        fields = ['start_date', 'end_date', 'buyer_name', 'buyer', 'product', 'created_by', 'min_amount', 'max_amount']
+
+    def filter_buyer_name(self, queryset, name, value):
+        prefix = value.lower()
+        # Диапазон [prefix, следующая строка) читается по индексу (company, buyer_name_lower);
+        # startswith (LIKE) сам по себе индекс в SQLite не использует
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return queryset.filter(
+            buyer_name_lower__gte=prefix,
+            buyer_name_lower__lt=upper,
+            buyer_name_lower__startswith=prefix
+        )
+
+    def filter_product(self, queryset, name, value):
+        # Фильтр работает и для архива: берем модель позиций того же queryset
+        lines = queryset.model._meta.get_field('product_sales').related_model
+        return queryset.filter(
+            Exists(lines.objects.filter(sale=OuterRef('pk'), product_id=value))
+        )
@@ -0,0 +1,126 @@
+import hashlib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from drf_spectacular.utils import OpenApiParameter
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+from .sharding import current_shard
+
+POLL_INTERVAL = 0.1
+
+IDEMPOTENCY_KEY_PARAMETER = OpenApiParameter(
+    name='Idempotency-Key',
+    location=OpenApiParameter.HEADER,
+    required=False,
+    type=str,
+    description='Ключ идемпотентности: повтор запроса с тем же ключом вернет сохраненный ответ'
+)
+
+
+class IdempotentCreateMixin:
+    """
+    Поддержка заголовка Idempotency-Key для POST.
+
+    Первый запрос с ключом занимает запись (company, key) и сохраняет в нее
+    ответ в той же транзакции, что и сам документ: документ без сохраненного
+    ответа не фиксируется. Повтор возвращает сохраненный ответ одним запросом
+    по индексу, а параллельный дубликат ждет, пока первый запрос завершится.
+    Занятый ключ не перехватывается и после IDEMPOTENCY_LOCK_TIMEOUT: повтор
+    получает 409, пока зависшую запись не удалит purge_idempotency_keys.
+    """
+    idempotency_header = 'Idempotency-Key'
+
+    def post(self, request, *args, **kwargs):
+        key = request.headers.get(self.idempotency_header)
+        if not key:
+            return super().post(request, *args, **kwargs)
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response(
+                {'detail': 'Слишком длинный Idempotency-Key'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        request_hash = hashlib.sha256(request.path.encode() + b'\n' + request.body).hexdigest()
+        record, created = self._acquire(request.user.company_id, key, request_hash)
+        if not created:
+            return self._replay(record, request_hash)
+
+        using = current_shard()
+        try:
+            with transaction.atomic(using=using):
+                response = super().post(request, *args, **kwargs)
+                if response.status_code < 500 and not self._complete(record, response):
+                    # Запись удалили как зависшую, и повтор мог уже выполниться:
+                    # документ откатывается вместе с ответом
+                    transaction.set_rollback(True, using=using)
+                    return Response(
+                        {'detail': 'Idempotency-Key истек до завершения запроса, документ не проведен'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+        except Exception:
+            record.delete()
+            raise
+
+        if response.status_code >= 500:
+            # Ошибку сервера можно повторить с тем же ключом
+            record.delete()
+        return response
+
+    def _complete(self, record, response):
+        """Сохраняет ответ в запись, если она все еще занята этим запросом."""
+        return IdempotencyKey.objects.filter(pk=record.pk, status_code__isnull=True).update(
+            status_code=response.status_code,
+            response_body=response.data,
+            expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+        )
+
+    def _acquire(self, company_id, key, request_hash):
+        deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            record = IdempotencyKey.objects.filter(company_id=company_id, key=key).first()
+            if record is None:
+                try:
+                    with transaction.atomic(using=current_shard()):
+                        # Пока запрос выполняется, запись живет IDEMPOTENCY_LOCK_TIMEOUT,
+                        # чтобы ключ упавшего процесса не блокировался на весь TTL
+                        return IdempotencyKey.objects.create(
+                            company_id=company_id,
+                            key=key,
+                            request_hash=request_hash,
+                            expires_at=timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+                        ), True
+                except IntegrityError:
+                    continue
+
+            if record.status_code is not None and record.expires_at <= timezone.now():
+                # Истекший ответ: ключ можно использовать заново. Занятый ключ
+                # не перехватывается - запрос мог уже провести документ
+                record.delete()
+                continue
+            if record.status_code is not None or time.monotonic() >= deadline \
+                    or record.expires_at <= timezone.now():
+                return record, False
+            time.sleep(POLL_INTERVAL)
+
+    def _replay(self, record, request_hash):
+        if record.request_hash != request_hash:
+            return Response(
+                {'detail': 'Idempotency-Key уже использован для другого запроса'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        if record.status_code is None:
+            return Response(
+                {'detail': 'Запрос с этим Idempotency-Key еще выполняется'},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(
+            record.response_body,
+            status=record.status_code,
+            headers={'Idempotent-Replayed': 'true'}
+        )
@@ -0,0 +1,221 @@
+"""
+Файловый кэш PDF-накладных.
+
+Имя файла содержит id поставки и хэш всего, что попадает в накладную
+(поставщик, дата, позиции), поэтому изменение позиций само дает новый
+файл, а устаревшие файлы удаляются сигналом на SupplyProduct и при записи
+файла с новым хэшем (например, после переименования поставщика или
+товара). Хэш же служит ETag ответа.
+"""
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.db.models import Prefetch
+
+from .models import Supply, SupplyProduct
+from .utils import generate_supply_pdf
+
+# Увеличить при изменении макета накладной, чтобы старые файлы не отдавались
+INVOICE_LAYOUT_VERSION = 2
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def invoice_lines(supply):
+    return list(
+        supply.supply_products.select_related('product').order_by('id')
+    )
+
+
+def invoice_digest(supply, lines):
+    digest = hashlib.sha256()
+    parts = [
+        INVOICE_LAYOUT_VERSION,
+        supply.id,
+        supply.supplier.name if supply.supplier else '',
+        supply.created_at.isoformat(),
+    ]
+    for line in lines:
+        parts += [line.id, line.product.title, line.quantity, line.purchase_price]
+    for part in parts:
+        digest.update(str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def _supply_dir(supply_id):
+    # Не больше тысячи поставок в одном каталоге
+    return settings.INVOICE_CACHE_DIR / str(supply_id // 1000)
+
+
+def invoice_path(supply_id, digest):
+    return _supply_dir(supply_id) / f'{supply_id}-{digest[:32]}.pdf'
+
+
+def render_invoice(supply, lines):
+    return generate_supply_pdf(supply, lines).getvalue()
+
+
+def store_invoice(path, content):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Пишем во временный файл и переименовываем: параллельный запрос
+    # никогда не увидит недописанный PDF
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    # Версии накладной с прежним хэшем больше не понадобятся
+    supply_id = path.name.split('-', 1)[0]
+    for stale in path.parent.glob(f'{supply_id}-*.pdf'):
+        if stale != path:
+            stale.unlink(missing_ok=True)
+
+
+def invoice_file(supply, lines=None, digest=None):
+    """
+    Путь к PDF накладной и ее хэш. PDF генерируется, только если его еще нет.
+    Уже прочитанные позиции и посчитанный хэш можно передать.
+    """
+    if lines is None:
+        lines = invoice_lines(supply)
+    if digest is None:
+        digest = invoice_digest(supply, lines)
+    path = invoice_path(supply.id, digest)
+    if not path.exists():
+        store_invoice(path, render_invoice(supply, lines))
+    return path, digest
+
+
+def invalidate_invoice(supply_id):
+    """Удаляет все закэшированные версии накладной поставки."""
+    directory = _supply_dir(supply_id)
+    if directory.exists():
+        for path in directory.glob(f'{supply_id}-*.pdf'):
+            path.unlink(missing_ok=True)
+
+
+def render_pool():
+    """
+    Общий на процесс пул рендеринга из INVOICE_EXPORT_WORKERS процессов.
+    Создается при первой выгрузке через spawn: fork из многопоточного
+    веб-воркера может унаследовать захваченные блокировки. Параллельные
+    выгрузки делят этот пул, и число процессов не растет с их количеством.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.INVOICE_EXPORT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                # Не функция этого модуля: ее импорт в новом процессе
+                # загрузил бы модели до настройки Django
+                initializer=django.setup
+            )
+        return _executor
+
+
+def _reset_render_pool(executor):
+    # Упавший процесс ломает пул целиком: следующая выгрузка создаст новый
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+class ZipStream:
+    """Приемник для ZipFile без seek: записанное забирается порциями через pop()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _supplies(supply_ids, using):
+    return Supply.objects.using(using).filter(id__in=supply_ids).select_related('supplier').prefetch_related(
+        Prefetch('supply_products', queryset=SupplyProduct.objects.select_related('product').order_by('id'))
+    )
+
+
+def _document(supply_id, path, future, supply, lines):
+    if future is not None:
+        content = future.result()
+        store_invoice(path, content)
+        return supply_id, content
+    try:
+        return supply_id, path.read_bytes()
+    except FileNotFoundError:
+        # Файл успели удалить после изменения позиций
+        return supply_id, render_invoice(supply, lines)
+
+
+def invoice_documents(supply_ids, workers, using=None):
+    """
+    (id поставки, PDF) по возрастанию id. Готовые PDF читаются из кэша,
+    недостающие рендерятся в общем пуле процессов (render_pool), если
+    workers > 1. В работе не больше 2 * workers документов, поэтому память
+    не растет с размером выгрузки.
+    """
+    window = max(workers, 1) * 2
+    executor = render_pool() if workers > 1 else None
+    pending = deque()
+    try:
+        for start in range(0, len(supply_ids), window):
+            for supply in sorted(_supplies(supply_ids[start:start + window], using), key=lambda s: s.id):
+                lines = list(supply.supply_products.all())
+                path = invoice_path(supply.id, invoice_digest(supply, lines))
+                future = None
+                if path.exists():
+                    pass
+                elif executor is not None:
+                    future = executor.submit(render_invoice, supply, lines)
+                else:
+                    store_invoice(path, render_invoice(supply, lines))
+                pending.append((supply.id, path, future, supply, lines))
+            while len(pending) > window:
+                yield _document(*pending.popleft())
+        while pending:
+            yield _document(*pending.popleft())
+    except BrokenProcessPool:
+        _reset_render_pool(executor)
+        raise
+    finally:
+        # Пул общий: отменяются только еще не начатые документы этой выгрузки
+        for _, _, future, _, _ in pending:
+            if future is not None:
+                future.cancel()
+
+
+def invoice_zip(supply_ids, workers, using=None):
+    """ZIP с накладными шарда using, отдаваемый по мере готовности документов."""
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for supply_id, content in invoice_documents(supply_ids, workers, using):
+            archive.writestr(f'supply_{supply_id}.pdf', content)
+            yield stream.pop()
+    yield stream.pop()
@@ -0,0 +1,158 @@
+"""
+KPI по всем компаниям платформы: выручка и прибыль за период,
+товары в наличии и стоимость остатков по закупочной цене.
+
+Компании каждого шарда делятся на диапазоны id, каждый диапазон
+считается сгруппированными запросами (по несколько на диапазон, а не на
+компанию) в отдельном процессе со своим соединением с БД.
+"""
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+import django
+from django.apps import apps
+from django.db import connections
+from django.db.models import Count, Sum
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import (Company, Product, StorageValuation, Sale, ProductSale, ArchivedSale, ArchivedProductSale,
+                     PRODUCT_SALE_PROFIT)
+from .sharding import current_shard, shard_aliases, use_shard
+
+KPI_FIELDS = ('revenue', 'profit', 'active_products', 'stock_value')
+
+
+def period_bounds(date_from=None, date_to=None):
+    """
+    Границы периода из строк YYYY-MM-DD: начало первого дня и начало
+    дня после последнего. Неверная дата - ValueError.
+    """
+    bounds = []
+    for value, shift in ((date_from, 0), (date_to, 1)):
+        if not value:
+            bounds.append(None)
+            continue
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(value)
+        bounds.append(timezone.make_aware(datetime.combine(date + timedelta(days=shift), time.min)))
+    return tuple(bounds)
+
+
+def company_id_ranges(ranges, alias=None):
+    """
+    Делит компании шарда alias (по умолчанию текущего) на не более чем
+    ranges диапазонов (first_id, last_id) поровну по числу компаний.
+    """
+    ids = list(
+        Company.objects.filter(shard=alias or current_shard()).order_by('id').values_list('id', flat=True)
+    )
+    if not ids:
+        return []
+    size = -(-len(ids) // max(ranges, 1))
+    return [(chunk[0], chunk[-1]) for chunk in (ids[i:i + size] for i in range(0, len(ids), size))]
+
+
+def range_kpis(first_id, last_id, start=None, end=None):
+    """KPI компаний текущего шарда с id в [first_id, last_id] за период [start, end): {company_id: {...}}."""
+    period = {}
+    if start:
+        period['sale_date__gte'] = start
+    if end:
+        period['sale_date__lt'] = end
+
+    # Компании, созданные после чтения списка, пропускаются до следующего расчета
+    companies = Company.objects.filter(id__gte=first_id, id__lte=last_id, shard=current_shard())
+    result = {
+        company_id: {'company_id': company_id, 'title': title,
+                     'revenue': Decimal(0), 'profit': Decimal(0),
+                     'active_products': 0, 'stock_value': Decimal(0)}
+        for company_id, title in companies.values_list('id', 'title')
+    }
+
+    # Горячие и архивные продажи складываются
+    for sales, product_sales in ((Sale, ProductSale), (ArchivedSale, ArchivedProductSale)):
+        rows = sales.objects.filter(
+            company__gte=first_id, company__lte=last_id, **period
+        ).values('company_id').annotate(revenue=Sum('total_amount')).order_by()
+        for row in rows:
+            if row['company_id'] in result:
+                result[row['company_id']]['revenue'] += row['revenue'] or 0
+
+        rows = product_sales.objects.filter(
+            sale__company__gte=first_id, sale__company__lte=last_id,
+            **{f'sale__{key}': value for key, value in period.items()}
+        ).values('sale__company_id').annotate(profit=Sum(PRODUCT_SALE_PROFIT)).order_by()
+        for row in rows:
+            if row['sale__company_id'] in result:
+                result[row['sale__company_id']]['profit'] += row['profit'] or 0
+
+    rows = Product.objects.filter(
+        company__gte=first_id, company__lte=last_id, quantity__gt=0
+    ).values('company_id').annotate(active_products=Count('id')).order_by()
+    for row in rows:
+        if row['company_id'] in result:
+            result[row['company_id']]['active_products'] = row['active_products']
+
+    # Стоимость остатков берется из счетчиков складов, а не суммой по товарам
+    rows = StorageValuation.objects.filter(
+        storage__company__gte=first_id, storage__company__lte=last_id
+    ).values('storage__company_id').annotate(stock_value=Sum('purchase_value')).order_by()
+    for row in rows:
+        if row['storage__company_id'] in result:
+            result[row['storage__company_id']]['stock_value'] = row['stock_value'] or 0
+
+    return result
+
+
+def _init_worker():
+    # При spawn/forkserver Django в процессе еще не настроен
+    if not apps.ready:
+        django.setup()
+
+
+def _range_kpis_in_shard(alias, *args):
+    with use_shard(alias):
+        return range_kpis(*args)
+
+
+def _range_kpis_in_worker(args):
+    try:
+        return _range_kpis_in_shard(*args)
+    finally:
+        connections.close_all()
+
+
+def fleet_kpis(start=None, end=None, workers=4, ranges=None):
+    """
+    KPI всех компаний, отсортированные по id, и итог по платформе.
+    При workers <= 1 или БД в памяти все считается в текущем процессе.
+    """
+    tasks = [
+        (alias, first_id, last_id, start, end)
+        for alias in shard_aliases()
+        for first_id, last_id in company_id_ranges(ranges or workers * 4, alias)
+    ]
+
+    in_memory = any(
+        connections[alias].vendor == 'sqlite' and connections[alias].is_in_memory_db()
+        for alias in shard_aliases()
+    )
+    if workers <= 1 or len(tasks) <= 1 or in_memory:
+        parts = [_range_kpis_in_shard(*task) for task in tasks]
+    else:
+        # Дочерние процессы не должны унаследовать открытые соединения
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            parts = list(executor.map(_range_kpis_in_worker, tasks))
+
+    companies = [kpis for part in parts for kpis in part.values()]
+    companies.sort(key=lambda kpis: kpis['company_id'])
+    totals = defaultdict(int)
+    for kpis in companies:
+        for field in KPI_FIELDS:
+            totals[field] += kpis[field]
+    return companies, {field: totals[field] for field in KPI_FIELDS}
@@ -0,0 +1,180 @@
+"""
+Генератор нагрузки для проверки конкуренции за остатки товаров.
+
+Потоки (и при необходимости процессы) отправляют на работающий сервер
+продажи, поставки и запросы списков. Часть продаж и поставок идет
+в "горячие" товары, чтобы воспроизвести конкуренцию за одну строку
+Product. По итогам считаются пропускная способность, задержки,
+ошибки блокировок и сходимость остатков.
+"""
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+LIST_PATHS = ('sales/', 'products/', 'supplies/')
+LOCK_MARKERS = (b'database is locked', b'database table is locked', b'lock timeout', b'deadlock')
+
+
+class Api:
+    def __init__(self, base_url, token, timeout):
+        self.base_url = base_url.rstrip('/') + '/api/'
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, method, path, body=None):
+        """Возвращает (статус, тело ответа). Сетевые ошибки - статус 0."""
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+        request = urllib.request.Request(
+            self.base_url + path,
+            data=json.dumps(body).encode() if body is not None else None,
+            headers=headers,
+            method=method
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as exc:
+            return exc.code, exc.read()
+        except (urllib.error.URLError, OSError) as exc:
+            return 0, str(exc).encode()
+
+    def json(self, path):
+        status, body = self.request('GET', path)
+        if status != 200:
+            raise RuntimeError(f'GET {path}: {status} {body[:200]!r}')
+        return json.loads(body)
+
+    def all_pages(self, path):
+        data = self.json(path)
+        if isinstance(data, list):
+            return data
+        results = data['results']
+        page = 1
+        while data.get('next'):
+            page += 1
+            data = self.json(f'{path}?page={page}')
+            results += data['results']
+        return results
+
+
+def login(base_url, email, password, timeout=10):
+    status, body = Api(base_url, None, timeout).request(
+        'POST', 'auth/login/', {'email': email, 'password': password}
+    )
+    if status != 200:
+        raise RuntimeError(f'Не удалось войти: {status} {body[:200]!r}')
+    return json.loads(body)['access']
+
+
+def stock(api):
+    return {product['id']: product['quantity'] for product in api.all_pages('companies/products/')}
+
+
+def new_stats():
+    return {
+        'latencies': defaultdict(list),
+        'statuses': defaultdict(Counter),
+        'lock_errors': 0,
+        'sold': Counter(),
+        'supplied': Counter(),
+    }
+
+
+def merge_stats(target, source):
+    for op, values in source['latencies'].items():
+        target['latencies'][op].extend(values)
+    for op, statuses in source['statuses'].items():
+        target['statuses'][op].update(statuses)
+    target['lock_errors'] += source['lock_errors']
+    target['sold'].update(source['sold'])
+    target['supplied'].update(source['supplied'])
+    return target
+
+
+def run_threads(config, seed):
+    """Нагрузка из одного процесса: config['concurrency'] потоков до дедлайна."""
+    api = Api(config['base_url'], config['token'], config['timeout'])
+    deadline = time.monotonic() + config['duration']
+    products = config['products']
+    hot = products[:config['hot_products']]
+    ops, weights = zip(*config['mix'].items())
+    lock = threading.Lock()
+    stats = new_stats()
+
+    def pick_product(rng):
+        if hot and rng.random() < config['hot_fraction']:
+            return rng.choice(hot)
+        return rng.choice(products)
+
+    def worker(rng):
+        local = new_stats()
+        while time.monotonic() < deadline:
+            op = rng.choices(ops, weights)[0]
+            quantity = config['quantity']
+            if op == 'sale':
+                product = pick_product(rng)
+                method, path, body = 'POST', 'companies/sales/create/', {
+                    'buyer_name': 'load-test',
+                    'product_sales': [{'product_id': product, 'quantity': quantity}],
+                }
+            elif op == 'supply':
+                product = pick_product(rng)
+                method, path, body = 'POST', 'companies/supplies/create/', {
+                    'storage_id': config['storage'],
+                    'products': [{'product_id': product, 'quantity': quantity}],
+                }
+            else:
+                method, path, body = 'GET', 'companies/' + rng.choice(LIST_PATHS), None
+
+            started = time.perf_counter()
+            status, content = api.request(method, path, body)
+            local['latencies'][op].append(time.perf_counter() - started)
+            local['statuses'][op][status] += 1
+
+            if status == 201 and op == 'sale':
+                local['sold'][product] += quantity
+            elif status == 201 and op == 'supply':
+                local['supplied'][product] += quantity
+            elif status >= 500 and any(marker in content.lower() for marker in LOCK_MARKERS):
+                local['lock_errors'] += 1
+
+        with lock:
+            merge_stats(stats, local)
+
+    threads = [
+        threading.Thread(target=worker, args=(random.Random(seed * 1000 + i),))
+        for i in range(config['concurrency'])
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+def run(config, processes=1):
+    """Запускает нагрузку в processes процессах и возвращает (статистика, секунды)."""
+    started = time.perf_counter()
+    if processes <= 1:
+        stats = run_threads(config, seed=config['seed'])
+    else:
+        stats = new_stats()
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            for part in executor.map(run_threads, [config] * processes,
+                                     [config['seed'] + i for i in range(processes)]):
+                merge_stats(stats, part)
+    return stats, time.perf_counter() - started
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
@@ -0,0 +1,30 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from companies.archive import archive_sales
+from companies.sharding import shard_aliases, use_shard
+
+
+class Command(BaseCommand):
+    help = 'Переносит продажи закрытых периодов в архивные таблицы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, help='Дата YYYY-MM-DD: архивируются продажи до нее')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Продаж в одной транзакции')
+
+    def handle(self, *args, **options):
+        before_date = parse_date(options['before'])
+        if before_date is None:
+            raise CommandError('Неверный формат даты. Используйте YYYY-MM-DD')
+        if before_date > timezone.localdate():
+            raise CommandError('Нельзя архивировать незакрытый период')
+
+        before = timezone.make_aware(datetime.combine(before_date, time.min))
+        moved = 0
+        for alias in shard_aliases():
+            with use_shard(alias):
+                moved += archive_sales(before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Перенесено в архив продаж: {moved}'))
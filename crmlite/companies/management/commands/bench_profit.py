@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Sum, F
+from django.test.utils import CaptureQueriesContext
+
+from companies.models import Company, Sale, ProductSale, PRODUCT_SALE_PROFIT
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает расчет прибыли через JOIN на Product и по снимку cost_price'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='ID компании (по умолчанию первая)')
+        parser.add_argument('--repeat', type=int, default=20, help='Количество повторов')
+
+    def handle(self, *args, **options):
+        company = Company.objects.filter(pk=options['company']).first() if options['company'] \
+            else Company.objects.order_by('id').first()
+        if company is None:
+            raise CommandError('Компания не найдена')
+
+        sales = Sale.objects.using(company.shard).filter(company=company)
+        variants = {
+            'join product': Sum(F('quantity') * (F('price') - F('product__purchase_price'))),
+            'cost_price snapshot': Sum(PRODUCT_SALE_PROFIT),
+        }
+
+        for name, expression in variants.items():
+            queryset = ProductSale.objects.using(company.shard).filter(sale__in=sales)
+            with CaptureQueriesContext(connections[company.shard]) as queries:
+                profit = queryset.aggregate(profit=expression)['profit']
+            has_join = '"companies_product"' in queries[0]['sql']
+
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                queryset.aggregate(profit=expression)
+            elapsed = (time.perf_counter() - started) / options['repeat']
+
+            self.stdout.write(
+                f'{name}: прибыль {profit}, {elapsed * 1000:.2f} ms/запрос, '
+                f'JOIN companies_product: {"да" if has_join else "нет"}'
+            )
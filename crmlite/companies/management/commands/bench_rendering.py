@@ -0,0 +1,74 @@
+import itertools
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+
+from companies.models import Company, Sale
+from companies.serializers import SaleSerializer
+
+try:
+    from crmlite.renderers import ORJSONRenderer
+except ImportError:
+    ORJSONRenderer = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает рендеринг JSON и размер сжатого ответа для страницы продаж'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='ID компании (по умолчанию первая)')
+        parser.add_argument('--size', type=int, default=1000, help='Продаж на странице')
+        parser.add_argument('--repeat', type=int, default=20, help='Количество повторов')
+
+    def handle(self, *args, **options):
+        company = Company.objects.filter(pk=options['company']).first() if options['company'] \
+            else Company.objects.order_by('id').first()
+        if company is None:
+            raise CommandError('Компания не найдена')
+
+        sales = list(
+            Sale.objects.using(company.shard).filter(company=company)
+            .prefetch_related('product_sales__product')
+            .order_by('-sale_date')[:options['size']]
+        )
+        if not sales:
+            raise CommandError('У компании нет продаж')
+        if len(sales) < options['size']:
+            # Продаж меньше размера страницы: повторяем имеющиеся
+            self.stdout.write(f'Продаж в БД {len(sales)}, страница дополнена повторами')
+            sales = list(itertools.islice(itertools.cycle(sales), options['size']))
+
+        # Полное представление с позициями, как при ?expand=product_sales
+        data = SaleSerializer(sales, many=True, context={'company_title': company.title}).data
+        self.stdout.write(f'Страница: {len(sales)} продаж')
+
+        renderers = {'json (stdlib)': JSONRenderer()}
+        if ORJSONRenderer is not None:
+            renderers['orjson'] = ORJSONRenderer()
+        else:
+            self.stdout.write('orjson не установлен, сравнение только со стандартным рендерером')
+
+        body = None
+        for name, renderer in renderers.items():
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                body = renderer.render(data)
+            elapsed = (time.perf_counter() - started) / options['repeat']
+            self.stdout.write(
+                f'{name}: {elapsed * 1000:.2f} ms/страница, '
+                f'{len(body) / elapsed / 2 ** 20:.1f} MB/s, {len(body)} байт'
+            )
+
+        self.stdout.write(f'gzip: {len(compress_string(body))} байт')
+        if brotli is not None:
+            self.stdout.write(f'brotli: {len(brotli.compress(body, quality=settings.BROTLI_QUALITY))} байт')
+        else:
+            self.stdout.write('brotli не установлен')
@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from companies.reports import PERIODS, build_sales_reports
+from companies.sharding import shard_aliases, use_shard
+
+MODES = {
+    'full': 'полный пересчет',
+    'incremental': 'только измененные периоды',
+    'resumed': 'продолжение прерванного запуска',
+}
+
+
+class Command(BaseCommand):
+    help = 'Строит SalesReport всех компаний за дни, недели, месяцы или годы (для запуска по расписанию)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--period', choices=PERIODS, default='day', help='Вид периода')
+        parser.add_argument('--since', help='Дата YYYY-MM-DD: отчеты с периода, в который она попадает')
+        parser.add_argument('--workers', type=int, default=settings.SALES_REPORT_WORKERS, help='Количество процессов')
+        parser.add_argument('--ranges', type=int, help='Количество диапазонов id компаний (по умолчанию workers * 4)')
+        parser.add_argument('--full', action='store_true', help='Пересчитать все периоды, а не только измененные')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_date(options['since'])
+            if since is None:
+                raise CommandError('Неверный формат даты. Используйте YYYY-MM-DD')
+
+        # Прогресс у каждого шарда свой
+        for alias in shard_aliases():
+            started = time.perf_counter()
+            with use_shard(alias):
+                written, mode = build_sales_reports(
+                    options['period'], since,
+                    workers=options['workers'], ranges=options['ranges'], full=options['full']
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f'[{alias}] Отчетов ({options["period"]}) записано: {written}, {MODES[mode]}, '
+                f'{time.perf_counter() - started:.2f} с'
+            ))
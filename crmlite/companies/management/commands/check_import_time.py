@@ -0,0 +1,56 @@
+import os
+import re
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)$')
+LAZY_MODULES = ('matplotlib', 'reportlab')
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время импорта проекта через python -X importtime и проверяет бюджет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--budget-ms', type=int, default=600, help='Допустимое время импорта, мс')
+        parser.add_argument('--module', default=settings.ROOT_URLCONF, help='Модуль, который импортируется после django.setup()')
+        parser.add_argument('--top', type=int, default=10, help='Сколько самых медленных модулей показать')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'crmlite.settings'))
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c',
+             f'import django; django.setup(); import {options["module"]}'],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode != 0:
+            raise CommandError(result.stderr[-2000:])
+
+        total_us = 0
+        modules = []
+        for line in result.stderr.splitlines():
+            match = IMPORTTIME_LINE.match(line)
+            if not match:
+                continue
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append((int(cumulative_us), name))
+            # Верхний уровень выводится с одним пробелом отступа
+            if len(indent) == 1:
+                total_us += int(cumulative_us)
+
+        for cumulative_us, name in sorted(modules, reverse=True)[:options['top']]:
+            self.stdout.write(f'{cumulative_us / 1000:8.1f} ms  {name}')
+
+        total_ms = total_us / 1000
+        self.stdout.write(f'Итого: {total_ms:.1f} ms (бюджет {options["budget_ms"]} ms)')
+
+        loaded = sorted({name.split('.')[0] for _, name in modules} & set(LAZY_MODULES))
+        if loaded:
+            raise CommandError(f'При старте импортируются тяжелые модули: {", ".join(loaded)}')
+        if total_ms > options['budget_ms']:
+            raise CommandError(f'Время импорта {total_ms:.1f} ms превышает бюджет {options["budget_ms"]} ms')
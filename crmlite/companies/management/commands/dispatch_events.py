@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.outbox import dispatch
+from companies.sharding import shard_aliases, use_shard
+
+
+class Command(BaseCommand):
+    help = 'Доставляет события из outbox во внешние системы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Один проход и выход')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза между проходами, с')
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=4, help='Компаний обрабатывается параллельно')
+        parser.add_argument('--endpoint', action='append', dest='endpoints',
+                            help='Адрес получателя (по умолчанию OUTBOX_ENDPOINTS)')
+
+    def handle(self, *args, **options):
+        endpoints = options['endpoints'] or settings.OUTBOX_ENDPOINTS
+        if not endpoints:
+            raise CommandError('Не заданы адреса получателей: OUTBOX_ENDPOINTS или --endpoint')
+
+        while True:
+            delivered = 0
+            for alias in shard_aliases():
+                with use_shard(alias):
+                    delivered += dispatch(
+                        endpoints,
+                        batch_size=options['batch_size'],
+                        workers=options['workers'],
+                        timeout=settings.OUTBOX_REQUEST_TIMEOUT
+                    )
+            if delivered:
+                self.stdout.write(f'Доставлено событий: {delivered}')
+            if options['once']:
+                break
+            if not delivered:
+                time.sleep(options['interval'])
@@ -0,0 +1,36 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from companies.kpis import KPI_FIELDS, fleet_kpis, period_bounds
+
+
+class Command(BaseCommand):
+    help = 'Считает KPI всех компаний: выручку, прибыль, товары в наличии и стоимость остатков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='Дата от YYYY-MM-DD (по умолчанию 30 дней назад)')
+        parser.add_argument('--to', dest='date_to', help='Дата до включительно YYYY-MM-DD')
+        parser.add_argument('--workers', type=int, default=settings.FLEET_KPI_WORKERS, help='Количество процессов')
+        parser.add_argument('--ranges', type=int, help='Количество диапазонов id (по умолчанию workers * 4)')
+
+    def handle(self, *args, **options):
+        try:
+            start, end = period_bounds(options['date_from'], options['date_to'])
+        except ValueError:
+            raise CommandError('Неверный формат даты. Используйте YYYY-MM-DD')
+        if not options['date_from'] and not options['date_to']:
+            start = timezone.now() - timedelta(days=30)
+
+        started = time.perf_counter()
+        companies, totals = fleet_kpis(start, end, workers=options['workers'], ranges=options['ranges'])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write('\t'.join(('company_id', 'title') + KPI_FIELDS))
+        for kpis in companies:
+            self.stdout.write('\t'.join(str(kpis[field]) for field in ('company_id', 'title') + KPI_FIELDS))
+        self.stdout.write('\t'.join(('', 'ИТОГО') + tuple(str(totals[field]) for field in KPI_FIELDS)))
+        self.stdout.write(self.style.SUCCESS(f'Компаний: {len(companies)}, {elapsed:.2f} с'))
@@ -0,0 +1,118 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.loadtest import Api, login, percentile, run, stock
+
+
+def parse_mix(value):
+    try:
+        mix = {op: float(weight) for op, weight in (item.split('=') for item in value.split(','))}
+    except ValueError:
+        raise CommandError('Неверный формат --mix, пример: sale=70,supply=10,list=20')
+    if set(mix) - {'sale', 'supply', 'list'} or not any(mix.values()):
+        raise CommandError('--mix допускает операции sale, supply и list')
+    return mix
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест продаж, поставок и списков на работающем сервере'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Адрес сервера')
+        parser.add_argument('--token', help='JWT access-токен владельца компании')
+        parser.add_argument('--email', help='Email владельца (вместо --token)')
+        parser.add_argument('--password', help='Пароль владельца')
+        parser.add_argument('--duration', type=float, default=30, help='Длительность, секунд')
+        parser.add_argument('--concurrency', type=int, default=16, help='Потоков на процесс')
+        parser.add_argument('--processes', type=int, default=1, help='Количество процессов')
+        parser.add_argument('--mix', default='sale=70,supply=10,list=20', help='Доли операций')
+        parser.add_argument('--products', help='ID товаров через запятую (по умолчанию все товары компании)')
+        parser.add_argument('--hot-products', type=int, default=1, help='Сколько первых товаров считаются горячими')
+        parser.add_argument('--hot-fraction', type=float, default=0.8,
+                            help='Доля продаж и поставок, приходящаяся на горячие товары')
+        parser.add_argument('--quantity', type=int, default=1, help='Количество товара в одной операции')
+        parser.add_argument('--timeout', type=float, default=30, help='Таймаут запроса, секунд')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        token = options['token']
+        if not token:
+            if not options['email'] or not options['password']:
+                raise CommandError('Укажите --token или --email и --password')
+            token = login(options['url'], options['email'], options['password'])
+
+        api = Api(options['url'], token, options['timeout'])
+        mix = parse_mix(options['mix'])
+        try:
+            before = stock(api)
+            storages = api.all_pages('companies/storages/') if mix.get('supply') else []
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+
+        products = [int(pk) for pk in options['products'].split(',')] if options['products'] else sorted(before)
+        if not products or set(products) - set(before):
+            raise CommandError('Нет товаров для нагрузки или товар не принадлежит компании')
+        if mix.get('supply') and not storages:
+            raise CommandError('Для поставок нужен хотя бы один склад')
+
+        config = {
+            'base_url': options['url'],
+            'token': token,
+            'timeout': options['timeout'],
+            'duration': options['duration'],
+            'concurrency': options['concurrency'],
+            'mix': mix,
+            'products': products,
+            'hot_products': options['hot_products'],
+            'hot_fraction': options['hot_fraction'],
+            'quantity': options['quantity'],
+            'storage': storages[0]['id'] if storages else None,
+            'seed': options['seed'],
+        }
+        self.stdout.write(
+            f'{options["processes"]} x {options["concurrency"]} потоков, {options["duration"]} с, '
+            f'горячие товары: {products[:options["hot_products"]]} ({options["hot_fraction"]:.0%})'
+        )
+        stats, elapsed = run(config, processes=options['processes'])
+
+        total = 0
+        for op, latencies in sorted(stats['latencies'].items()):
+            statuses = stats['statuses'][op]
+            ok = sum(count for status, count in statuses.items() if 200 <= status < 300)
+            total += len(latencies)
+            self.stdout.write(
+                f'{op}: {len(latencies)} запросов, успешно {ok} ({ok / elapsed:.1f}/с), '
+                f'p50 {percentile(latencies, 0.5) * 1000:.1f} ms, p99 {percentile(latencies, 0.99) * 1000:.1f} ms, '
+                f'статусы {dict(sorted(statuses.items()))}'
+            )
+        self.stdout.write(f'Всего: {total} запросов за {elapsed:.1f} с ({total / elapsed:.1f}/с)')
+
+        server_errors = sum(
+            count for statuses in stats['statuses'].values()
+            for status, count in statuses.items() if status >= 500
+        )
+        network_errors = sum(statuses[0] for statuses in stats['statuses'].values())
+        self.stdout.write(
+            f'Ошибки 5xx: {server_errors}, из них блокировки БД: {stats["lock_errors"]}, '
+            f'сетевые ошибки и таймауты: {network_errors}'
+        )
+        if server_errors > stats['lock_errors']:
+            self.stdout.write('Причину остальных 5xx видно в логе сервера (или в ответах при DEBUG=True)')
+
+        # Остатки должны сойтись: было - продано + поставлено
+        after = stock(api)
+        mismatches = []
+        for product in products:
+            expected = before[product] - stats['sold'][product] + stats['supplied'][product]
+            if after.get(product) != expected:
+                mismatches.append(f'товар {product}: ожидалось {expected}, на сервере {after.get(product)}')
+        negative = [product for product in products if after.get(product, 0) < 0]
+
+        if mismatches or negative:
+            for line in mismatches:
+                self.stdout.write(self.style.ERROR(line))
+            if negative:
+                self.stdout.write(self.style.ERROR(f'Отрицательный остаток: {negative}'))
+            if network_errors:
+                self.stdout.write('Часть расхождений может объясняться запросами, прерванными по таймауту')
+        else:
+            self.stdout.write(self.style.SUCCESS('Остатки сходятся'))
@@ -0,0 +1,26 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.sharding import reserve_id_block, shard_aliases, use_shard
+
+
+class Command(BaseCommand):
+    help = 'Применяет миграции ко всем шардам компаний и выделяет каждому шарду свой блок id'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shard', help='Только этот шард (алиас из COMPANY_SHARDS)')
+
+    def handle(self, *args, **options):
+        aliases = shard_aliases()
+        if options['shard']:
+            if options['shard'] not in aliases:
+                raise CommandError(f'Неизвестный шард {options["shard"]}, есть: {", ".join(aliases)}')
+            aliases = [options['shard']]
+
+        for alias in aliases:
+            self.stdout.write(f'Шард {alias}')
+            # Миграции с данными пишут в шард через роутер
+            with use_shard(alias):
+                call_command('migrate', database=alias, verbosity=options['verbosity'])
+            reserve_id_block(alias)
+        self.stdout.write(self.style.SUCCESS(f'Шардов обновлено: {len(aliases)}'))
@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from companies.models import Company
+from companies.sharding import move_company, shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Переносит данные компании в другой шард'
+
+    def add_arguments(self, parser):
+        parser.add_argument('company', type=int, help='ID компании')
+        parser.add_argument('shard', help='Шард назначения (алиас из COMPANY_SHARDS)')
+
+    def handle(self, *args, **options):
+        company = Company.objects.filter(pk=options['company']).first()
+        if company is None:
+            raise CommandError('Компания не найдена')
+        if options['shard'] not in shard_aliases():
+            raise CommandError(f'Неизвестный шард {options["shard"]}, есть: {", ".join(shard_aliases())}')
+        if options['shard'] == company.shard:
+            raise CommandError(f'Компания уже в шарде {company.shard}')
+
+        source = company.shard
+        started = time.perf_counter()
+        try:
+            moved = move_company(company, options['shard'])
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+        except DatabaseError as exc:
+            # SQLite не дает писать по устаревшему снимку, если компанию меняли
+            raise CommandError(f'Перенос откатился: {exc}. Повторите, лучше в тихие часы')
+
+        for model, count in moved.items():
+            if count:
+                self.stdout.write(f'{model}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Компания {company.id} перенесена из {source} в {company.shard}: '
+            f'{sum(moved.values())} строк, {time.perf_counter() - started:.2f} с'
+        ))
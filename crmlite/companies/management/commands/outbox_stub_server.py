@@ -0,0 +1,35 @@
+import json
+import random
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Локальный приемник событий outbox для проверки dispatch_events'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8099)
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='Доля запросов, отвечающих 503')
+
+    def handle(self, *args, **options):
+        stdout = self.stdout
+        fail_rate = options['fail_rate']
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if random.random() < fail_rate:
+                    self.send_response(503)
+                    self.end_headers()
+                    return
+                for event in json.loads(body)['events']:
+                    stdout.write(f"{event['company_id']} #{event['id']} {event['type']}")
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.stdout.write(f'Принимаю события на http://127.0.0.1:{options["port"]}/')
+        ThreadingHTTPServer(('127.0.0.1', options['port']), Handler).serve_forever()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from companies.models import ShardPurge
+from companies.sharding import purge_deleted_companies
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из шардов данные удаленных компаний, которые не удалось удалить сразу'
+
+    def handle(self, *args, **options):
+        done = purge_deleted_companies()
+        self.stdout.write(self.style.SUCCESS(
+            f'Очищено компаний: {done}, осталось в очереди: {ShardPurge.objects.count()}'
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from companies.models import IdempotencyKey
+from companies.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Удаляет истекшие ключи идемпотентности'
+
+    def handle(self, *args, **options):
+        deleted = 0
+        for alias in shard_aliases():
+            deleted += IdempotencyKey.objects.using(alias).filter(expires_at__lte=timezone.now()).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Удалено ключей: {deleted}'))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from companies.models import QueryStat
+
+ORDERINGS = {
+    'total': F('total_ms').desc(),
+    'count': F('count').desc(),
+    'max': F('max_ms').desc(),
+    'avg': (F('total_ms') / F('count')).desc(),
+    'per_request': (F('count') * 1.0 / F('requests')).desc(),
+}
+
+# Запрос, повторяющийся столько раз за обращение, похож на N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+
+class Command(BaseCommand):
+    help = 'Показывает самые дорогие SQL-запросы по эндпоинтам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Сколько запросов показать')
+        parser.add_argument('--order', choices=ORDERINGS, default='total', help='Сортировка')
+        parser.add_argument('--url', help='Только указанное имя URL')
+        parser.add_argument('--reset', action='store_true', help='Очистить статистику после вывода')
+
+    def handle(self, *args, **options):
+        stats = QueryStat.objects.order_by(ORDERINGS[options['order']])
+        if options['url']:
+            stats = stats.filter(url_name=options['url'])
+
+        rows = list(stats[:options['limit']])
+        if not rows:
+            self.stdout.write('Статистика пуста')
+        for stat in rows:
+            per_request = stat.count / stat.requests if stat.requests else 0
+            self.stdout.write(
+                f'{stat.url_name}  count={stat.count}  per_request={per_request:.1f}  '
+                f'total={stat.total_ms:.1f}ms  avg={stat.total_ms / stat.count:.2f}ms  max={stat.max_ms:.1f}ms'
+            )
+            self.stdout.write(f'    {stat.view}')
+            self.stdout.write(f'    {stat.sql[:300]}')
+            if per_request >= N_PLUS_ONE_THRESHOLD:
+                self.stdout.write(self.style.WARNING(
+                    f'    Возможный N+1: {per_request:.1f} выполнений за обращение'
+                ))
+
+        if options['reset']:
+            QueryStat.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS('Статистика очищена'))
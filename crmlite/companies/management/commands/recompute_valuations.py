@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from companies.models import Storage
+from companies.sharding import shard_aliases, shard_for_company, use_shard
+from companies.valuation import recompute_valuations, valuation_mismatches
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает стоимость остатков складов по товарам и исправляет расхождения со счетчиками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, help='Только склады компании с этим id')
+        parser.add_argument('--verify', action='store_true',
+                            help='Только сверить счетчики, ничего не записывая (код выхода 1 при расхождениях)')
+
+    def handle(self, *args, **options):
+        aliases = [shard_for_company(options['company'])] if options['company'] else shard_aliases()
+        mismatches = []
+        for alias in aliases:
+            with use_shard(alias):
+                storages = Storage.objects.all()
+                if options['company']:
+                    storages = storages.filter(company_id=options['company'])
+
+                if options['verify']:
+                    mismatches += valuation_mismatches(storages)
+                else:
+                    mismatches += recompute_valuations(storages)
+
+        for storage_id, stored, computed in mismatches:
+            self.stdout.write(f'Склад {storage_id}: счетчики {stored}, пересчет {computed}')
+        if options['verify'] and mismatches:
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        action = 'Найдено' if options['verify'] else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(f'{action} расхождений: {len(mismatches)}'))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0006_salesreport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsale',
+            name='cost_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Закупочная цена на момент продажи'),
+        ),
+        migrations.AddField(
+            model_name='productsale',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Сумма по позиции'),
+        ),
+    ]
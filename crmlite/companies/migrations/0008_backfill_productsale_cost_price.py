@@ -0,0 +1,44 @@
+from django.db import migrations
+
+BATCH_SIZE = 1000
+
+
+def backfill_cost_price(apps, schema_editor):
+    """
+    Заполняет cost_price и total_amount у существующих позиций продаж.
+    Обрабатывает строки пачками по id, чтобы не держать всю таблицу в памяти.
+    """
+    ProductSale = apps.get_model('companies', 'ProductSale')
+    db_alias = schema_editor.connection.alias
+
+    last_id = 0
+    while True:
+        batch = list(
+            ProductSale.objects.using(db_alias)
+            .filter(id__gt=last_id)
+            .select_related('product')
+            .only('id', 'quantity', 'price', 'product__purchase_price')
+            .order_by('id')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+
+        for product_sale in batch:
+            product_sale.cost_price = product_sale.product.purchase_price
+            product_sale.total_amount = product_sale.price * product_sale.quantity
+
+        ProductSale.objects.using(db_alias).bulk_update(
+            batch, ['cost_price', 'total_amount']
+        )
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0007_productsale_cost_price_productsale_total_amount'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_cost_price, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+BATCH_SIZE = 1000
+
+
+def backfill_company(apps, schema_editor):
+    """
+    Копирует company_id склада в товары и поставки.
+    Обновляет строки диапазонами id, чтобы не блокировать таблицу целиком.
+    """
+    Storage = apps.get_model('companies', 'Storage')
+    db_alias = schema_editor.connection.alias
+    storage_company = Subquery(
+        Storage.objects.using(db_alias).filter(id=OuterRef('storage_id')).values('company_id')[:1]
+    )
+
+    for model_name in ('Product', 'Supply'):
+        model = apps.get_model('companies', model_name)
+        manager = model.objects.using(db_alias)
+        max_id = manager.aggregate(max_id=Max('id'))['max_id'] or 0
+
+        for start in range(0, max_id, BATCH_SIZE):
+            manager.filter(
+                id__gt=start,
+                id__lte=start + BATCH_SIZE
+            ).update(company_id=storage_company)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0008_backfill_productsale_cost_price'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='company',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='products', to='companies.company'),
+        ),
+        migrations.AddField(
+            model_name='supply',
+            name='company',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='supplies', to='companies.company'),
+        ),
+        migrations.RunPython(backfill_company, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='product',
+            name='company',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='products', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='supply',
+            name='company',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='supplies', to='companies.company'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['company', 'title'], name='companies_p_company_db9b87_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['company', 'storage'], name='companies_p_company_9b1409_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supply',
+            index=models.Index(fields=['company', '-created_at'], name='companies_s_company_04a69a_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0009_product_company_supply_company'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['company', '-sale_date'], name='companies_s_company_2ce7cd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['sale_date'], name='companies_s_sale_da_062921_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='supply',
+            index=models.Index(fields=['created_at'], name='companies_s_created_5a4393_idx'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:30
+
+import django.core.serializers.json
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0011_archivedsale_archivedproductsale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('request_hash', models.CharField(max_length=64)),
+                ('status_code', models.PositiveSmallIntegerField(null=True)),
+                ('response_body', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to='companies.company')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at'], name='companies_i_expires_e7de9f_idx')],
+                'constraints': [models.UniqueConstraint(fields=('company', 'key'), name='unique_company_idempotency_key')],
+            },
+        ),
+    ]
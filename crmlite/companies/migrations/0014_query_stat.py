@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0013_outboxevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url_name', models.CharField(max_length=200)),
+                ('fingerprint', models.CharField(max_length=40)),
+                ('sql', models.TextField()),
+                ('view', models.CharField(blank=True, max_length=255)),
+                ('requests', models.PositiveBigIntegerField(default=0)),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('total_ms', models.FloatField(default=0)),
+                ('max_ms', models.FloatField(default=0)),
+                ('last_seen', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('url_name', 'fingerprint'), name='unique_query_stat')],
+            },
+        ),
+    ]
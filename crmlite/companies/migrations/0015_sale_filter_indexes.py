@@ -0,0 +1,83 @@
+# Generated by Django 5.2.3 on 2026-10-19 18:49
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F, Func, Max
+from django.db.models.functions import Lower
+
+BATCH_SIZE = 10000
+
+
+def backfill_buyer_name_lower(apps, schema_editor):
+    """
+    Заполняет buyer_name_lower у существующих продаж, горячих и архивных,
+    одним UPDATE на каждый диапазон из BATCH_SIZE id. LOWER() в SQLite
+    не понимает кириллицу, поэтому там регистрируется str.lower.
+    """
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        connection.ensure_connection()
+        connection.connection.create_function('PY_LOWER', 1, str.lower, deterministic=True)
+        lower = Func(F('buyer_name'), function='PY_LOWER')
+    else:
+        lower = Lower('buyer_name')
+
+    for model_name in ('Sale', 'ArchivedSale'):
+        sales = apps.get_model('companies', model_name).objects.using(connection.alias)
+        last_id = sales.aggregate(last_id=Max('id'))['last_id'] or 0
+        for first_id in range(0, last_id, BATCH_SIZE):
+            sales.filter(id__gt=first_id, id__lte=first_id + BATCH_SIZE).update(buyer_name_lower=lower)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0014_query_stat'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedsale',
+            name='buyer_name_lower',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='buyer_name_lower',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(backfill_buyer_name_lower, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='archivedproductsale',
+            index=models.Index(fields=['product', 'sale'], name='companies_a_product_a0e438_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedsale',
+            index=models.Index(fields=['company', 'buyer_name_lower'], name='companies_a_company_efb72e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedsale',
+            index=models.Index(fields=['company', 'total_amount'], name='companies_a_company_6ed727_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedsale',
+            index=models.Index(fields=['created_by', '-sale_date'], name='companies_a_created_c0a2ab_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsale',
+            index=models.Index(fields=['product', 'sale'], name='companies_p_product_e9c46d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['company', 'buyer_name_lower'], name='companies_s_company_ecc3cb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['company', 'total_amount'], name='companies_s_company_74f44e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['created_by', '-sale_date'], name='companies_s_created_c5f907_idx'),
+        ),
+    ]
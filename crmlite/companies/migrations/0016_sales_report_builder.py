@@ -0,0 +1,64 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:05
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def drop_duplicate_reports(apps, schema_editor):
+    """Оставляет по одному (последнему) отчету на компанию, вид периода и дату."""
+    SalesReport = apps.get_model('companies', 'SalesReport')
+    reports = SalesReport.objects.using(schema_editor.connection.alias)
+    duplicates = reports.values('company_id', 'period', 'report_date').annotate(
+        count=Count('id'), last_id=Max('id')
+    ).filter(count__gt=1).order_by()
+    for row in duplicates:
+        reports.filter(
+            company_id=row['company_id'], period=row['period'], report_date=row['report_date']
+        ).exclude(id=row['last_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0015_sale_filter_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SalesReportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(max_length=10, unique=True)),
+                ('since', models.DateField(null=True)),
+                ('watermark', models.DateTimeField(null=True)),
+                ('run_since', models.DateField(null=True)),
+                ('run_after', models.DateTimeField(null=True)),
+                ('run_until', models.DateTimeField(null=True)),
+                ('last_company_id', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='StaleSalesPeriod',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('company_id', models.PositiveIntegerField()),
+                ('sale_date', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedsale',
+            index=models.Index(fields=['updated_at'], name='companies_a_updated_669703_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['updated_at'], name='companies_s_updated_577cc2_idx'),
+        ),
+        migrations.RunPython(drop_duplicate_reports, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='salesreport',
+            constraint=models.UniqueConstraint(fields=('company', 'period', 'report_date'), name='unique_sales_report'),
+        ),
+    ]
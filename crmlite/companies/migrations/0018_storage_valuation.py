@@ -0,0 +1,56 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:13
+
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+
+def fill_valuations(apps, schema_editor):
+    """Считает стоимость остатков всех существующих складов."""
+    db_alias = schema_editor.connection.alias
+    Storage = apps.get_model('companies', 'Storage')
+    Product = apps.get_model('companies', 'Product')
+    StorageValuation = apps.get_model('companies', 'StorageValuation')
+
+    cents = Decimal('0.01')
+    totals = {
+        row['storage_id']: row
+        for row in Product.objects.using(db_alias).values('storage_id').annotate(
+            quantity_total=Sum('quantity'),
+            purchase_value=Sum(F('quantity') * F('purchase_price')),
+            selling_value=Sum(F('quantity') * F('selling_price'))
+        ).order_by()
+    }
+    valuations = []
+    for storage_id in Storage.objects.using(db_alias).values_list('id', flat=True).iterator():
+        row = totals.get(storage_id, {})
+        valuations.append(StorageValuation(
+            storage_id=storage_id,
+            quantity=row.get('quantity_total') or 0,
+            purchase_value=Decimal(row.get('purchase_value') or 0).quantize(cents),
+            selling_value=Decimal(row.get('selling_value') or 0).quantize(cents)
+        ))
+    StorageValuation.objects.using(db_alias).bulk_create(valuations, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0017_stock_transfer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageValuation',
+            fields=[
+                ('storage', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='valuation', serialize=False, to='companies.storage')),
+                ('quantity', models.BigIntegerField(default=0)),
+                ('purchase_value', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('selling_value', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(fill_valuations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,108 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:18
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Func, Max, OuterRef, Subquery
+
+BATCH_SIZE = 10000
+
+
+def normalize_buyer_name(name):
+    return ' '.join(name.split()).lower()
+
+
+def backfill_buyers(apps, schema_editor):
+    """
+    Создает покупателей по buyer_name существующих продаж и проставляет
+    buyer. Продажи обходятся диапазонами из BATCH_SIZE id: покупатели
+    диапазона создаются одним bulk_create, а buyer проставляется одним
+    UPDATE с подзапросом по уникальному индексу (company, normalized_name).
+    Для SQLite нормализация регистрируется как функция; в остальных БД
+    buyer проставляется из Python.
+    """
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        connection.ensure_connection()
+        connection.connection.create_function('PY_NORMALIZE_BUYER', 1, normalize_buyer_name, deterministic=True)
+
+    buyers = apps.get_model('companies', 'Buyer').objects.using(connection.alias)
+    for model_name in ('Sale', 'ArchivedSale'):
+        sales = apps.get_model('companies', model_name).objects.using(connection.alias)
+        last_id = sales.aggregate(last_id=Max('id'))['last_id'] or 0
+        for first_id in range(0, last_id, BATCH_SIZE):
+            batch = sales.filter(id__gt=first_id, id__lte=first_id + BATCH_SIZE)
+            names = {}
+            for company_id, buyer_name in batch.values_list('company_id', 'buyer_name').distinct():
+                names.setdefault((company_id, normalize_buyer_name(buyer_name)), ' '.join(buyer_name.split()))
+            buyers.bulk_create(
+                [buyers.model(company_id=company_id, name=name, normalized_name=normalized)
+                 for (company_id, normalized), name in names.items()],
+                ignore_conflicts=True
+            )
+
+            if connection.vendor == 'sqlite':
+                batch.update(buyer_id=Subquery(buyers.filter(
+                    company_id=OuterRef('company_id'),
+                    normalized_name=Func(OuterRef('buyer_name'), function='PY_NORMALIZE_BUYER')
+                ).values('id')[:1]))
+                continue
+
+            buyer_ids = {
+                (company_id, normalized): buyer_id
+                for buyer_id, company_id, normalized in buyers.filter(
+                    company_id__in={company_id for company_id, _ in names},
+                    normalized_name__in={normalized for _, normalized in names}
+                ).values_list('id', 'company_id', 'normalized_name')
+            }
+            rows = list(batch.only('id', 'company_id', 'buyer_name'))
+            for sale in rows:
+                sale.buyer_id = buyer_ids[sale.company_id, normalize_buyer_name(sale.buyer_name)]
+            sales.bulk_update(rows, ['buyer'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0018_storage_valuation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Buyer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Имя покупателя')),
+                ('normalized_name', models.CharField(editable=False, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buyers', to='companies.company')),
+            ],
+            options={
+                'verbose_name': 'Buyer',
+            },
+        ),
+        migrations.AddField(
+            model_name='archivedsale',
+            name='buyer',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_sales', to='companies.buyer'),
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='buyer',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales', to='companies.buyer'),
+        ),
+        migrations.AddConstraint(
+            model_name='buyer',
+            constraint=models.UniqueConstraint(fields=('company', 'normalized_name'), name='unique_company_buyer'),
+        ),
+        migrations.RunPython(backfill_buyers, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='archivedsale',
+            index=models.Index(fields=['company', 'buyer', 'sale_date', 'total_amount'], name='companies_a_company_39f65d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['company', 'buyer', 'sale_date', 'total_amount'], name='companies_s_company_2d027c_idx'),
+        ),
+    ]
@@ -0,0 +1,97 @@
+# Generated by Django 5.2.3 on 2026-10-19 19:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0019_buyer'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='shard',
+            field=models.CharField(default='default', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='archivedsale',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='archived_sales', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='archivedsale',
+            name='created_by',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_sales', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='buyer',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='buyers', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='outboxevent',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='outbox_events', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='products', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='sale',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='sales', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='sale',
+            name='created_by',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='created_sales', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='salesreport',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='stocktransfer',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='stock_transfers', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='stocktransfer',
+            name='created_by',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='created_transfers', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='storage',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='storages', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='supplier',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='suppliers', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='supply',
+            name='company',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='supplies', to='companies.company'),
+        ),
+        migrations.AlterField(
+            model_name='supply',
+            name='created_by',
+            field=models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='created_supplies', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-19 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('companies', '0020_company_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='archived_before',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
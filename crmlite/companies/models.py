@@ -1,4 +1,6 @@
-from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, router, transaction
+from django.db.models import F, Q
 from django.core.validators import MinLengthValidator
 from django.utils import timezone
 
@@ -12,17 +14,32 @@ class Company(models.Model):
     )
     title = models.CharField(max_length=255)
     description = models.TextField(blank=True)
+    # База с данными компании (companies/sharding.py). Справочник компаний
+    # и пользователи живут в 'default', поэтому внешние ключи на них из
+    # шардируемых моделей объявлены с db_constraint=False. В 'default'
+    # ограничения создает ensure_reference_constraints после миграций
+    shard = models.CharField(max_length=64, editable=False)
+    # Граница архива продаж (companies/archive.py): продажи раньше нее
+    # перенесены в архив, период закрыт для новых и измененных продаж
+    archived_before = models.DateTimeField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        if not self.shard:
+            from .sharding import choose_shard  # Ленивый импорт
+            self.shard = choose_shard()
+        super().save(*args, **kwargs)
+
 
 class Storage(models.Model):
     address = models.CharField(max_length=255)
     company = models.ForeignKey(
         Company,
+        db_constraint=False,
         on_delete=models.CASCADE,
         related_name='storages'
     )
@@ -32,10 +49,17 @@ class Storage(models.Model):
     def __str__(self):
         return f"{self.company.title} = {self.address}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Товары и поставки хранят копию company_id склада
+        self.products.exclude(company_id=self.company_id).update(company_id=self.company_id)
+        self.supplies.exclude(company_id=self.company_id).update(company_id=self.company_id)
+
 
 class Supplier(models.Model):
     company = models.ForeignKey(
         Company,
+        db_constraint=False,
         on_delete=models.CASCADE,
         related_name='suppliers'
     )
@@ -52,6 +76,12 @@ class Supplier(models.Model):
 
 
 class Product(models.Model):
+    company = models.ForeignKey(
+        Company,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='products'
+    )
     storage = models.ForeignKey(
         Storage,
         on_delete=models.CASCADE,
@@ -65,11 +95,104 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', 'title']),
+            models.Index(fields=['company', 'storage']),
+        ]
+
     def __str__(self):
         return f'{self.title} (Остаток: {self.quantity})'
 
+    def valuation_state(self):
+        """(склад, количество, цена закупки, цена продажи) или None, если поля отложены."""
+        if any(field not in self.__dict__ for field in VALUATION_FIELDS):
+            return None
+        return tuple(getattr(self, field) for field in VALUATION_FIELDS)
+
+    def _stored_valuation_state(self, lock=False):
+        rows = Product.objects.using(self._state.db).filter(pk=self.pk)
+        if lock:
+            rows = rows.select_for_update()
+        return rows.values_list(*VALUATION_FIELDS).first()
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Product, instance=self)):
+            # Прежнее состояние читается из БД под блокировкой: объект в памяти
+            # мог устареть, а счетчик склада должен сдвинуться на реальную разницу
+            old = None if self._state.adding else self._stored_valuation_state(lock=True)
+            # Копия company_id склада: склад читается, только если товар новый или переехал
+            if old is None or old[0] != self.storage_id or self.company_id is None:
+                self.company_id = self.storage.company_id
+            super().save(*args, **kwargs)
+            new = self.valuation_state() or self._stored_valuation_state()
+            StorageValuation.apply(
+                ([valuation_change(old, -1)] if old else []) + [valuation_change(new, 1)]
+            )
+
+VALUATION_FIELDS = ('storage_id', 'quantity', 'purchase_price', 'selling_price')
+
+
+def valuation_change(state, sign):
+    """Изменение счетчиков склада при добавлении (sign=1) или снятии (-1) состояния товара."""
+    storage_id, quantity, purchase_price, selling_price = state
+    quantity *= sign
+    return storage_id, quantity, quantity * purchase_price, quantity * selling_price
+
+
+class StorageValuation(models.Model):
+    """
+    Стоимость остатков склада. Обновляется в транзакции каждого изменения
+    товара, пересчитывается командой recompute_valuations.
+    """
+    storage = models.OneToOneField(
+        Storage,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='valuation'
+    )
+    quantity = models.BigIntegerField(default=0)
+    purchase_value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    selling_value = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def apply(cls, changes, create=True):
+        """
+        Прибавляет изменения (storage_id, количество, стоимость закупки,
+        стоимость продажи) к счетчикам. Без create отсутствующие счетчики
+        не создаются: так удаляемый вместе с товарами склад не получит новую запись.
+        """
+        totals = {}
+        for storage_id, quantity, purchase_value, selling_value in changes:
+            total = totals.setdefault(storage_id, [0, 0, 0])
+            total[0] += quantity
+            total[1] += purchase_value
+            total[2] += selling_value
+
+        now = timezone.now()
+        for storage_id, (quantity, purchase_value, selling_value) in totals.items():
+            if not (quantity or purchase_value or selling_value):
+                continue
+            changes = {
+                'quantity': F('quantity') + quantity,
+                'purchase_value': F('purchase_value') + purchase_value,
+                'selling_value': F('selling_value') + selling_value,
+                'updated_at': now,
+            }
+            if cls.objects.filter(storage_id=storage_id).update(**changes) or not create:
+                continue
+            cls.objects.get_or_create(storage_id=storage_id)
+            cls.objects.filter(storage_id=storage_id).update(**changes)
+
 
 class Supply(models.Model):
+    company = models.ForeignKey(
+        Company,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='supplies'
+    )
     supplier = models.ForeignKey(
         Supplier,
         on_delete=models.SET_NULL,
@@ -83,6 +206,7 @@ class Supply(models.Model):
     )
     created_by = models.ForeignKey(
         'users.User',
+        db_constraint=False,
         on_delete=models.SET_NULL,
         null=True,
         related_name='created_supplies'
@@ -90,9 +214,19 @@ class Supply(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', '-created_at']),
+            models.Index(fields=['created_at']),
+        ]
+
     def __str__(self):
         return f"Поставка #{self.id} от {self.supplier.name if self.supplier else 'неизвестного поставщика'}"
 
+    def save(self, *args, **kwargs):
+        self.company_id = self.storage.company_id
+        super().save(*args, **kwargs)
+
 
 class SupplyProduct(models.Model):
     supply = models.ForeignKey(
@@ -112,9 +246,98 @@ class SupplyProduct(models.Model):
         return f"{self.product.title} x{self.quantity} в поставке #{self.supply.id}"
 
 
+class StockTransfer(models.Model):
+    """Перемещение товаров между складами одной компании."""
+    company = models.ForeignKey(
+        Company,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='stock_transfers'
+    )
+    source_storage = models.ForeignKey(
+        Storage,
+        on_delete=models.CASCADE,
+        related_name='outgoing_transfers'
+    )
+    destination_storage = models.ForeignKey(
+        Storage,
+        on_delete=models.CASCADE,
+        related_name='incoming_transfers'
+    )
+    created_by = models.ForeignKey(
+        'users.User',
+        db_constraint=False,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='created_transfers'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['company', '-created_at']),
+        ]
+
+    def __str__(self):
+        return f'Перемещение #{self.id}'
+
+
+class StockTransferProduct(models.Model):
+    transfer = models.ForeignKey(
+        StockTransfer,
+        on_delete=models.CASCADE,
+        related_name='transfer_products'
+    )
+    source_product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='outgoing_transfers'
+    )
+    destination_product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='incoming_transfers'
+    )
+    quantity = models.PositiveIntegerField()
+
+    def __str__(self):
+        return f"{self.source_product.title} x{self.quantity} в перемещении #{self.transfer_id}"
+
+
+def normalize_buyer_name(name):
+    """Имя покупателя без учета регистра и лишних пробелов."""
+    return ' '.join(name.split()).lower()
+
+
+class Buyer(models.Model):
+    company = models.ForeignKey(
+        Company,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='buyers'
+    )
+    name = models.CharField(max_length=255, verbose_name='Имя покупателя')
+    normalized_name = models.CharField(max_length=255, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Buyer'
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'normalized_name'], name='unique_company_buyer'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_buyer_name(self.name)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return self.name
+
+
 class Sale(models.Model):
     company = models.ForeignKey(
         Company,
+        db_constraint=False,
         on_delete=models.CASCADE,
         related_name='sales'
     )
@@ -122,6 +345,16 @@ class Sale(models.Model):
         max_length=255,
         verbose_name='Имя покупателя'
     )
+    # Имя в нижнем регистре для поиска по префиксу без учета регистра
+    buyer_name_lower = models.CharField(max_length=255, default='', editable=False)
+    # Покупатель по нормализованному имени, заполняется в save()
+    buyer = models.ForeignKey(
+        Buyer,
+        on_delete=models.SET_NULL,
+        null=True,
+        editable=False,
+        related_name='sales'
+    )
     sale_date = models.DateTimeField(
         default=timezone.now,
         verbose_name='Дата продажи'
@@ -135,6 +368,7 @@ class Sale(models.Model):
     )
     created_by = models.ForeignKey(
         'users.User',
+        db_constraint=False,
         on_delete=models.SET_NULL,
         null=True,
         related_name='created_sales',
@@ -143,6 +377,28 @@ class Sale(models.Model):
     class Meta:
         verbose_name = 'Sale'
         ordering =  ['-sale_date']
+        indexes = [
+            models.Index(fields=['company', '-sale_date']),
+            models.Index(fields=['sale_date']),
+            models.Index(fields=['company', 'buyer_name_lower']),
+            models.Index(fields=['company', 'total_amount']),
+            models.Index(fields=['created_by', '-sale_date']),
+            models.Index(fields=['updated_at']),
+            # Покрывающий индекс для аналитики по покупателям
+            models.Index(fields=['company', 'buyer', 'sale_date', 'total_amount']),
+        ]
+
+    def save(self, *args, **kwargs):
+        from .cache import get_buyer_id  # Ленивый импорт
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'buyer_name' in update_fields:
+            # lower() в Python: LOWER() в SQLite не понимает кириллицу
+            self.buyer_name_lower = self.buyer_name.lower()
+            self.buyer_id = get_buyer_id(self.company_id, self.buyer_name)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'buyer_name_lower', 'buyer'}
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f'Продажа #{self.id} {self.buyer_name} ({self.sale_date.strftime("%d.%m.%Y")})'
@@ -161,14 +417,115 @@ class ProductSale(models.Model):
     )
     quantity = models.PositiveIntegerField(null=False, default=0, verbose_name='Количество')
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    cost_price = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=0,
+        verbose_name='Закупочная цена на момент продажи'
+    )
+    total_amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+        verbose_name='Сумма по позиции'
+    )
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Для EXISTS-фильтра продаж по товару
+            models.Index(fields=['product', 'sale']),
+        ]
+
     def __str__(self):
         return f"{self.product.title} x{self.quantity}"
 
 
+class ArchivedSale(models.Model):
+    company = models.ForeignKey(
+        Company,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='archived_sales'
+    )
+    buyer_name = models.CharField(
+        max_length=255,
+        verbose_name='Имя покупателя'
+    )
+    buyer_name_lower = models.CharField(max_length=255, default='', editable=False)
+    buyer = models.ForeignKey(
+        Buyer,
+        on_delete=models.SET_NULL,
+        null=True,
+        editable=False,
+        related_name='archived_sales'
+    )
+    sale_date = models.DateTimeField(verbose_name='Дата продажи')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    total_amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=0,
+    )
+    created_by = models.ForeignKey(
+        'users.User',
+        db_constraint=False,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='archived_sales',
+    )
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Archived sale'
+        ordering = ['-sale_date']
+        indexes = [
+            models.Index(fields=['company', '-sale_date']),
+            models.Index(fields=['company', 'buyer_name_lower']),
+            models.Index(fields=['company', 'total_amount']),
+            models.Index(fields=['created_by', '-sale_date']),
+            models.Index(fields=['updated_at']),
+            models.Index(fields=['company', 'buyer', 'sale_date', 'total_amount']),
+        ]
+
+    def __str__(self):
+        return f'Архивная продажа #{self.id} {self.buyer_name} ({self.sale_date.strftime("%d.%m.%Y")})'
+
+
+class ArchivedProductSale(models.Model):
+    sale = models.ForeignKey(
+        ArchivedSale,
+        on_delete=models.CASCADE,
+        related_name='product_sales'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.PROTECT,
+        related_name='archived_sales'
+    )
+    quantity = models.PositiveIntegerField(default=0, verbose_name='Количество')
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    cost_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    total_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'sale']),
+        ]
+
+    def __str__(self):
+        return f"{self.product.title} x{self.quantity}"
+
+
+# Прибыль по позиции продажи считается только по полям ProductSale,
+# без JOIN на Product: цена закупки фиксируется в момент продажи.
+PRODUCT_SALE_PROFIT = F('total_amount') - F('quantity') * F('cost_price')
+
+
 class SalesReport(models.Model):
-    company = models.ForeignKey(Company, on_delete=models.CASCADE)
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, db_constraint=False)
     report_date = models.DateField()
     period = models.CharField(max_length=10, choices=[
         ('day', 'День'),
@@ -185,3 +542,117 @@ class SalesReport(models.Model):
         indexes = [
             models.Index(fields=['company', 'report_date']),
         ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['company', 'period', 'report_date'],
+                name='unique_sales_report'
+            ),
+        ]
+
+
+class SalesReportCheckpoint(models.Model):
+    """Прогресс build_sales_reports по одному виду периода."""
+    period = models.CharField(max_length=10, unique=True)
+    # Отчеты учитывают продажи с sale_date от since, измененные до watermark
+    since = models.DateField(null=True)
+    watermark = models.DateTimeField(null=True)
+    # Незавершенный запуск: окно изменений (run_after, run_until]
+    # и последняя обработанная компания
+    run_since = models.DateField(null=True)
+    run_after = models.DateTimeField(null=True)
+    run_until = models.DateTimeField(null=True)
+    last_company_id = models.PositiveIntegerField(default=0)
+
+
+class StaleSalesPeriod(models.Model):
+    """
+    Дата, из периода которой ушла продажа (дата изменена или продажа
+    удалена): по updated_at оставшихся продаж такой период не найти.
+    """
+    # Без внешнего ключа: запись не должна мешать каскадному удалению компании
+    company_id = models.PositiveIntegerField()
+    sale_date = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+
+class IdempotencyKey(models.Model):
+    company = models.ForeignKey(
+        Company,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys'
+    )
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response_body = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'key'], name='unique_company_idempotency_key'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+
+class OutboxEvent(models.Model):
+    company = models.ForeignKey(
+        Company,
+        db_constraint=False,
+        on_delete=models.CASCADE,
+        related_name='outbox_events'
+    )
+    event_type = models.CharField(max_length=50)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['company', 'id'],
+                condition=Q(dispatched_at__isnull=True),
+                name='outbox_pending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.event_type} #{self.id}'
+
+
+class ShardPurge(models.Model):
+    """Очередь удаления данных удаленной компании из ее шарда (в 'default')."""
+    company_id = models.BigIntegerField()
+    shard = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f'{self.shard}: компания {self.company_id}'
+
+
+class QueryStat(models.Model):
+    url_name = models.CharField(max_length=200)
+    fingerprint = models.CharField(max_length=40)
+    sql = models.TextField()
+    view = models.CharField(max_length=255, blank=True)
+    requests = models.PositiveBigIntegerField(default=0)
+    count = models.PositiveBigIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    last_seen = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['url_name', 'fingerprint'], name='unique_query_stat'),
+        ]
+
+    def __str__(self):
+        return f'{self.url_name}: {self.sql[:50]}'
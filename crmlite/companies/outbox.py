@@ -0,0 +1,139 @@
+"""
+Transactional outbox: события о продажах и поставках пишутся в OutboxEvent
+в той же транзакции, что и сам документ, а команда dispatch_events
+доставляет их пачками во внешние системы (ERP, склад).
+
+Доставка "как минимум один раз": получатель должен игнорировать
+повторно пришедшие события по их id.
+"""
+import json
+import logging
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Min
+from django.utils import timezone
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+
+def publish(company_id, event_type, payload):
+    """Добавляет событие в outbox. Вызывать внутри транзакции документа."""
+    return OutboxEvent.objects.create(
+        company_id=company_id,
+        event_type=event_type,
+        payload=payload
+    )
+
+
+def backoff(attempts):
+    return timedelta(seconds=min(
+        settings.OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1),
+        settings.OUTBOX_BACKOFF_MAX
+    ))
+
+
+def pending_batches(batch_size, limit=None):
+    """
+    Пачки неотправленных событий по компаниям, по одной пачке на компанию.
+
+    Берутся только компании, чье самое старое событие готово к отправке:
+    если оно ждет повтора, компания пропускается целиком, чтобы не нарушить
+    порядок ее событий. Пачку забирает один диспетчер: самому старому событию
+    сдвигается next_attempt_at на OUTBOX_CLAIM_TIMEOUT, и для остальных
+    диспетчеров компания выглядит ожидающей повтора, пока deliver не отметит
+    результат или не истечет срок.
+    """
+    now = timezone.now()
+    pending = OutboxEvent.objects.filter(dispatched_at__isnull=True)
+    heads = pending.filter(
+        id__in=pending.values('company_id').annotate(head=Min('id')).values('head'),
+        next_attempt_at__lte=now
+    ).order_by('id').values_list('id', 'company_id')
+    if limit:
+        heads = heads[:limit]
+
+    batches = []
+    claimed_until = now + timedelta(seconds=settings.OUTBOX_CLAIM_TIMEOUT)
+    for head_id, company_id in heads:
+        # Условный UPDATE: из параллельных диспетчеров компанию получит один
+        if not OutboxEvent.objects.filter(
+            id=head_id, dispatched_at__isnull=True, next_attempt_at__lte=now
+        ).update(next_attempt_at=claimed_until):
+            continue
+        batches.append(list(pending.filter(company_id=company_id, id__gte=head_id).order_by('id')[:batch_size]))
+    return batches
+
+
+def send(url, events, timeout):
+    body = json.dumps({
+        'events': [
+            {
+                'id': event.id,
+                'company_id': event.company_id,
+                'type': event.event_type,
+                'created_at': event.created_at,
+                'payload': event.payload,
+            }
+            for event in events
+        ]
+    }, cls=DjangoJSONEncoder).encode()
+    request = urllib.request.Request(
+        url,
+        data=body,
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        response.read()
+
+
+def deliver(events, endpoints, timeout):
+    """Отправляет пачку одной компании на все адреса и отмечает результат."""
+    # Поток пула не видит шард вызвавшего кода: пишем в базу, откуда прочитаны события
+    using = events[0]._state.db
+    try:
+        for url in endpoints:
+            send(url, events, timeout)
+    except Exception as exc:
+        now = timezone.now()
+        for event in events:
+            event.attempts += 1
+            event.next_attempt_at = now + backoff(event.attempts)
+            event.last_error = str(exc)[:1000]
+        OutboxEvent.objects.using(using).bulk_update(events, ['attempts', 'next_attempt_at', 'last_error'])
+        logger.warning('Не удалось доставить %s событий компании %s: %s',
+                       len(events), events[0].company_id, exc)
+        return 0
+
+    OutboxEvent.objects.using(using).filter(
+        id__in=[event.id for event in events]
+    ).update(dispatched_at=timezone.now())
+    return len(events)
+
+
+def dispatch(endpoints, batch_size, workers=4, timeout=5):
+    """
+    Один проход диспетчера по текущему шарду. Компании обрабатываются
+    параллельно, события одной компании уходят последовательно.
+    Возвращает количество доставленных событий.
+    """
+    batches = pending_batches(batch_size)
+    if not batches:
+        return 0
+
+    def deliver_in_thread(events):
+        try:
+            return deliver(events, endpoints, timeout)
+        finally:
+            # У каждого потока свои соединения с БД
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(deliver_in_thread, batches))
@@ -4,7 +4,7 @@ from .models import Company, Storage
 
 class IsCompanyEmployee(permissions.BasePermission):
     def has_permission(self, request, view):
-        return request.user.company is not None
+        return request.user.company_id is not None
 
 
 class IsCompanyOwner(permissions.BasePermission):
@@ -13,7 +13,7 @@ class IsCompanyOwner(permissions.BasePermission):
 
     def has_object_permission(self, request, view, obj):
         if isinstance(obj, Company):
-            return request.user.is_company_owner and request.user.company == obj
+            return request.user.is_company_owner and request.user.company_id == obj.id
         elif isinstance(obj, Storage):
-            return request.user.is_company_owner and request.user.company == obj.company
+            return request.user.is_company_owner and request.user.company_id == obj.company_id
         return False
\ No newline at end of file
@@ -0,0 +1,224 @@
+"""
+Построение SalesReport по всем компаниям: выручка и прибыль за день,
+неделю, месяц или год.
+
+Пересчитываются только периоды, в которых продажи менялись после
+прошлого запуска (по updated_at). Отчеты строятся по шардам, прогресс
+у каждого шарда свой. Компании шарда делятся на диапазоны id,
+агрегаты диапазона считаются в отдельном процессе, а записывает их
+текущий процесс в одной транзакции с отметкой о прогрессе, поэтому
+прерванный запуск продолжается со следующего диапазона.
+"""
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+from itertools import repeat
+
+import django
+from django.apps import apps
+from django.db import connections, transaction
+from django.db.models import DateField, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from .kpis import company_id_ranges
+from .models import (Sale, ProductSale, ArchivedSale, ArchivedProductSale, SalesReport,
+                     SalesReportCheckpoint, StaleSalesPeriod, PRODUCT_SALE_PROFIT)
+from .sharding import current_shard, use_shard
+
+PERIODS = ('day', 'week', 'month', 'year')
+SOURCES = ((Sale, ProductSale), (ArchivedSale, ArchivedProductSale))
+# Продажа получает updated_at до коммита своей транзакции. Изменения
+# последних минут оставляем следующему запуску, чтобы не пропустить их
+COMMIT_LAG = timedelta(minutes=5)
+
+
+def period_start(date, period):
+    """Первый день периода, в который попадает date."""
+    if period == 'week':
+        return date - timedelta(days=date.weekday())
+    if period == 'month':
+        return date.replace(day=1)
+    if period == 'year':
+        return date.replace(month=1, day=1)
+    return date
+
+
+def _bucket(field, period):
+    return Trunc(field, period, output_field=DateField())
+
+
+def _start_of(date):
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def mark_stale_period(company_id, sale_date):
+    """Отмечает, что продажа ушла из периода даты sale_date."""
+    StaleSalesPeriod.objects.create(company_id=company_id, sale_date=sale_date)
+
+
+def changed_periods(period, since, after, until):
+    """
+    {company_id: {начало периода}} для продаж, измененных в (after, until],
+    и периодов, из которых продажи ушли. Один запрос по индексу updated_at
+    на весь шард: с фильтром по диапазону компаний SQLite выбирает
+    индекс по company и читает все продажи.
+    """
+    sources = [sales.objects.filter(updated_at__gt=after, updated_at__lte=until) for sales, _ in SOURCES]
+    sources.append(StaleSalesPeriod.objects.filter(created_at__gt=after, created_at__lte=until))
+
+    periods = defaultdict(set)
+    for changed in sources:
+        if since:
+            changed = changed.filter(sale_date__gte=_start_of(since))
+        rows = changed.annotate(
+            bucket=_bucket('sale_date', period)
+        ).values_list('company_id', 'bucket').distinct().order_by()
+        for company_id, bucket in rows:
+            periods[company_id].add(bucket)
+    return periods
+
+
+def range_reports(first_id, last_id, period, since=None, changed=None):
+    """
+    Строки (company_id, report_date, total_sales, net_profit) компаний
+    с id в [first_id, last_id]: все периоды с since или, если передан
+    changed ({company_id: {начало периода}}), только измененные.
+    """
+    if changed is None:
+        scope = {'company__gte': first_id, 'company__lte': last_id}
+        start = _start_of(since) if since else None
+    else:
+        scope = {'company__in': sorted(changed)}
+        start = _start_of(min(min(buckets) for buckets in changed.values()))
+    if start:
+        scope['sale_date__gte'] = start
+    line_scope = {f'sale__{key}': value for key, value in scope.items()}
+
+    totals = defaultdict(Decimal)
+    profits = defaultdict(Decimal)
+
+    # Горячие и архивные продажи складываются
+    for sales, product_sales in SOURCES:
+        rows = sales.objects.filter(**scope).annotate(
+            bucket=_bucket('sale_date', period)
+        ).values('company_id', 'bucket').annotate(total=Sum('total_amount')).order_by()
+        for row in rows:
+            totals[row['company_id'], row['bucket']] += row['total'] or 0
+
+        rows = product_sales.objects.filter(**line_scope).annotate(
+            bucket=_bucket('sale__sale_date', period)
+        ).values('sale__company_id', 'bucket').annotate(profit=Sum(PRODUCT_SALE_PROFIT)).order_by()
+        for row in rows:
+            profits[row['sale__company_id'], row['bucket']] += row['profit'] or 0
+
+    if changed is None:
+        keys = sorted(totals)
+    else:
+        # Период, из которого ушли все продажи, перезаписывается нулями
+        keys = sorted((company_id, bucket) for company_id, buckets in changed.items() for bucket in buckets)
+    return [(company_id, bucket, totals[company_id, bucket], profits[company_id, bucket])
+            for company_id, bucket in keys]
+
+
+def save_reports(rows, period):
+    SalesReport.objects.bulk_create(
+        [
+            SalesReport(company_id=company_id, report_date=report_date, period=period,
+                        total_sales=total_sales, net_profit=net_profit)
+            for company_id, report_date, total_sales, net_profit in rows
+        ],
+        update_conflicts=True,
+        unique_fields=['company', 'period', 'report_date'],
+        update_fields=['total_sales', 'net_profit'],
+        batch_size=1000
+    )
+
+
+def _init_worker():
+    # При spawn/forkserver Django в процессе еще не настроен
+    if not apps.ready:
+        django.setup()
+
+
+def _range_reports_in_worker(alias, args):
+    try:
+        with use_shard(alias):
+            return range_reports(*args)
+    finally:
+        connections.close_all()
+
+
+def build_sales_reports(period, since=None, workers=4, ranges=None, full=False):
+    """
+    Пересчитывает SalesReport вида period в текущем шарде начиная с даты since.
+    Возвращает (записано отчетов, режим): 'full', 'incremental' или 'resumed'.
+    """
+    alias = current_shard()
+    since = period_start(since, period) if since else None
+    checkpoint, _ = SalesReportCheckpoint.objects.get_or_create(period=period)
+
+    if not full and checkpoint.run_until is not None and checkpoint.run_since == since:
+        mode = 'resumed'
+    else:
+        # Инкрементальный запуск возможен, только если прошлый покрыл весь запрошенный период
+        covered = checkpoint.watermark is not None and (
+            checkpoint.since is None or (since is not None and since >= checkpoint.since)
+        )
+        mode = 'incremental' if covered and not full else 'full'
+        checkpoint.run_since = since
+        checkpoint.run_after = checkpoint.watermark if mode == 'incremental' else None
+        checkpoint.run_until = timezone.now() - COMMIT_LAG
+        checkpoint.last_company_id = 0
+        checkpoint.save()
+
+    id_ranges = [
+        (max(first_id, checkpoint.last_company_id + 1), last_id)
+        for first_id, last_id in company_id_ranges(ranges or workers * 4)
+        if last_id > checkpoint.last_company_id
+    ]
+    if checkpoint.run_after is None:
+        tasks = [(first_id, last_id, period, since) for first_id, last_id in id_ranges]
+    else:
+        changed = changed_periods(period, since, checkpoint.run_after, checkpoint.run_until)
+        tasks = []
+        for first_id, last_id in id_ranges:
+            in_range = {company_id: buckets for company_id, buckets in changed.items()
+                        if first_id <= company_id <= last_id}
+            if in_range:
+                tasks.append((first_id, last_id, period, since, in_range))
+
+    written = 0
+
+    def save_range(task, rows):
+        nonlocal written
+        with transaction.atomic(using=alias):
+            save_reports(rows, period)
+            checkpoint.last_company_id = task[1]
+            checkpoint.save(update_fields=['last_company_id'])
+        written += len(rows)
+
+    in_memory = connections[alias].vendor == 'sqlite' and connections[alias].is_in_memory_db()
+    if workers <= 1 or len(tasks) <= 1 or in_memory:
+        for task in tasks:
+            save_range(task, range_reports(*task))
+    else:
+        # Дочерние процессы не должны унаследовать открытые соединения
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+            # map отдает результаты по порядку диапазонов, поэтому прогресс не перескакивает
+            for task, rows in zip(tasks, executor.map(_range_reports_in_worker, repeat(alias), tasks)):
+                save_range(task, rows)
+
+    checkpoint.since = since
+    checkpoint.watermark = checkpoint.run_until
+    checkpoint.run_since = checkpoint.run_after = checkpoint.run_until = None
+    checkpoint.last_company_id = 0
+    checkpoint.save()
+
+    # Отметки, которые уже учтены во всех видах отчетов, больше не нужны
+    watermarks = SalesReportCheckpoint.objects.values_list('watermark', flat=True)
+    if None not in watermarks:
+        StaleSalesPeriod.objects.filter(created_at__lte=min(watermarks)).delete()
+    return written, mode
@@ -1,7 +1,12 @@
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from rest_framework import serializers
-from .models import Company, Storage, Supplier, Product, SupplyProduct, Supply, Sale, ProductSale
+from drf_spectacular.utils import extend_schema_field
+from .models import (Company, Storage, Supplier, Product, SupplyProduct, Supply, Sale, ProductSale,
+                     StockTransfer, StockTransferProduct)
+from .cache import get_company, get_storages, get_suppliers
+from .employees import EMPLOYEES_BULK_MAX
+from .fieldsets import SparseFieldsetMixin
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -9,7 +14,7 @@ User = get_user_model()
 class CompanySerializer(serializers.ModelSerializer):
     class Meta:
         model = Company
-        fields = '__all__'
+        exclude = ('shard',)
         read_only_fields = ('created_at', 'updated_at')
 
 
@@ -27,11 +32,18 @@ class SupplierSerializer(serializers.ModelSerializer):
         read_only_fields = ('created_at', 'updated_at', 'company')
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    expanded_fields = {'storage': serializers.SerializerMethodField}
+
     class Meta:
         model = Product
         fields = '__all__'
-        read_only_fields = ('created_at', 'updated_at', 'quantity')
+        read_only_fields = ('created_at', 'updated_at', 'quantity', 'company')
+
+    # Используется только при ?expand=storage
+    def get_storage(self, obj):
+        cached = get_storages(obj.company_id).get(obj.storage_id)
+        return cached if cached is not None else StorageSerializer(obj.storage).data
 
 
 class SupplyCreateProductSerializer(serializers.Serializer):
@@ -83,15 +95,69 @@ class SupplyCreateSerializer(serializers.Serializer):
                 raise serializers.ValidationError("Количество должно быть положительным")
         return value
 
-class SupplySerializer(serializers.ModelSerializer):
+class SupplySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     products = SupplyProductSerializer(many=True, source='supply_products', read_only=True)
-    supplier = SupplierSerializer(read_only=True)
-    storage = StorageSerializer(read_only=True)
+    supplier = serializers.SerializerMethodField()
+    storage = serializers.SerializerMethodField()
+
+    collapsed_fields = {
+        'products': None,
+        'supplier': lambda: serializers.IntegerField(source='supplier_id', read_only=True, allow_null=True),
+        'storage': lambda: serializers.IntegerField(source='storage_id', read_only=True),
+    }
 
     class Meta:
         model = Supply
         fields = '__all__'
-        read_only_fields = ('created_at', 'updated_at', 'created_by')
+        read_only_fields = ('created_at', 'updated_at', 'created_by', 'company')
+
+    # Поставщик и склад берутся из кэша справочников вместо JOIN
+    @extend_schema_field(SupplierSerializer)
+    def get_supplier(self, obj):
+        if obj.supplier_id is None:
+            return None
+        cached = get_suppliers(obj.company_id).get(obj.supplier_id)
+        return cached if cached is not None else SupplierSerializer(obj.supplier).data
+
+    @extend_schema_field(StorageSerializer)
+    def get_storage(self, obj):
+        cached = get_storages(obj.company_id).get(obj.storage_id)
+        return cached if cached is not None else StorageSerializer(obj.storage).data
+
+
+class StockTransferCreateSerializer(serializers.Serializer):
+    source_storage_id = serializers.PrimaryKeyRelatedField(
+        queryset=Storage.objects.all(),
+        source='source_storage'
+    )
+    destination_storage_id = serializers.PrimaryKeyRelatedField(
+        queryset=Storage.objects.all(),
+        source='destination_storage'
+    )
+    products = SupplyCreateProductSerializer(
+        many=True,
+        allow_empty=False,
+        help_text='Товары склада-источника и количество'
+    )
+
+    def validate(self, data):
+        if data['source_storage'].id == data['destination_storage'].id:
+            raise serializers.ValidationError('Склад-источник и склад назначения совпадают')
+        return data
+
+
+class StockTransferProductSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockTransferProduct
+        fields = ('source_product', 'destination_product', 'quantity')
+
+
+class StockTransferSerializer(serializers.ModelSerializer):
+    products = StockTransferProductSerializer(many=True, source='transfer_products', read_only=True)
+
+    class Meta:
+        model = StockTransfer
+        fields = '__all__'
 
 
 class AddEmployeesSerializer(serializers.Serializer):
@@ -102,7 +168,7 @@ class AddEmployeesSerializer(serializers.Serializer):
         if not any([data.get('user_id'), data.get('email')]):
             raise serializers.ValidationError("Необходимо указать user_id или email")
 
-        user = self.get_user()
+        user = self.get_user(data)
 
         if user.is_company_owner:
             raise serializers.ValidationError('Нельзя прикрепить владельца другой компании')
@@ -111,11 +177,28 @@ class AddEmployeesSerializer(serializers.Serializer):
 
         return data
 
-    def get_user(self):
-        if self.validated_data.get('user_id'):
-            return get_object_or_404(User, id=self.validated_data['user_id'])
-        elif self.validated_data.get('email'):
-            return get_object_or_404(User, email=self.validated_data['email'])
+    def get_user(self, data):
+        if data.get('user_id'):
+            return get_object_or_404(User, id=data['user_id'])
+        elif data.get('email'):
+            return get_object_or_404(User, email=data['email'])
+
+
+class BulkAddEmployeesSerializer(serializers.Serializer):
+    emails = serializers.ListField(
+        child=serializers.EmailField(), required=False, max_length=EMPLOYEES_BULK_MAX
+    )
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=False, max_length=EMPLOYEES_BULK_MAX
+    )
+
+    def validate(self, data):
+        count = len(data.get('emails', [])) + len(data.get('user_ids', []))
+        if not count:
+            raise serializers.ValidationError('Необходимо указать emails или user_ids')
+        if count > EMPLOYEES_BULK_MAX:
+            raise serializers.ValidationError(f'Не больше {EMPLOYEES_BULK_MAX} пользователей за запрос')
+        return data
 
 
 class ProductSaleCreateSerializer(serializers.Serializer):
@@ -151,14 +234,22 @@ class ProductSaleSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ProductSale
-        fields = ['id', 'product', 'product_title','quantity', 'price', 'created_at']
-        read_only_fields = ('price', 'created_at')
+        fields = ['id', 'product', 'product_title','quantity', 'price', 'cost_price', 'total_amount', 'created_at']
+        read_only_fields = ('price', 'cost_price', 'total_amount', 'created_at')
 
 
-class SaleSerializer(serializers.ModelSerializer):
+class SaleSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     product_sales = ProductSaleSerializer(many=True, read_only=True)
-    company_name = serializers.CharField(source='company.title', read_only=True)
+    company_name = serializers.SerializerMethodField()
+
+    collapsed_fields = {'product_sales': None}
 
     class Meta:
         model = Sale
-        fields = '__all__'
\ No newline at end of file
+        exclude = ['buyer_name_lower']
+
+    def get_company_name(self, obj) -> str:
+        # Компании живут в 'default', продажи - в шарде компании. Вьюхи передают
+        # название в контексте, чтобы не читать справочник на каждую продажу
+        title = self.context.get('company_title')
+        return title if title is not None else get_company(obj.company_id).title
\ No newline at end of file
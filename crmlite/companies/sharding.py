@@ -0,0 +1,387 @@
+"""
+Шардирование данных компаний по базам данных.
+
+Справочник компаний (Company), пользователи, статистика запросов и
+служебные таблицы Django живут в 'default'. Остальные модели companies -
+склады, товары, поставки, продажи и все, что к ним относится, - лежат
+в шарде компании: алиасе из settings.COMPANY_SHARDS, записанном в
+Company.shard. 'default' - первый шард, поэтому с одним шардом все
+работает как раньше.
+
+Шард запроса хранится в contextvar: его выставляет аутентификация
+(CompanyJWTAuthentication) по компании пользователя, а команды обходят
+шарды через use_shard(). Объект, загруженный из шарда, сам ведет
+связанные запросы в свою базу, объект Company - в шард компании.
+
+id строк глобально уникальны: каждый шард выдает их из своего блока
+(SHARD_ID_BLOCK), поэтому при переносе компании между шардами id
+сохраняются и ссылки на них остаются верными.
+"""
+import contextvars
+import copy
+import logging
+from contextlib import contextmanager
+from functools import wraps
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models import Count
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+# Каждый следующий шард выдает id начиная с index * SHARD_ID_BLOCK
+SHARD_ID_BLOCK = 10 ** 12
+# Модели companies, которые не шардируются
+SHARED_MODELS = {'company', 'shardpurge', 'querystat'}
+# Состояние самого шарда, а не компании: при переносе не копируется
+SHARD_STATE_MODELS = {'salesreportcheckpoint'}
+
+# Данные компании в порядке зависимостей: (модель, фильтр по компании)
+COMPANY_DATA = (
+    ('Storage', 'company_id'),
+    ('StorageValuation', 'storage__company_id'),
+    ('Supplier', 'company_id'),
+    ('Product', 'company_id'),
+    ('Supply', 'company_id'),
+    ('SupplyProduct', 'supply__company_id'),
+    ('StockTransfer', 'company_id'),
+    ('StockTransferProduct', 'transfer__company_id'),
+    ('Buyer', 'company_id'),
+    ('Sale', 'company_id'),
+    ('ProductSale', 'sale__company_id'),
+    ('ArchivedSale', 'company_id'),
+    ('ArchivedProductSale', 'sale__company_id'),
+    ('SalesReport', 'company_id'),
+    ('StaleSalesPeriod', 'company_id'),
+    ('IdempotencyKey', 'company_id'),
+    ('OutboxEvent', 'company_id'),
+)
+# Ссылки на пользователей из шардов: при удалении пользователя обнуляются
+USER_REFERENCES = ('Supply', 'StockTransfer', 'Sale', 'ArchivedSale')
+MOVE_BATCH_SIZE = 2000
+
+logger = logging.getLogger(__name__)
+
+_current_shard = contextvars.ContextVar('company_shard', default=None)
+
+
+def shard_aliases():
+    return list(settings.COMPANY_SHARDS)
+
+
+def is_sharded(app_label, model_name):
+    return app_label == 'companies' and model_name not in SHARED_MODELS
+
+
+def current_shard():
+    return _current_shard.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use_shard(alias):
+    """Запросы к данным компаний внутри блока идут в шард alias."""
+    token = _current_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_shard.reset(token)
+
+
+def shard_atomic(func):
+    """transaction.atomic в шарде, выбранном на момент вызова, а не импорта."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with transaction.atomic(using=current_shard()):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def shard_for_company(company_id):
+    from .cache import get_company  # Ленивый импорт
+
+    company = get_company(company_id)
+    return company.shard if company and company.shard else DEFAULT_DB_ALIAS
+
+
+def use_company(company_id):
+    return use_shard(shard_for_company(company_id))
+
+
+def choose_shard():
+    """Шард для новой компании: тот, где компаний меньше всего."""
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return aliases[0]
+    Company = apps.get_model('companies', 'Company')
+    counts = dict(Company.objects.values_list('shard').annotate(Count('id')).order_by())
+    return min(aliases, key=lambda alias: counts.get(alias, 0))
+
+
+class CompanyShardRouter:
+    """
+    Справочник и пользователи - в 'default', данные компании - в ее шарде.
+    Связи между шардами запрещены, связи со справочником разрешены:
+    внешние ключи на Company и User ограничены в БД только в 'default'.
+    """
+
+    def _db(self, model, **hints):
+        if not is_sharded(model._meta.app_label, model._meta.model_name):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None:
+            meta = instance._meta
+            if meta.app_label == 'companies' and meta.model_name == 'company':
+                return instance.shard or DEFAULT_DB_ALIAS
+            if is_sharded(meta.app_label, meta.model_name) and instance._state.db:
+                return instance._state.db
+        return current_shard()
+
+    db_for_read = _db
+    db_for_write = _db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if all(is_sharded(obj._meta.app_label, obj._meta.model_name) for obj in (obj1, obj2)):
+            return obj1._state.db == obj2._state.db
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if model_name is None:
+            return None
+        if is_sharded(app_label, model_name):
+            return db in settings.COMPANY_SHARDS
+        return db == DEFAULT_DB_ALIAS
+
+
+class CompanyJWTAuthentication(JWTAuthentication):
+    """JWT-аутентификация, которая направляет запросы в шард компании пользователя."""
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            _current_shard.set(shard_for_company(result[0].company_id))
+        return result
+
+
+class CompanyShardMiddleware:
+    """Сбрасывает шард после запроса: поток обслуживает и другие компании."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _current_shard.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _current_shard.reset(token)
+
+
+def reserve_id_block(alias):
+    """Переводит автоинкремент таблиц шарда в его блок id, если он еще не там."""
+    start = shard_aliases().index(alias) * SHARD_ID_BLOCK
+    if not start:
+        return
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=alias), connection.cursor() as cursor:
+        for model in apps.get_app_config('companies').get_models():
+            pk = model._meta.pk
+            if not is_sharded(model._meta.app_label, model._meta.model_name) \
+                    or not pk.get_internal_type().endswith('AutoField'):
+                continue
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    'INSERT INTO sqlite_sequence (name, seq) SELECT %s, 0 '
+                    'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)',
+                    [table, table]
+                )
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s',
+                               [start, table, start])
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    f'SELECT setval(pg_get_serial_sequence(%s, %s), %s) '
+                    f'WHERE NOT EXISTS (SELECT 1 FROM {quote(table)} WHERE {quote(pk.column)} > %s)',
+                    [table, pk.column, start, start]
+                )
+            elif connection.vendor == 'mysql':
+                # MySQL не опускает AUTO_INCREMENT ниже существующих id
+                cursor.execute(f'ALTER TABLE {quote(table)} AUTO_INCREMENT = {start + 1}')
+
+
+def _company_data():
+    models = [(apps.get_model('companies', name), path) for name, path in COMPANY_DATA]
+    covered = {model._meta.model_name for model, _ in models} | SHARD_STATE_MODELS
+    missing = [
+        model.__name__ for model in apps.get_app_config('companies').get_models()
+        if is_sharded(model._meta.app_label, model._meta.model_name) and model._meta.model_name not in covered
+    ]
+    if missing:
+        raise ImproperlyConfigured(f'Модели {missing} не описаны в COMPANY_DATA')
+    return models
+
+
+def _copy_rows(model, rows, alias):
+    connection = connections[alias]
+    fields = model._meta.concrete_fields
+    quote = connection.ops.quote_name
+    sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+        quote(model._meta.db_table),
+        ', '.join(quote(field.column) for field in fields),
+        ', '.join(['%s'] * len(fields))
+    )
+    # INSERT в обход bulk_create: auto_now и auto_now_add перезаписали бы даты
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [field.get_db_prep_save(value, connection) for field, value in zip(fields, row)]
+            for row in rows
+        ])
+
+
+def delete_company_data(company_id, alias):
+    """Удаляет данные компании из шарда alias. Возвращает {модель: удалено строк}."""
+    deleted = {}
+    with transaction.atomic(using=alias):
+        for model, path in reversed(_company_data()):
+            # Без сигналов и каскадов: зависимые строки удалены раньше
+            deleted[model.__name__] = model._base_manager.using(alias).filter(
+                **{path: company_id}
+            )._raw_delete(alias)
+    return deleted
+
+
+def purge_deleted_companies(purges=None):
+    """
+    Удаляет данные удаленных компаний из шардов по очереди ShardPurge
+    (по умолчанию - всей). Выполненные записи удаляются из очереди,
+    неудачные остаются для следующего запуска purge_deleted_companies.
+    Возвращает количество очищенных компаний.
+    """
+    if purges is None:
+        purges = apps.get_model('companies', 'ShardPurge').objects.order_by('id')
+    done = 0
+    for purge in purges:
+        try:
+            delete_company_data(purge.company_id, purge.shard)
+        except DatabaseError as exc:
+            purge.attempts += 1
+            purge.last_error = str(exc)[:1000]
+            purge.save(update_fields=['attempts', 'last_error'])
+            logger.warning('Не удалось удалить данные компании %s из шарда %s: %s',
+                           purge.company_id, purge.shard, exc)
+            continue
+        purge.delete()
+        done += 1
+    return done
+
+
+def move_company(company, destination, batch_size=MOVE_BATCH_SIZE):
+    """
+    Переносит данные компании в шард destination и переключает на него
+    справочник. Возвращает {модель: перенесено строк}.
+
+    Копирование и удаление из источника идут в транзакциях обоих шардов.
+    Если компанию меняли во время копирования, удаление из источника
+    не совпадет с копией (в SQLite запись по устаревшему снимку вовсе
+    не пройдет), и перенос откатится целиком. Переносить лучше в тихие часы.
+    """
+    source = company.shard or DEFAULT_DB_ALIAS
+    if destination not in shard_aliases():
+        raise ValueError(f'Неизвестный шард {destination}')
+    if destination == source:
+        return {}
+
+    models = _company_data()
+    moved = {}
+    with transaction.atomic(using=source):
+        with transaction.atomic(using=destination):
+            # Остатки прерванного переноса
+            delete_company_data(company.id, destination)
+            for model, path in models:
+                attnames = [field.attname for field in model._meta.concrete_fields]
+                rows = model._base_manager.using(source).filter(
+                    **{path: company.id}
+                ).order_by('pk').values_list(*attnames)
+                batch = []
+                count = 0
+                for row in rows.iterator(chunk_size=batch_size):
+                    batch.append(row)
+                    if len(batch) >= batch_size:
+                        _copy_rows(model, batch, destination)
+                        count += len(batch)
+                        batch = []
+                if batch:
+                    _copy_rows(model, batch, destination)
+                    count += len(batch)
+                moved[model.__name__] = count
+            if delete_company_data(company.id, source) != moved:
+                raise RuntimeError('Данные компании изменились во время переноса, повторите')
+        # После коммита в шарде назначения: post_save сбрасывает кэш справочника
+        company.shard = destination
+        company.save(update_fields=['shard', 'updated_at'])
+    return moved
+
+
+def reference_fields(model):
+    """Внешние ключи шардируемой модели на справочник и пользователей."""
+    return [
+        field for field in model._meta.local_fields
+        if field.remote_field and not is_sharded(
+            field.related_model._meta.app_label, field.related_model._meta.model_name
+        )
+    ]
+
+
+def ensure_reference_constraints(using=DEFAULT_DB_ALIAS):
+    """
+    Создает в 'default' ограничения внешних ключей на справочник, которых нет
+    в моделях: в остальных шардах таблиц справочника нет, поэтому поля
+    объявлены с db_constraint=False. Вызывается после каждой миграции
+    (post_migrate): пересоздание таблицы в SQLite по состоянию миграций
+    теряет ограничения. Возвращает [(модель, поле)] созданных ограничений.
+    """
+    connection = connections[using]
+    if not connection.features.supports_foreign_keys:
+        return []
+    created = []
+    for model in apps.get_app_config('companies').get_models():
+        if not is_sharded(model._meta.app_label, model._meta.model_name):
+            continue
+        with connection.cursor() as cursor:
+            existing = {
+                (tuple(info['columns']), info['foreign_key'])
+                for info in connection.introspection.get_constraints(cursor, model._meta.db_table).values()
+                if info['foreign_key']
+            }
+        alter_fields = []
+        for field in reference_fields(model):
+            target = (field.target_field.model._meta.db_table, field.target_field.column)
+            if ((field.column,), target) in existing:
+                continue
+            constrained = copy.copy(field)
+            constrained.db_constraint = True
+            alter_fields.append((field, constrained))
+        if not alter_fields:
+            continue
+        with connection.schema_editor() as editor:
+            if connection.vendor == 'sqlite':
+                # Одним пересозданием таблицы: поле за полем каждое
+                # пересоздание теряло бы ограничение предыдущего
+                editor._remake_table(model, alter_fields=alter_fields)
+            else:
+                for field, constrained in alter_fields:
+                    editor.alter_field(model, field, constrained)
+        created += [(model.__name__, field.name) for field, _ in alter_fields]
+    return created
+
+
+def detach_user(user_id):
+    """Обнуляет ссылки на удаленного пользователя в шардах, кроме 'default'."""
+    for alias in shard_aliases():
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        for name in USER_REFERENCES:
+            apps.get_model('companies', name)._base_manager.using(alias).filter(
+                created_by_id=user_id
+            ).update(created_by=None)
@@ -0,0 +1,64 @@
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from users.models import User
+from .cache import bump_version
+from .invoices import invalidate_invoice
+from .models import Buyer, Company, Product, ShardPurge, Storage, StorageValuation, Supplier, SupplyProduct, valuation_change
+from .sharding import detach_user, ensure_reference_constraints, purge_deleted_companies
+
+
+def bump_version_on_commit(instance, company_id):
+    # После коммита: иначе параллельный запрос перечитает старую строку
+    # и закэширует ее под новой версией
+    transaction.on_commit(lambda: bump_version(company_id), using=instance._state.db)
+
+
+@receiver([post_save, post_delete], sender=Company)
+def company_changed(sender, instance, **kwargs):
+    bump_version_on_commit(instance, instance.id)
+
+
+@receiver(post_delete, sender=Company)
+def company_deleted(sender, instance, **kwargs):
+    # Каскад Django удаляет только строки в базе справочника. Задание на
+    # очистку шарда пишется в транзакции удаления и выполняется после
+    # коммита; если очистка не прошла, ее повторит purge_deleted_companies
+    if instance.shard and instance.shard != DEFAULT_DB_ALIAS:
+        purge = ShardPurge.objects.create(company_id=instance.id, shard=instance.shard)
+        transaction.on_commit(lambda: purge_deleted_companies([purge]), using=DEFAULT_DB_ALIAS, robust=True)
+
+
+@receiver(post_migrate)
+def reference_constraints(sender, using, **kwargs):
+    # Один раз за migrate, и только в базе справочника
+    if sender.name == 'companies' and using == DEFAULT_DB_ALIAS:
+        ensure_reference_constraints(using)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    detach_user(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Storage)
+@receiver([post_save, post_delete], sender=Supplier)
+@receiver(post_delete, sender=Buyer)
+def reference_changed(sender, instance, **kwargs):
+    bump_version_on_commit(instance, instance.company_id)
+
+
+@receiver([post_save, post_delete], sender=SupplyProduct)
+def supply_lines_changed(sender, instance, **kwargs):
+    # После коммита: иначе параллельный запрос успеет снова сохранить старую версию
+    supply_id = instance.supply_id
+    transaction.on_commit(lambda: invalidate_invoice(supply_id), using=instance._state.db)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    state = instance.valuation_state()
+    if state:
+        # create=False: при каскадном удалении склада его счетчик уже может быть удален
+        StorageValuation.apply([valuation_change(state, -1)], create=False)
@@ -1,3 +1,518 @@
-from django.test import TestCase
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from users.models import User
+from . import outbox, sharding
+from .archive import archive_sales
+from .cache import company_version, get_company, get_storages, get_suppliers
+from .idempotency import IdempotentCreateMixin
+from .models import (ArchivedSale, Company, IdempotencyKey, OutboxEvent, Product, ProductSale, Sale, SalesReport,
+                     ShardPurge, Storage, StorageValuation, Supplier)
+from .sharding import SHARD_ID_BLOCK, ensure_reference_constraints, move_company
+from .valuation import valuation_mismatches
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class CompanyTestCase(TestCase):
+    """Компания со складом и товаром и API-клиент ее владельца."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.company = Company.objects.create(INN='123456789012', title='Компания')
+        cls.user = User.objects.create_user(
+            username='owner',
+            email='owner@example.com',
+            password='password',
+            company=cls.company,
+            is_company_owner=True
+        )
+        cls.storage = Storage.objects.create(company=cls.company, address='Склад 1')
+        cls.product = Product.objects.create(
+            storage=cls.storage,
+            title='Товар',
+            quantity=10,
+            purchase_price=Decimal('10.00'),
+            selling_price=Decimal('15.00')
+        )
+
+    def setUp(self):
+        caches['default'].clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sell(self, quantity=1, key=None, **extra):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return self.client.post(reverse('sale-create'), {
+            'buyer_name': 'Иван',
+            'product_sales': [{'product_id': self.product.id, 'quantity': quantity}],
+            **extra
+        }, format='json', **headers)
+
+    def stock(self):
+        return Product.objects.get(pk=self.product.pk).quantity
+
+
+class IdempotencyTests(CompanyTestCase):
+    def test_replay_returns_stored_response(self):
+        first = self.sell(2, key='sale-1')
+        second = self.sell(2, key='sale-1')
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(second.status_code, 201)
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(second.json()['id'], first.json()['id'])
+        self.assertEqual(Sale.objects.count(), 1)
+        self.assertEqual(self.stock(), 8)
+
+    def test_validation_error_is_stored(self):
+        self.assertEqual(self.sell(100, key='sale-1').status_code, 400)
+        replay = self.sell(100, key='sale-1')
+
+        self.assertEqual(replay.status_code, 400)
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+    def test_other_request_with_same_key(self):
+        self.sell(1, key='sale-1')
+
+        self.assertEqual(self.sell(2, key='sale-1').status_code, 422)
+        self.assertEqual(Sale.objects.count(), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_pending_key_returns_conflict(self):
+        self.sell(1, key='sale-1')
+        IdempotencyKey.objects.update(status_code=None, response_body=None)
+
+        self.assertEqual(self.sell(1, key='sale-1').status_code, 409)
+        self.assertEqual(Sale.objects.count(), 1)
+
+    def test_expired_pending_key_is_not_taken_over(self):
+        self.sell(1, key='sale-1')
+        record = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.update(
+            status_code=None,
+            response_body=None,
+            expires_at=record.created_at - timedelta(seconds=1)
+        )
+
+        self.assertEqual(self.sell(1, key='sale-1').status_code, 409)
+        self.assertEqual(Sale.objects.count(), 1)
+        self.assertEqual(self.stock(), 9)
+
+    def test_expired_response_frees_key(self):
+        self.sell(1, key='sale-1')
+        record = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.update(expires_at=record.created_at - timedelta(seconds=1))
+
+        response = self.sell(1, key='sale-1')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Sale.objects.count(), 2)
+
+    def test_document_rolls_back_when_key_was_purged(self):
+        # Запись удалили как зависшую, пока выполнялся запрос
+        with mock.patch.object(IdempotentCreateMixin, '_complete', return_value=0):
+            response = self.sell(3, key='sale-1')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Sale.objects.exists())
+        self.assertEqual(self.stock(), 10)
+
+
+@override_settings(OUTBOX_BACKOFF_BASE=2, OUTBOX_BACKOFF_MAX=60, OUTBOX_CLAIM_TIMEOUT=300)
+class OutboxTests(CompanyTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other = Company.objects.create(INN='210987654321', title='Другая компания')
+
+    def publish(self, company, count):
+        return [outbox.publish(company.id, 'sale.created', {'n': n}).id for n in range(count)]
+
+    def batch_ids(self, batches):
+        return {events[0].company_id: [event.id for event in events] for events in batches}
+
+    def test_batches_keep_event_order_per_company(self):
+        first = self.publish(self.company, 3)
+        other = self.publish(self.other, 2)
+
+        batches = self.batch_ids(outbox.pending_batches(batch_size=2))
+
+        self.assertEqual(batches, {self.company.id: first[:2], self.other.id: other})
+
+    def test_company_in_backoff_does_not_block_others(self):
+        self.publish(self.company, 5)
+        other = self.publish(self.other, 1)
+        OutboxEvent.objects.filter(company=self.company).update(
+            next_attempt_at=timezone.now() + timedelta(minutes=1)
+        )
+
+        batches = self.batch_ids(outbox.pending_batches(batch_size=10, limit=1))
+
+        self.assertEqual(batches, {self.other.id: other})
+
+    def test_batch_is_claimed_by_one_dispatcher(self):
+        self.publish(self.company, 2)
+
+        self.assertEqual(len(outbox.pending_batches(batch_size=10)), 1)
+        self.assertEqual(outbox.pending_batches(batch_size=10), [])
+
+    def test_failed_delivery_is_retried_after_backoff(self):
+        ids = self.publish(self.company, 2)
+        events = outbox.pending_batches(batch_size=10)[0]
+
+        with mock.patch.object(outbox, 'send', side_effect=OSError('connection refused')), \
+                self.assertLogs('companies.outbox', 'WARNING'):
+            self.assertEqual(outbox.deliver(events, ['http://erp.local/'], timeout=1), 0)
+
+        failed = OutboxEvent.objects.get(pk=ids[0])
+        self.assertEqual(failed.attempts, 1)
+        self.assertEqual(failed.last_error, 'connection refused')
+        self.assertIsNone(failed.dispatched_at)
+        self.assertEqual(outbox.pending_batches(batch_size=10), [])
+
+        OutboxEvent.objects.update(next_attempt_at=timezone.now())
+        events = outbox.pending_batches(batch_size=10)[0]
+        with mock.patch.object(outbox, 'send') as send:
+            self.assertEqual(outbox.deliver(events, ['http://erp.local/'], timeout=1), 2)
+
+        self.assertEqual([event.id for event in send.call_args.args[1]], ids)
+        self.assertFalse(OutboxEvent.objects.filter(dispatched_at__isnull=True).exists())
+
+    def test_next_batch_continues_after_delivered_one(self):
+        ids = self.publish(self.company, 3)
+
+        with mock.patch.object(outbox, 'send'):
+            outbox.deliver(outbox.pending_batches(batch_size=2)[0], ['http://erp.local/'], timeout=1)
+
+        self.assertEqual(self.batch_ids(outbox.pending_batches(batch_size=2)), {self.company.id: ids[2:]})
+
+    def test_backoff_is_capped(self):
+        self.assertEqual(outbox.backoff(1), timedelta(seconds=2))
+        self.assertEqual(outbox.backoff(3), timedelta(seconds=8))
+        self.assertEqual(outbox.backoff(20), timedelta(seconds=60))
+
+
+class StorageValuationTests(CompanyTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.second = Storage.objects.create(company=cls.company, address='Склад 2')
+
+    def valuation(self, storage):
+        valuation = StorageValuation.objects.filter(storage=storage).first()
+        if valuation is None:
+            return 0, Decimal('0.00'), Decimal('0.00')
+        return valuation.quantity, valuation.purchase_value, valuation.selling_value
+
+    def assertConsistent(self):
+        self.assertEqual(valuation_mismatches(Storage.objects.filter(company=self.company)), [])
+
+    def test_new_product(self):
+        self.assertEqual(self.valuation(self.storage), (10, Decimal('100.00'), Decimal('150.00')))
+        self.assertConsistent()
+
+    def test_quantity_and_price_change(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.quantity = 4
+        product.purchase_price = Decimal('12.50')
+        product.save()
+
+        self.assertEqual(self.valuation(self.storage), (4, Decimal('50.00'), Decimal('60.00')))
+        self.assertConsistent()
+
+    def test_product_moved_to_other_storage(self):
+        product = Product.objects.get(pk=self.product.pk)
+        product.storage = self.second
+        product.save()
+
+        self.assertEqual(self.valuation(self.storage), (0, Decimal('0.00'), Decimal('0.00')))
+        self.assertEqual(self.valuation(self.second), (10, Decimal('100.00'), Decimal('150.00')))
+        self.assertConsistent()
+
+    def test_product_deleted(self):
+        Product.objects.get(pk=self.product.pk).delete()
+
+        self.assertEqual(self.valuation(self.storage), (0, Decimal('0.00'), Decimal('0.00')))
+        self.assertConsistent()
+
+    def test_sale(self):
+        self.assertEqual(self.sell(3).status_code, 201)
+
+        self.assertEqual(self.valuation(self.storage), (7, Decimal('70.00'), Decimal('105.00')))
+        self.assertConsistent()
+
+    def test_transfer(self):
+        response = self.client.post(reverse('transfer-create'), {
+            'source_storage_id': self.storage.id,
+            'destination_storage_id': self.second.id,
+            'products': [{'product_id': self.product.id, 'quantity': 4}]
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.valuation(self.storage), (6, Decimal('60.00'), Decimal('90.00')))
+        self.assertEqual(self.valuation(self.second), (4, Decimal('40.00'), Decimal('60.00')))
+        self.assertConsistent()
+
+    def test_transfer_short_of_stock_changes_nothing(self):
+        response = self.client.post(reverse('transfer-create'), {
+            'source_storage_id': self.storage.id,
+            'destination_storage_id': self.second.id,
+            'products': [{'product_id': self.product.id, 'quantity': 11}]
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.valuation(self.storage), (10, Decimal('100.00'), Decimal('150.00')))
+        self.assertEqual(self.valuation(self.second), (0, Decimal('0.00'), Decimal('0.00')))
+        self.assertConsistent()
+
+
+class SaleArchiveTests(CompanyTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        # Продажи 9, 7 и 5 дней назад уходят в архив, 3 и 1 день назад остаются
+        self.sales = {}
+        for days in (9, 7, 5, 3, 1):
+            sale_id = self.sell(1).json()['id']
+            Sale.objects.filter(pk=sale_id).update(sale_date=now - timedelta(days=days))
+            self.sales[days] = sale_id
+        self.before = now - timedelta(days=4)
+        archive_sales(self.before)
+        # Компания пользователя читается заново в каждом настоящем запросе
+        self.user.company.refresh_from_db()
+
+    def list_ids(self, **params):
+        ids = []
+        page = 1
+        with mock.patch.object(PageNumberPagination, 'page_size', 2):
+            while page:
+                data = self.client.get(reverse('sale-list'), {**params, 'page': page}).json()
+                ids += [sale['id'] for sale in data['results']]
+                page = page + 1 if data['next'] else None
+        return data['count'], ids
+
+    def test_sales_are_moved_to_archive(self):
+        self.assertEqual(set(ArchivedSale.objects.values_list('id', flat=True)),
+                         {self.sales[9], self.sales[7], self.sales[5]})
+        self.assertEqual(set(Sale.objects.values_list('id', flat=True)), {self.sales[3], self.sales[1]})
+        self.assertEqual(Company.objects.get(pk=self.company.pk).archived_before, self.before)
+        self.assertEqual(SalesReport.objects.filter(company=self.company, period='day').count(), 3)
+
+    def test_pagination_crosses_archive_boundary(self):
+        count, ids = self.list_ids()
+
+        self.assertEqual(count, 5)
+        self.assertEqual(ids, [self.sales[days] for days in (1, 3, 5, 7, 9)])
+
+    def test_period_after_boundary_skips_archive(self):
+        start = (timezone.now() - timedelta(days=2)).date().isoformat()
+
+        self.assertEqual(self.list_ids(start_date=start), (1, [self.sales[1]]))
+
+    def test_sale_in_closed_period_is_rejected(self):
+        closed = self.sell(1, sale_date=(self.before - timedelta(seconds=1)).isoformat())
+        opened = self.sell(1, sale_date=self.before.isoformat())
+
+        self.assertEqual(closed.status_code, 400)
+        self.assertEqual(opened.status_code, 201)
+
+    def test_sale_cannot_be_moved_into_closed_period(self):
+        url = reverse('sale-detail', args=[self.sales[3]])
+
+        closed = self.client.patch(url, {'sale_date': (self.before - timedelta(days=1)).isoformat()}, format='json')
+        opened = self.client.patch(url, {'sale_date': (self.before + timedelta(days=2)).isoformat()}, format='json')
+
+        self.assertEqual(closed.status_code, 400)
+        self.assertEqual(opened.status_code, 200)
+        self.assertEqual(self.list_ids()[1], [self.sales[1], self.sales[3], self.sales[5], self.sales[7], self.sales[9]])
+
+    def test_archived_sale_is_read_only(self):
+        url = reverse('sale-detail', args=[self.sales[7]])
+
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(self.client.patch(url, {'buyer_name': 'Петр'}, format='json').status_code, 403)
+
+
+class ReferenceCacheTests(CompanyTestCase):
+    def storage_addresses(self):
+        return [storage['address'] for storage in get_storages(self.company.id).values()]
+
+    def test_read_through(self):
+        self.assertEqual(self.storage_addresses(), ['Склад 1'])
+        self.assertEqual(get_company(self.company.id).title, 'Компания')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.storage_addresses(), ['Склад 1'])
+            self.assertEqual(get_company(self.company.id).title, 'Компания')
+
+    def test_version_changes_after_commit(self):
+        version = company_version(self.company.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Storage.objects.create(company=self.company, address='Склад 2')
+            # До коммита параллельный запрос читает старую строку под старой версией
+            self.assertEqual(company_version(self.company.id), version)
+
+        self.assertNotEqual(company_version(self.company.id), version)
+        self.assertEqual(self.storage_addresses(), ['Склад 1', 'Склад 2'])
+
+    def test_rollback_keeps_version(self):
+        version = company_version(self.company.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                Storage.objects.create(company=self.company, address='Склад 2')
+                transaction.set_rollback(True)
+
+        self.assertEqual(company_version(self.company.id), version)
+        self.assertEqual(self.storage_addresses(), ['Склад 1'])
+
+    def test_supplier_and_company_changes(self):
+        supplier = Supplier.objects.create(company=self.company, name='Поставщик', phone='1')
+        self.assertEqual(get_company(self.company.id).title, 'Компания')
+        get_suppliers(self.company.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            supplier.name = 'Новый поставщик'
+            supplier.save()
+            company = Company.objects.get(pk=self.company.pk)
+            company.title = 'Новая компания'
+            company.save()
+
+        self.assertEqual([row['name'] for row in get_suppliers(self.company.id).values()], ['Новый поставщик'])
+        self.assertEqual(get_company(self.company.id).title, 'Новая компания')
+
+    def test_versions_are_per_company(self):
+        other = Company.objects.create(INN='210987654321', title='Другая компания')
+        version = company_version(other.id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Storage.objects.create(company=self.company, address='Склад 2')
+
+        self.assertEqual(company_version(other.id), version)
+
+    def test_storage_list_sees_new_storage(self):
+        self.assertEqual(self.client.get(reverse('storages-list')).json()['count'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('storages-list'), {
+                'address': 'Склад 2', 'company': self.company.id
+            }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.client.get(reverse('storages-list')).json()['count'], 2)
+
+
+class ReferenceConstraintTests(TestCase):
+    def test_default_database_has_reference_constraints(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Sale._meta.db_table)
+        references = {info['foreign_key'] for info in constraints.values() if info['foreign_key']}
+
+        self.assertIn(('companies_company', 'id'), references)
+        self.assertIn(('users_user', 'id'), references)
+        self.assertEqual(ensure_reference_constraints(), [])
+
+
+@skipUnless('shard_1' in settings.DATABASES, 'нужен второй шард: CRMLITE_SHARDS=1')
+class ShardTests(CompanyTestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        super().setUp()
+        # Шард выбирает JWT-аутентификация, а не force_authenticate
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.sale_id = self.sell(2).json()['id']
+
+    def reload_company(self):
+        return Company.objects.get(pk=self.user.company_id)
+
+    def counts(self, alias):
+        return {
+            model.__name__: model.objects.using(alias).filter(**{path: self.user.company_id}).count()
+            for model, path in ((Storage, 'company_id'), (Product, 'company_id'), (Sale, 'company_id'),
+                                (ProductSale, 'sale__company_id'), (StorageValuation, 'storage__company_id'))
+        }
+
+    def test_move_company(self):
+        before = self.counts(DEFAULT_DB_ALIAS)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            moved = move_company(self.reload_company(), 'shard_1')
+
+        self.assertEqual(self.reload_company().shard, 'shard_1')
+        self.assertEqual(self.counts('shard_1'), before)
+        self.assertEqual(set(self.counts(DEFAULT_DB_ALIAS).values()), {0})
+        self.assertEqual(moved['Sale'], 1)
+        # id сохраняются, и API читает компанию уже из ее шарда
+        response = self.client.get(reverse('sale-detail', args=[self.sale_id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.sell(1).status_code, 201)
+        self.assertEqual(Sale.objects.using('shard_1').filter(company_id=self.user.company_id).count(), 2)
+
+    def test_move_company_back(self):
+        before = self.counts(DEFAULT_DB_ALIAS)
+        with self.captureOnCommitCallbacks(execute=True):
+            move_company(self.reload_company(), 'shard_1')
+            move_company(self.reload_company(), DEFAULT_DB_ALIAS)
+
+        self.assertEqual(self.reload_company().shard, DEFAULT_DB_ALIAS)
+        self.assertEqual(self.counts(DEFAULT_DB_ALIAS), before)
+        self.assertEqual(set(self.counts('shard_1').values()), {0})
+
+    def test_move_to_unknown_shard(self):
+        with self.assertRaises(ValueError):
+            move_company(self.reload_company(), 'shard_404')
+
+    def test_move_company_command(self):
+        call_command('move_company', self.user.company_id, 'shard_1', stdout=mock.MagicMock())
+
+        self.assertEqual(self.reload_company().shard, 'shard_1')
+
+    def test_deleted_company_is_purged_from_shard(self):
+        move_company(self.reload_company(), 'shard_1')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.reload_company().delete()
+
+        self.assertEqual(set(self.counts('shard_1').values()), {0})
+        self.assertFalse(ShardPurge.objects.exists())
+
+    def test_failed_purge_is_retried(self):
+        move_company(self.reload_company(), 'shard_1')
+
+        with mock.patch.object(sharding, 'delete_company_data', side_effect=OperationalError('database is locked')), \
+                self.assertLogs('companies.sharding', 'WARNING'), \
+                self.captureOnCommitCallbacks(execute=True):
+            self.reload_company().delete()
+
+        self.assertEqual(ShardPurge.objects.get().attempts, 1)
+        self.assertEqual(self.counts('shard_1')['Sale'], 1)
+
+        call_command('purge_deleted_companies', stdout=mock.MagicMock())
+
+        self.assertFalse(ShardPurge.objects.exists())
+        self.assertEqual(set(self.counts('shard_1').values()), {0})
+
+    def test_migrate_shards_reserves_id_block(self):
+        call_command('migrate_shards', shard='shard_1', verbosity=0, stdout=mock.MagicMock())
+
+        storage = Storage.objects.using('shard_1').create(company=self.reload_company(), address='Склад 2')
+
+        self.assertGreaterEqual(storage.id, SHARD_ID_BLOCK)
@@ -0,0 +1,126 @@
+"""
+Перемещение товаров между складами компании.
+
+Остатки меняются двумя UPDATE на все позиции: списание на складе-источнике
+с условием quantity >= перемещаемого количества и зачисление на складе
+назначения. Товар склада назначения ищется по названию и создается
+одним bulk_create, если его там еще нет.
+"""
+from django.db.models import Case, F, PositiveIntegerField, Value, When
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from .models import Product, StockTransfer, StockTransferProduct, StorageValuation, valuation_change
+from .outbox import publish
+from .sharding import shard_atomic
+
+
+def _by_id(quantities):
+    """CASE id WHEN ... THEN количество END для UPDATE по нескольким товарам."""
+    return Case(
+        *[When(id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+        output_field=PositiveIntegerField()
+    )
+
+
+@shard_atomic
+def transfer_stock(source, destination, quantities, user):
+    """
+    Перемещает товары со склада source на склад destination.
+    quantities: {id товара на складе-источнике: количество}.
+    """
+    products = {
+        product.id: product
+        for product in Product.objects.filter(id__in=quantities, storage=source).only(
+            'id', 'title', 'description', 'quantity', 'purchase_price', 'selling_price'
+        )
+    }
+    missing = sorted(set(quantities) - set(products))
+    if missing:
+        raise ValidationError({'products': f'Товары {missing} не найдены на складе-источнике'})
+    short = [
+        f'{product.title}: доступно {product.quantity}, требуется {quantities[product.id]}'
+        for product in products.values() if product.quantity < quantities[product.id]
+    ]
+    if short:
+        raise ValidationError({'products': short})
+
+    now = timezone.now()
+    needed = _by_id(quantities)
+    updated = Product.objects.filter(id__in=quantities, quantity__gte=needed).update(
+        quantity=F('quantity') - needed, updated_at=now
+    )
+    if updated != len(quantities):
+        # Остаток уменьшила параллельная продажа или перемещение
+        raise ValidationError({'products': 'Остатки изменились во время перемещения, повторите запрос'})
+
+    targets = {}
+    for product in Product.objects.filter(
+        company_id=destination.company_id,
+        storage=destination,
+        title__in={product.title for product in products.values()}
+    ).only('id', 'title', 'purchase_price', 'selling_price').order_by('id'):
+        targets.setdefault(product.title, product)
+
+    created = Product.objects.bulk_create([
+        Product(
+            company_id=destination.company_id, storage=destination, title=title,
+            description=product.description, quantity=0,
+            purchase_price=product.purchase_price, selling_price=product.selling_price
+        )
+        for title, product in {product.title: product for product in products.values()}.items()
+        if title not in targets
+    ])
+    for product in created:
+        targets[product.title] = product
+
+    incoming = {}
+    for product_id, quantity in quantities.items():
+        target_id = targets[products[product_id].title].id
+        incoming[target_id] = incoming.get(target_id, 0) + quantity
+    Product.objects.filter(id__in=incoming).update(
+        quantity=F('quantity') + _by_id(incoming), updated_at=now
+    )
+
+    # UPDATE минует Product.save(), поэтому стоимость остатков складов меняется здесь
+    changes = []
+    for product_id, quantity in quantities.items():
+        product = products[product_id]
+        target = targets[product.title]
+        changes.append(valuation_change(
+            (source.id, quantity, product.purchase_price, product.selling_price), -1
+        ))
+        changes.append(valuation_change(
+            (destination.id, quantity, target.purchase_price, target.selling_price), 1
+        ))
+    StorageValuation.apply(changes)
+
+    transfer = StockTransfer.objects.create(
+        company_id=source.company_id,
+        source_storage=source,
+        destination_storage=destination,
+        created_by=user
+    )
+    lines = StockTransferProduct.objects.bulk_create([
+        StockTransferProduct(
+            transfer=transfer,
+            source_product_id=product_id,
+            destination_product_id=targets[products[product_id].title].id,
+            quantity=quantity
+        )
+        for product_id, quantity in quantities.items()
+    ])
+
+    publish(transfer.company_id, 'stock_transfer.created', {
+        'id': transfer.id,
+        'source_storage_id': source.id,
+        'destination_storage_id': destination.id,
+        'created_at': transfer.created_at,
+        'products': [
+            {'source_product_id': line.source_product_id,
+             'destination_product_id': line.destination_product_id,
+             'quantity': line.quantity}
+            for line in lines
+        ],
+    })
+    return transfer
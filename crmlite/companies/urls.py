@@ -4,10 +4,12 @@ from .views import (CompanyCreateView, CompanyDetailView,
                     SupplierListView, SupplyCreateView,
                     ProductListView, ProductDetailView,
                     SupplyListView, SupplierDetailView,
-                    AddEmployeeView, SaleListView,
+                    AddEmployeeView, BulkAddEmployeesView, SaleListView,
                     SaleCreateView, SaleDetailView,
-                    SalesAnalyticsView, SupplyInvoiceView,
-                    SalesChartsView)
+                    SalesAnalyticsView, SupplyInvoiceView, SupplyInvoiceArchiveView,
+                    SalesChartsView, SalesChartDataView, FleetKPIView, StockValuationView,
+                    CustomerAnalyticsView, TopBuyersView,
+                    StockTransferListView, StockTransferCreateView)
 
 
 urlpatterns = [
@@ -25,7 +27,11 @@ urlpatterns = [
     path('supplies/', SupplyListView.as_view(), name='supply-list'),
     path('supplies/create/', SupplyCreateView.as_view(), name='supply-create'),
 
+    path('transfers/', StockTransferListView.as_view(), name='transfer-list'),
+    path('transfers/create/', StockTransferCreateView.as_view(), name='transfer-create'),
+
     path('add-employee/', AddEmployeeView.as_view(), name='add-employee'),
+    path('add-employees/', BulkAddEmployeesView.as_view(), name='add-employees'),
 
     path('sales/', SaleListView.as_view(), name='sale-list'),
     path('sales/create/', SaleCreateView.as_view(), name='sale-create'),
@@ -33,6 +39,12 @@ urlpatterns = [
 
     path('analytics/sales/', SalesAnalyticsView.as_view(), name='sales-analytics'),
     path('analytics/charts/', SalesChartsView.as_view(), name='sales-charts'),
+    path('analytics/charts/data/', SalesChartDataView.as_view(), name='sales-chart-data'),
+    path('analytics/fleet/', FleetKPIView.as_view(), name='fleet-kpis'),
+    path('analytics/valuation/', StockValuationView.as_view(), name='stock-valuation'),
+    path('analytics/customers/', CustomerAnalyticsView.as_view(), name='customer-analytics'),
+    path('analytics/customers/top/', TopBuyersView.as_view(), name='top-buyers'),
     path('supplies/<int:pk>/invoice/', SupplyInvoiceView.as_view(), name='supply-invoice'),
+    path('supplies/invoices/', SupplyInvoiceArchiveView.as_view(), name='supply-invoice-archive'),
 
 ]
\ No newline at end of file
@@ -1,11 +1,27 @@
+from collections import defaultdict
+from decimal import Decimal
 from django.db.models.functions import TruncDay, TruncWeek
-from reportlab.pdfgen import canvas
 from io import BytesIO
-import matplotlib.pyplot as plt
-from django.db.models import Sum, F
-from .models import Sale, ProductSale
+from django.db.models import Sum
+from .models import PRODUCT_SALE_PROFIT
+from .archive import sale_sources
+
+
+# matplotlib и reportlab тяжелые и нужны только двум эндпоинтам,
+# поэтому импортируются при первом построении графика или PDF.
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def generate_supply_pdf(supply, lines=None):
+    from reportlab.pdfgen import canvas
+
+    if lines is None:
+        lines = supply.supply_products.select_related('product')
 
-def generate_supply_pdf(supply):
     buffer = BytesIO()
     p = canvas.Canvas(buffer)
 
@@ -19,14 +35,16 @@ def generate_supply_pdf(supply):
     p.drawString(400, y, 'Цена')
     p.drawString(500, y, 'Сумма')
 
-    for item in supply.supply_products.all():
+    total = 0
+    for item in lines:
         y -= 20
         p.drawString(100, y, item.product.title)
         p.drawString(300, y, str(item.quantity))
-        p.drawString(400, y, str(item.price))
-        p.drawString(500, y, str(item.quantity * item.price))
+        p.drawString(400, y, str(item.purchase_price))
+        p.drawString(500, y, str(item.quantity * item.purchase_price))
+        total += item.quantity * item.purchase_price
 
-    p.drawString(400, y-40, f'ИТОГО: {supply.supply_products.aggregate(total=Sum(F("quantity") * F("price")))["total"]}')
+    p.drawString(400, y-40, f'ИТОГО: {total}')
 
     p.showPage()
     p.save()
@@ -34,54 +52,140 @@ def generate_supply_pdf(supply):
     return buffer
 
 
+def sales_plot_data(company, date_from=None, date_to=None):
+    """
+    Ряды для графиков продаж: суммы по дням, топ-5 товаров по количеству
+    и прибыль по неделям. Если период заходит в архив, архивные продажи
+    суммируются с горячими.
+    """
+    sales_by_day = defaultdict(Decimal)
+    top_products = defaultdict(int)
+    sales_by_week = defaultdict(Decimal)
+
+    for sales, product_sales in sale_sources(company, date_from if date_from and date_to else None):
+        if date_from and date_to:
+            sales = sales.filter(sale_date__range=[date_from, date_to])
+        product_sales = product_sales.filter(sale__in=sales)
+
+        for row in sales.annotate(
+            day=TruncDay('sale_date')
+        ).values('day').annotate(
+            total=Sum('total_amount')
+        ):
+            sales_by_day[row['day']] += row['total']
+
+        for row in product_sales.values(
+            'product__title'
+        ).annotate(
+            total=Sum('quantity')
+        ):
+            top_products[row['product__title']] += row['total']
+
+        for row in product_sales.annotate(
+            week=TruncWeek('sale__sale_date')
+        ).values('week').annotate(
+            profit=Sum(PRODUCT_SALE_PROFIT)
+        ):
+            sales_by_week[row['week']] += row['profit']
+
+    return {
+        'sales_by_day': sorted(sales_by_day.items()),
+        'top_products': sorted(top_products.items(), key=lambda x: x[1], reverse=True)[:5],
+        'profit_by_week': sorted(sales_by_week.items()),
+    }
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: индексы threshold точек ряда,
+    лучше всего сохраняющих его форму. Первая и последняя точки
+    остаются всегда, из каждой корзины берется точка, образующая
+    наибольший треугольник с предыдущей выбранной и средним следующей.
+    """
+    import numpy as np
+
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Границы корзин для точек между первой и последней
+    edges = np.append((np.arange(threshold - 1) * (n - 2) / (threshold - 2) + 1).astype(int), n)
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end, next_end = edges[i], edges[i + 1], edges[i + 2]
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs(
+            (x[a] - avg_x) * (y[start:end] - y[a])
+            - (x[a] - x[start:end]) * (avg_y - y[a])
+        )
+        a = start + int(area.argmax())
+        indices[i + 1] = a
+    return indices
+
+
+def downsample(series, points):
+    """Прореживает ряд [(дата, значение)] до points точек методом LTTB."""
+    if len(series) <= points:
+        return series
+    x = [moment.timestamp() for moment, _ in series]
+    y = [float(value) for _, value in series]
+    return [series[i] for i in lttb(x, y, points)]
+
+
+def sales_chart_data(company, date_from=None, date_to=None, points=500):
+    """Данные графиков продаж в JSON-виде с прореживанием длинных рядов."""
+    data = sales_plot_data(company, date_from, date_to)
+    sales_by_day = downsample(data['sales_by_day'], points)
+    profit_by_week = downsample(data['profit_by_week'], points)
+
+    return {
+        'source_points': {
+            'sales_by_day': len(data['sales_by_day']),
+            'profit_by_week': len(data['profit_by_week']),
+        },
+        'sales_by_day': [
+            {'date': day.date(), 'total': total} for day, total in sales_by_day
+        ],
+        'top_products': [
+            {'title': title, 'quantity': quantity} for title, quantity in data['top_products']
+        ],
+        'profit_by_week': [
+            {'week': week.date(), 'profit': profit} for week, profit in profit_by_week
+        ],
+    }
+
+
 def generate_sales_plot(company, date_from=None, date_to=None):
-    plt.style.use('seaborn')
-
-    sales = Sale.objects.filter(
-        company=company,
-        sale_date__range=[date_from, date_to]
-    ) if date_from and date_to else Sale.objects.filter(company=company)
-
-    sales_by_day = sales.annotate(
-        day=TruncDay('sale_date')
-    ).values('day').annotate(
-        total=Sum('total_amount')
-    ).order_by('day')
-
-    top_products = ProductSale.objects.filter(
-        sale__in = sales
-    ).values(
-        'product__title'
-    ).annotate(
-        total=Sum('quantity')
-    ).order_by('-total')[:5]
+    plt = _pyplot()
+    plt.style.use('seaborn-v0_8')
+
+    data = sales_plot_data(company, date_from, date_to)
 
     fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(10, 15))
 
-    days = [x['day'].strftime('%d.%m') for x in sales_by_day]
-    amounts = [float(x['total']) for x in sales_by_day]
+    days = [day.strftime('%d.%m') for day, _ in data['sales_by_day']]
+    amounts = [float(total) for _, total in data['sales_by_day']]
 
     ax1.bar(days, amounts, color='skyblue')
     ax1.set_title('продажи по дням')
-    ax1.setylabel('сумма')
+    ax1.set_ylabel('сумма')
     ax1.grid(True)
 
-    products = [x['product__title'][:15] for x in top_products]
-    quantities = [x['total'] for x in top_products]
+    products = [title[:15] for title, _ in data['top_products']]
+    quantities = [total for _, total in data['top_products']]
 
     ax2.bar(products, quantities, color='lightgreen')
     ax2.set_title('топ-5 товаров по количеству')
     ax2.grid(True)
 
-    sales_by_week = sales.annotate(
-        week=TruncWeek('sale_date')
-    ).values('week').annotate(
-        profit=Sum(F('product_sales__quantity') *
-                   (F('product_sales__price') - F('product_sales__product__purchase_price')))
-    ).order_by('week')
-
-    weeks = [x['week'].strftime('%U') for x in sales_by_week]
-    profits = [float(x['profit']) for x in sales_by_week]
+    weeks = [week.strftime('%U') for week, _ in data['profit_by_week']]
+    profits = [float(profit) for _, profit in data['profit_by_week']]
 
     ax3.plot(weeks, profits, marker='o', color='salmon')
     ax3.set_title('прибыль по неделям')
@@ -0,0 +1,87 @@
+"""
+Стоимость остатков по складам.
+
+Счетчики StorageValuation меняются на разницу при каждом сохранении
+товара (Product.save) и при перемещениях, поэтому отчет читает по
+одной строке на склад вместо SUM(quantity * price) по всем товарам.
+Пересчет с нуля нужен только для проверки и исправления счетчиков.
+"""
+from decimal import Decimal
+
+from django.db.models import F, Sum
+
+from .models import Product, Storage, StorageValuation
+from .sharding import shard_atomic
+
+CENTS = Decimal('0.01')
+VALUATION_TOTALS = ('quantity', 'purchase_value', 'selling_value')
+ZERO = {'quantity': 0, 'purchase_value': Decimal('0.00'), 'selling_value': Decimal('0.00')}
+
+
+def _money(value):
+    # SQLite суммирует DecimalField как float
+    return Decimal(value or 0).quantize(CENTS)
+
+
+def computed_valuations(storages):
+    """Стоимость остатков, посчитанная по товарам: {storage_id: {quantity, purchase_value, selling_value}}."""
+    result = {storage_id: dict(ZERO) for storage_id in storages.values_list('id', flat=True)}
+    rows = Product.objects.filter(storage__in=storages).values('storage_id').annotate(
+        quantity_total=Sum('quantity'),
+        purchase_value=Sum(F('quantity') * F('purchase_price')),
+        selling_value=Sum(F('quantity') * F('selling_price'))
+    ).order_by()
+    for row in rows:
+        result[row['storage_id']] = {
+            'quantity': row['quantity_total'] or 0,
+            'purchase_value': _money(row['purchase_value']),
+            'selling_value': _money(row['selling_value']),
+        }
+    return result
+
+
+def stored_valuations(storages):
+    return {
+        valuation.storage_id: {field: getattr(valuation, field) for field in VALUATION_TOTALS}
+        for valuation in StorageValuation.objects.filter(storage__in=storages)
+    }
+
+
+def valuation_mismatches(storages):
+    """Склады, где счетчики расходятся с пересчетом: [(storage_id, счетчики или None, пересчет)]."""
+    stored = stored_valuations(storages)
+    return [
+        (storage_id, stored.get(storage_id), computed)
+        for storage_id, computed in computed_valuations(storages).items()
+        # Счетчик склада без движений может еще не существовать
+        if stored.get(storage_id, ZERO) != computed
+    ]
+
+
+@shard_atomic
+def recompute_valuations(storages):
+    """Перезаписывает счетчики пересчетом по товарам. Возвращает исправленные расхождения."""
+    # Пересчет и запись в одной транзакции, чтобы не потерять параллельные изменения
+    mismatches = valuation_mismatches(storages)
+    StorageValuation.objects.bulk_create(
+        [StorageValuation(storage_id=storage_id, **computed) for storage_id, _, computed in mismatches],
+        update_conflicts=True,
+        unique_fields=['storage'],
+        update_fields=list(VALUATION_TOTALS) + ['updated_at'],
+        batch_size=1000
+    )
+    return mismatches
+
+
+def company_valuation(company_id):
+    """Стоимость остатков по складам компании и итог."""
+    rows = []
+    total = dict(ZERO)
+    for storage in Storage.objects.filter(company_id=company_id).select_related('valuation').order_by('id'):
+        valuation = getattr(storage, 'valuation', None)
+        row = {'storage_id': storage.id, 'address': storage.address}
+        for field in VALUATION_TOTALS:
+            row[field] = getattr(valuation, field) if valuation else ZERO[field]
+            total[field] += row[field]
+        rows.append(row)
+    return rows, total
@@ -1,26 +1,46 @@
 from django.shortcuts import get_object_or_404
 from django.db import transaction
-from django.db.models import Prefetch, Sum, F
+from django.conf import settings
+from django.db.models import Prefetch, Sum
 from django_filters.rest_framework import DjangoFilterBackend
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, Http404, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
 from rest_framework import generics, permissions, status
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from rest_framework.exceptions import ValidationError
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema, OpenApiExample, OpenApiResponse, OpenApiParameter
 from rest_framework.exceptions import PermissionDenied
 from datetime import timedelta
 import datetime
+import io
 from django.utils import timezone
-from .models import Company, Storage, Supplier, Product, Supply, SupplyProduct, Sale, ProductSale
+from .models import (Company, Storage, Supplier, Product, Supply, SupplyProduct, Sale, ProductSale,
+                     ArchivedSale, StockTransfer, PRODUCT_SALE_PROFIT)
 from .serializers import (CompanySerializer, StorageSerializer,
                           SupplierSerializer, ProductSerializer, SupplyCreateSerializer,
-                          SupplySerializer, AddEmployeesSerializer,
-                          SaleCreateSerializer, SaleSerializer)
+                          SupplySerializer, AddEmployeesSerializer, BulkAddEmployeesSerializer,
+                          SaleCreateSerializer, SaleSerializer, StockTransferCreateSerializer,
+                          StockTransferSerializer)
 from users.models import User
 from .permissions import IsCompanyOwner, IsCompanyEmployee
 from .filters import SaleFilter
-from .utils import generate_supply_pdf, generate_sales_plot
+from .archive import SaleChain, archive_boundary, reaches_archive, sale_sources
+from .cache import get_storages, get_suppliers
+from .fieldsets import SPARSE_PARAMETERS, only_fields
+from .employees import ADDED, EMPLOYEES_BULK_MAX, attach_employees
+from .kpis import fleet_kpis, period_bounds
+from .reports import mark_stale_period
+from .sharding import current_shard, shard_atomic
+from .transfers import transfer_stock
+from .valuation import company_valuation
+from .customers import (TOP_BUYERS_LIMIT, TOP_BUYERS_MAX, TOP_BUYERS_ORDERING,
+                        customer_summary, top_buyers)
+from .idempotency import IdempotentCreateMixin, IDEMPOTENCY_KEY_PARAMETER
+from .outbox import publish
+from .invoices import invoice_digest, invoice_file, invoice_lines, invoice_zip, render_invoice
+from .utils import generate_sales_plot, sales_chart_data
 
 
 @extend_schema(
@@ -119,6 +139,10 @@ class StorageView(generics.ListCreateAPIView):
             return Storage.objects.none()
         return Storage.objects.filter(company=user.company)
 
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(list(get_storages(request.user.company_id).values()))
+        return self.get_paginated_response(page)
+
     def perform_create(self, serializer):
         if not self.request.user.is_company_owner:
             raise PermissionDenied("Only company owner can create storages")
@@ -171,6 +195,10 @@ class SupplierListView(generics.ListCreateAPIView):
     def get_queryset(self):
         return Supplier.objects.filter(company=self.request.user.company)
 
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(list(get_suppliers(request.user.company_id).values()))
+        return self.get_paginated_response(page)
+
     def perform_create(self, serializer):
         serializer.save(company=self.request.user.company)
 
@@ -183,36 +211,40 @@ class SupplierDetailView(generics.RetrieveUpdateDestroyAPIView):
         return Supplier.objects.filter(company=self.request.user.company)
 
 
-@extend_schema(tags=["Products"])
+@extend_schema(tags=["Products"], parameters=SPARSE_PARAMETERS)
 class ProductListView(generics.ListCreateAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        queryset = Product.objects.filter(storage__company=self.request.user.company)
+        queryset = Product.objects.filter(company_id=self.request.user.company_id)
         storage_id = self.request.query_params.get('storage_id')
         if storage_id:
             queryset = queryset.filter(storage_id=storage_id)
-        return queryset
+        fields = self.get_serializer().fields
+        return queryset.only(*only_fields(Product, fields, 'company', 'storage')).order_by('title')
 
 
     def perform_create(self, serializer):
         storage = serializer.validated_data['storage']
-        if storage.company != self.request.user.company:
+        if storage.company_id != self.request.user.company_id:
             raise PermissionDenied('Вы не можете добавлять товары на этот склад')
         serializer.save(quantity=0)
 
-@extend_schema(tags=["Products"])
+@extend_schema(tags=["Products"], parameters=SPARSE_PARAMETERS)
 class ProductDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Product.objects.filter(storage__company=self.request.user.company)
+        fields = self.get_serializer().fields
+        return Product.objects.filter(
+            company_id=self.request.user.company_id
+        ).only(*only_fields(Product, fields, 'company', 'storage'))
 
 
-@extend_schema(tags=["Supplies"])
-class SupplyCreateView(generics.CreateAPIView):
+@extend_schema(tags=["Supplies"], parameters=[IDEMPOTENCY_KEY_PARAMETER])
+class SupplyCreateView(IdempotentCreateMixin, generics.CreateAPIView):
     serializer_class = SupplyCreateSerializer
     permission_classes = [permissions.IsAuthenticated, IsCompanyOwner]
 
@@ -227,22 +259,27 @@ class SupplyCreateView(generics.CreateAPIView):
             headers=headers
         )
 
-    @transaction.atomic
+    @shard_atomic
     def perform_create(self, serializer):
         validated_data = serializer.validated_data
         products_data = validated_data['products']
 
+        storage = validated_data['storage']
+        if storage.company_id != self.request.user.company_id:
+            raise PermissionDenied('Вы не можете оформлять поставки на этот склад')
+
         supply = Supply.objects.create(
-            storage_id=validated_data['storage_id'],
-            supplier_id=validated_data.get('supplier_id'),
+            storage=storage,
+            supplier=validated_data.get('supplier'),
             created_by=self.request.user
         )
 
+        lines = []
         for product_item in products_data:
             product = get_object_or_404(
                 Product,
                 id=product_item['product_id'],
-                storage__company=self.request.user.company
+                company_id=self.request.user.company_id
             )
 
             SupplyProduct.objects.create(
@@ -254,24 +291,83 @@ class SupplyCreateView(generics.CreateAPIView):
 
             product.quantity += product_item['quantity']
             product.save()
-
+            lines.append({
+                'product_id': product.id,
+                'quantity': product_item['quantity'],
+                'purchase_price': product.purchase_price,
+            })
+
+        publish(supply.company_id, 'supply.created', {
+            'id': supply.id,
+            'storage_id': supply.storage_id,
+            'supplier_id': supply.supplier_id,
+            'created_at': supply.created_at,
+            'products': lines,
+        })
         return supply
 
 
-@extend_schema(tags=["Supplies"])
+@extend_schema(tags=["Supplies"], parameters=SPARSE_PARAMETERS)
 class SupplyListView(generics.ListAPIView):
     serializer_class = SupplySerializer
     permission_classes = [permissions.IsAuthenticated, IsCompanyEmployee]
 
     def get_queryset(self):
-        return Supply.objects.filter(
-            storage__company=self.request.user.company
-        ).prefetch_related(
-            Prefetch(
-                'supply_products',
-                queryset=SupplyProduct.objects.select_related('product')
+        fields = self.get_serializer().fields
+        queryset = Supply.objects.filter(
+            company_id=self.request.user.company_id
+        ).only(*only_fields(Supply, fields, 'company')).order_by('-created_at')
+
+        # Позиции поставки читаются, только если они есть в ответе
+        if 'products' in fields:
+            queryset = queryset.prefetch_related(
+                Prefetch(
+                    'supply_products',
+                    queryset=SupplyProduct.objects.select_related('product')
+                )
             )
-        ).select_related('supplier', 'storage', 'created_by').order_by('-created_at')
+        return queryset
+
+
+@extend_schema(
+    tags=['Transfers'],
+    description='Перемещение товаров между складами компании одной транзакцией. '
+                'Товары склада назначения находятся по названию или создаются.',
+    parameters=[IDEMPOTENCY_KEY_PARAMETER],
+    responses={201: StockTransferSerializer}
+)
+class StockTransferCreateView(IdempotentCreateMixin, generics.CreateAPIView):
+    serializer_class = StockTransferCreateSerializer
+    permission_classes = [permissions.IsAuthenticated, IsCompanyOwner]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+
+        source = validated_data['source_storage']
+        destination = validated_data['destination_storage']
+        if {source.company_id, destination.company_id} != {request.user.company_id}:
+            raise PermissionDenied('Вы не можете перемещать товары между этими складами')
+
+        quantities = {}
+        for item in validated_data['products']:
+            quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+
+        transfer = transfer_stock(source, destination, quantities, request.user)
+        transfer = StockTransfer.objects.prefetch_related('transfer_products').get(id=transfer.id)
+        return Response(StockTransferSerializer(transfer).data, status=status.HTTP_201_CREATED)
+
+
+@extend_schema(tags=['Transfers'])
+class StockTransferListView(generics.ListAPIView):
+    serializer_class = StockTransferSerializer
+    permission_classes = [permissions.IsAuthenticated, IsCompanyEmployee]
+
+    def get_queryset(self):
+        return StockTransfer.objects.filter(
+            company_id=self.request.user.company_id
+        ).prefetch_related('transfer_products').order_by('-created_at')
 
 
 @extend_schema(
@@ -302,19 +398,17 @@ class AddEmployeeView(generics.GenericAPIView):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
 
-        user = get_object_or_404(
-            User,
-            email=serializer.validated_data['email']
-        )
+        # Пользователь уже найден при валидации
+        user = serializer.context['user']
 
-        if user.company:
+        if user.company_id:
             return Response(
                 {'detail': 'Пользователь уже привязан к другой компании'},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
         user.company = request.user.company
-        user.save()
+        user.save(update_fields=['company'])
 
         return Response(
             {
@@ -329,11 +423,76 @@ class AddEmployeeView(generics.GenericAPIView):
         )
 
 
+@extend_schema(
+    tags=['Employees'],
+    description=f'''
+    Массовое добавление сотрудников в компанию (до {EMPLOYEES_BULK_MAX} за запрос).
+    Требуются права владельца компании.
+    Для каждой записи возвращается статус: added, not_found, company_owner,
+    already_member (уже в этой компании) или other_company.
+    ''',
+    examples=[
+        OpenApiExample(
+            'Example',
+            value={"emails": ["user@example.com", "cashier@example.com"], "user_ids": [3, 4]},
+            request_only=True
+        ),
+        OpenApiExample(
+            'Example response',
+            value={
+                'added': 1,
+                'skipped': 1,
+                'results': [
+                    {'email': 'user@example.com', 'status': 'added',
+                     'user': {'id': 5, 'email': 'user@example.com', 'username': 'user'}},
+                    {'user_id': 3, 'status': 'other_company',
+                     'user': {'id': 3, 'email': 'seller@example.com', 'username': 'seller'}},
+                ]
+            },
+            response_only=True
+        )
+    ]
+)
+class BulkAddEmployeesView(generics.GenericAPIView):
+    serializer_class = BulkAddEmployeesSerializer
+    permission_classes = [permissions.IsAuthenticated, IsCompanyOwner]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        if not request.user.company_id:
+            return Response(
+                {'detail': 'Пользователь не привязан к компании'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        results = attach_employees(
+            request.user.company,
+            emails=serializer.validated_data.get('emails', []),
+            user_ids=serializer.validated_data.get('user_ids', [])
+        )
+        added = sum(result['status'] == ADDED for result in results)
+        return Response(
+            {'added': added, 'skipped': len(results) - added, 'results': results},
+            status=status.HTTP_200_OK
+        )
+
+
+def load_sale_relations(queryset, fields):
+    """Загружает для продаж только колонки и связи, которые попадут в ответ."""
+    # company_name берется из кэша справочника: компании живут в другой базе
+    if 'product_sales' in fields:
+        queryset = queryset.prefetch_related('product_sales__product')
+    return queryset.only(*only_fields(queryset.model, fields, 'company'))
+
+
 @extend_schema(
     tags=['Sales'],
     parameters=[
         OpenApiParameter(name='start_date', description='Фильтр по дате от', required=False, type=str),
-        OpenApiParameter(name='end_date', description='Фильтр по дате до', required=False, type=str)
+        OpenApiParameter(name='end_date', description='Фильтр по дате до', required=False, type=str),
+        *SPARSE_PARAMETERS
     ]
 )
 class SaleListView(generics.ListAPIView):
@@ -344,19 +503,38 @@ class SaleListView(generics.ListAPIView):
     pagination_class = PageNumberPagination
 
     def get_queryset(self):
-        return Sale.objects.filter(
-            company=self.request.user.company
-        ).select_related('company', 'created_by')\
-         .prefetch_related('product_sales__product')\
-         .order_by('-sale_date')
-
-
-@extend_schema(tags=['Sales'])
-class SaleCreateView(generics.CreateAPIView):
+        return load_sale_relations(
+            Sale.objects.filter(company=self.request.user.company),
+            self.get_serializer().fields
+        ).order_by('-sale_date')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        company = getattr(self.request.user, 'company', None)
+        if company:
+            context['company_title'] = company.title
+        return context
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        company = self.request.user.company
+        if not reaches_archive(company, self.request.query_params.get('start_date')):
+            return queryset
+
+        # Архив читается, только если запрошенный период заходит в него
+        archived = load_sale_relations(
+            ArchivedSale.objects.filter(company=company),
+            self.get_serializer().fields
+        ).order_by('-sale_date')
+        return SaleChain(queryset, SaleFilter(self.request.query_params, queryset=archived).qs)
+
+
+@extend_schema(tags=['Sales'], parameters=[IDEMPOTENCY_KEY_PARAMETER])
+class SaleCreateView(IdempotentCreateMixin, generics.CreateAPIView):
     serializer_class = SaleCreateSerializer
     permission_classes = [permissions.IsAuthenticated, IsCompanyEmployee]
 
-    @transaction.atomic
+    @shard_atomic
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -368,6 +546,13 @@ class SaleCreateView(generics.CreateAPIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        boundary = archive_boundary(company)
+        if boundary and serializer.validated_data['sale_date'] < boundary:
+            return Response(
+                {'detail': 'Период продаж закрыт и перенесен в архив'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         try:
             sale = Sale.objects.create(
                 company=company,
@@ -386,50 +571,92 @@ class SaleCreateView(generics.CreateAPIView):
                         f'Недостаточно товара {product.title}. Доступно: {product.quantity}'
                     )
 
+                line_total = product.selling_price * quantity
                 ProductSale.objects.create(
                     sale=sale,
                     product=product,
                     quantity=quantity,
-                    price=product.selling_price
+                    price=product.selling_price,
+                    cost_price=product.purchase_price,
+                    total_amount=line_total
                 )
 
                 product.quantity -= quantity
                 product.save()
-                total_amount += product.selling_price * quantity
+                total_amount += line_total
 
             sale.total_amount = total_amount
-            sale.save()
+            sale.save(update_fields=['total_amount', 'updated_at'])
+
+            data = SaleSerializer(sale, context={'company_title': company.title}).data
+            publish(company.id, 'sale.created', data)
 
             return Response(
-                SaleSerializer(sale).data,
+                data,
                 status=status.HTTP_201_CREATED
             )
 
         except ValidationError as e:
+            transaction.set_rollback(True, using=current_shard())
             return Response(
                 {'detail': str(e)},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
 
-@extend_schema(tags=['Sales'])
+@extend_schema(tags=['Sales'], parameters=SPARSE_PARAMETERS)
 class SaleDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = SaleSerializer
     permission_classes = [permissions.IsAuthenticated, IsCompanyEmployee]
     http_method_names = ['get', 'patch', 'delete']
 
     def get_queryset(self):
-        return Sale.objects.filter(
-            company=self.request.user.company
-        ).select_related('company', 'created_by')\
-         .prefetch_related('product_sales__product')
+        return load_sale_relations(
+            Sale.objects.filter(company=self.request.user.company),
+            self.get_serializer().fields
+        )
 
-    @transaction.atomic
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        company = getattr(self.request.user, 'company', None)
+        if company:
+            context['company_title'] = company.title
+        return context
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            archived = get_object_or_404(
+                load_sale_relations(
+                    ArchivedSale.objects.filter(company=self.request.user.company),
+                    self.get_serializer().fields
+                ),
+                pk=self.kwargs['pk']
+            )
+            if self.request.method != 'GET':
+                raise PermissionDenied('Продажа относится к закрытому периоду')
+            return archived
+
+    @shard_atomic
+    def perform_update(self, serializer):
+        # Перенос в закрытый период нарушил бы порядок SaleChain и дневные отчеты архива
+        boundary = archive_boundary(self.request.user.company)
+        new_date = serializer.validated_data.get('sale_date')
+        if boundary and new_date and new_date < boundary:
+            raise ValidationError({'sale_date': 'Период продаж закрыт и перенесен в архив'})
+        sale_date = serializer.instance.sale_date
+        sale = serializer.save()
+        if sale.sale_date != sale_date:
+            mark_stale_period(sale.company_id, sale_date)
+
+    @shard_atomic
     def perform_destroy(self, instance):
         for product_sale in instance.product_sales.all():
             product = product_sale.product
             product.quantity += product_sale.quantity
             product.save()
+        mark_stale_period(instance.company_id, instance.sale_date)
         instance.delete()
 
 
@@ -441,37 +668,59 @@ class SalesAnalyticsView(generics.GenericAPIView):
         date_from = request.query_params.get('from')
         date_to = request.query_params.get('to')
 
-        # Фильтрация по компании пользователя
-        queryset = Sale.objects.filter(company=request.user.company)
-
         # Фильтр по дате
         if date_from and date_to:
-            queryset = queryset.filter(sale_date__range=[date_from, date_to])
+            period = {'sale_date__range': [date_from, date_to]}
         else:
             # По умолчанию - последние 30 дней
-            queryset = queryset.filter(
-                sale_date__gte=timezone.now() - timedelta(days=30)
-            )
+            period = {'sale_date__gte': timezone.now() - timedelta(days=30)}
 
-        # Расчет показателей
-        total_sales = queryset.aggregate(
-            total=Sum('total_amount')
-        )['total'] or 0
+        # Горячие таблицы и, если период заходит в архив, архивные
+        sources = sale_sources(
+            request.user.company,
+            date_from if date_from and date_to else period['sale_date__gte']
+        )
 
-        net_profit = queryset.aggregate(
-            profit=Sum(F('product_sales__quantity') *
-                       (F('product_sales__price') - F('product_sales__product__purchase_price')))
-        )['profit'] or 0
+        # Расчет показателей
+        total_sales = 0
+        net_profit = 0
+        products = {}
+        for sales, product_sales in sources:
+            queryset = sales.filter(**period)
+            total_sales += queryset.aggregate(
+                total=Sum('total_amount')
+            )['total'] or 0
+
+            product_sales = product_sales.filter(sale__in=queryset)
+
+            net_profit += product_sales.aggregate(
+                profit=Sum(PRODUCT_SALE_PROFIT)
+            )['profit'] or 0
+
+            rows = product_sales.values(
+                'product__title'
+            ).annotate(
+                total_quantity=Sum('quantity'),
+                total_profit=Sum(PRODUCT_SALE_PROFIT)
+            ).order_by('-total_quantity')
+            if len(sources) == 1:
+                rows = rows[:5]
+
+            for row in rows:
+                merged = products.setdefault(row['product__title'], {
+                    'product__title': row['product__title'],
+                    'total_quantity': 0,
+                    'total_profit': 0,
+                })
+                merged['total_quantity'] += row['total_quantity']
+                merged['total_profit'] += row['total_profit']
 
         # ТОП-5 товаров по количеству
-        top_products = ProductSale.objects.filter(
-            sale__in=queryset
-        ).values(
-            'product__title'
-        ).annotate(
-            total_quantity=Sum('quantity'),
-            total_profit=Sum(F('quantity') * (F('price') - F('product__purchase_price')))
-        ).order_by('-total_quantity')[:5]
+        top_products = sorted(
+            products.values(),
+            key=lambda x: x['total_quantity'],
+            reverse=True
+        )[:5]
 
         return Response({
             'period': {
@@ -495,15 +744,92 @@ class SupplyInvoiceView(generics.RetrieveAPIView):
 
     def get(self, request, pk):
         supply = get_object_or_404(
-            Supply,
+            Supply.objects.select_related('supplier'),
             pk=pk,
-            storage__company=request.user.company
+            company_id=request.user.company_id
         )
 
-        pdf_buffer = generate_supply_pdf(supply)
+        # ETag - хэш содержимого накладной: 304 отдается без генерации PDF,
+        # сам PDF берется из файлового кэша
+        lines = invoice_lines(supply)
+        digest = invoice_digest(supply, lines)
+        etag = f'"{digest}"'
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return not_modified
 
-        response = HttpResponse(pdf_buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="supply_{pk}.pdf"'
+        path, digest = invoice_file(supply, lines, digest)
+        try:
+            content = path.open('rb')
+        except FileNotFoundError:
+            # Файл удалили после проверки (invalidate_invoice): отдаем из памяти
+            content = io.BytesIO(render_invoice(supply, lines))
+
+        response = FileResponse(
+            content,
+            as_attachment=True,
+            filename=f'supply_{pk}.pdf',
+            content_type='application/pdf'
+        )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+
+@extend_schema(
+    tags=['Supplies'],
+    parameters=[
+        OpenApiParameter(name='from', description='Дата поставки от (YYYY-MM-DD)', required=False, type=str),
+        OpenApiParameter(name='to', description='Дата поставки до включительно (YYYY-MM-DD)', required=False, type=str),
+        OpenApiParameter(name='ids', description='ID поставок через запятую', required=False, type=str)
+    ],
+    responses={(200, 'application/zip'): OpenApiTypes.BINARY}
+)
+class SupplyInvoiceArchiveView(generics.GenericAPIView):
+    """ZIP с накладными поставок за период или по списку id"""
+    permission_classes = [permissions.IsAuthenticated, IsCompanyEmployee]
+
+    def get(self, request):
+        supplies = Supply.objects.filter(company_id=request.user.company_id)
+        ids = request.query_params.get('ids')
+        date_from = request.query_params.get('from')
+        date_to = request.query_params.get('to')
+
+        if ids:
+            try:
+                supplies = supplies.filter(id__in=[int(pk) for pk in ids.split(',')])
+            except ValueError:
+                return Response({'error': 'ids - список чисел через запятую'}, status=status.HTTP_400_BAD_REQUEST)
+        elif date_from or date_to:
+            try:
+                start, end = period_bounds(date_from, date_to)
+            except ValueError:
+                return Response(
+                    {'error': 'Неверный формат даты. Используйте YYYY-MM-DD'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if start:
+                supplies = supplies.filter(created_at__gte=start)
+            if end:
+                supplies = supplies.filter(created_at__lt=end)
+        else:
+            return Response({'error': 'Укажите период (from, to) или ids'}, status=status.HTTP_400_BAD_REQUEST)
+
+        supply_ids = list(supplies.order_by('id').values_list('id', flat=True)[:settings.INVOICE_EXPORT_MAX + 1])
+        if not supply_ids:
+            raise Http404('Поставки не найдены')
+        if len(supply_ids) > settings.INVOICE_EXPORT_MAX:
+            return Response(
+                {'error': f'Не больше {settings.INVOICE_EXPORT_MAX} накладных за раз'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = StreamingHttpResponse(
+            # Генератор выполняется после ответа view, когда шард запроса уже сброшен
+            invoice_zip(supply_ids, workers=settings.INVOICE_EXPORT_WORKERS, using=current_shard()),
+            content_type='application/zip'
+        )
+        response['Content-Disposition'] = 'attachment; filename="invoices.zip"'
         return response
 
 
@@ -517,9 +843,9 @@ class SalesChartsView(generics.GenericAPIView):
 
         try:
             if date_from:
-                datetime.strptime(date_from, '%Y-%m-%d')
+                datetime.datetime.strptime(date_from, '%Y-%m-%d')
                 if date_to:
-                    datetime.strptime(date_to, '%Y-%m-%d')
+                    datetime.datetime.strptime(date_to, '%Y-%m-%d')
         except ValueError:
             return Response(
                 {'error': 'Неверный формат даты. Используйте YYYY-MM-DD'},
@@ -532,4 +858,193 @@ class SalesChartsView(generics.GenericAPIView):
             date_to=date_to
         )
 
-        return HttpResponse(img_buffer, content_type='image/png')
\ No newline at end of file
+        return HttpResponse(img_buffer, content_type='image/png')
+
+
+@extend_schema(
+    tags=['Analytics'],
+    parameters=[
+        OpenApiParameter(name='from', description='Дата от (YYYY-MM-DD)', required=False, type=str),
+        OpenApiParameter(name='to', description='Дата до (YYYY-MM-DD)', required=False, type=str),
+        OpenApiParameter(name='points', description='Максимум точек в ряду (3-5000, по умолчанию 500)',
+                         required=False, type=int)
+    ]
+)
+class SalesChartDataView(generics.GenericAPIView):
+    """Данные графиков продаж для отрисовки на клиенте"""
+    permission_classes = [permissions.IsAuthenticated, IsCompanyEmployee]
+    default_points = 500
+    max_points = 5000
+
+    def get(self, request):
+        date_from = request.query_params.get('from')
+        date_to = request.query_params.get('to')
+
+        try:
+            if date_from:
+                datetime.datetime.strptime(date_from, '%Y-%m-%d')
+                if date_to:
+                    datetime.datetime.strptime(date_to, '%Y-%m-%d')
+        except ValueError:
+            return Response(
+                {'error': 'Неверный формат даты. Используйте YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            points = int(request.query_params.get('points', self.default_points))
+        except ValueError:
+            points = 0
+        if not 3 <= points <= self.max_points:
+            return Response(
+                {'error': f'points должен быть числом от 3 до {self.max_points}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'period': {
+                'from': date_from,
+                'to': date_to
+            },
+            'points': points,
+            **sales_chart_data(
+                company=request.user.company,
+                date_from=date_from,
+                date_to=date_to,
+                points=points
+            )
+        })
+
+
+CUSTOMER_PERIOD_PARAMETERS = [
+    OpenApiParameter(name='from', description='Дата от (YYYY-MM-DD), по умолчанию - за все время',
+                     required=False, type=str),
+    OpenApiParameter(name='to', description='Дата до включительно (YYYY-MM-DD)', required=False, type=str)
+]
+
+
+@extend_schema(tags=['Analytics'], parameters=CUSTOMER_PERIOD_PARAMETERS)
+class CustomerAnalyticsView(generics.GenericAPIView):
+    """Покупатели, доля повторных покупателей и средняя выручка на покупателя (LTV)"""
+    permission_classes = [permissions.IsAuthenticated, IsCompanyEmployee]
+
+    def get(self, request):
+        date_from = request.query_params.get('from')
+        date_to = request.query_params.get('to')
+        try:
+            start, end = period_bounds(date_from, date_to)
+        except ValueError:
+            return Response(
+                {'error': 'Неверный формат даты. Используйте YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'period': {
+                'from': date_from,
+                'to': date_to
+            },
+            **customer_summary(request.user.company, start, end)
+        })
+
+
+@extend_schema(
+    tags=['Analytics'],
+    parameters=CUSTOMER_PERIOD_PARAMETERS + [
+        OpenApiParameter(name='limit', description=f'Количество покупателей (1-{TOP_BUYERS_MAX}, '
+                                                   f'по умолчанию {TOP_BUYERS_LIMIT})',
+                         required=False, type=int),
+        OpenApiParameter(name='ordering', description='revenue (по умолчанию) или sales_count',
+                         required=False, type=str, enum=list(TOP_BUYERS_ORDERING))
+    ]
+)
+class TopBuyersView(generics.GenericAPIView):
+    """Лучшие покупатели компании по выручке или числу продаж"""
+    permission_classes = [permissions.IsAuthenticated, IsCompanyEmployee]
+
+    def get(self, request):
+        date_from = request.query_params.get('from')
+        date_to = request.query_params.get('to')
+        try:
+            start, end = period_bounds(date_from, date_to)
+        except ValueError:
+            return Response(
+                {'error': 'Неверный формат даты. Используйте YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            limit = int(request.query_params.get('limit', TOP_BUYERS_LIMIT))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= TOP_BUYERS_MAX:
+            return Response(
+                {'error': f'limit должен быть числом от 1 до {TOP_BUYERS_MAX}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        ordering = request.query_params.get('ordering', 'revenue')
+        if ordering not in TOP_BUYERS_ORDERING:
+            return Response(
+                {'error': f'ordering должен быть одним из: {", ".join(TOP_BUYERS_ORDERING)}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response({
+            'period': {
+                'from': date_from,
+                'to': date_to
+            },
+            'ordering': ordering,
+            'buyers': top_buyers(request.user.company, start, end, limit=limit, ordering=ordering)
+        })
+
+
+@extend_schema(tags=['Analytics'])
+class StockValuationView(generics.GenericAPIView):
+    """Стоимость остатков по складам компании по закупочным и продажным ценам"""
+    permission_classes = [permissions.IsAuthenticated, IsCompanyEmployee]
+
+    def get(self, request):
+        storages, totals = company_valuation(request.user.company_id)
+        return Response({
+            'totals': totals,
+            'storages': storages
+        })
+
+
+@extend_schema(
+    tags=['Analytics'],
+    parameters=[
+        OpenApiParameter(name='from', description='Дата от (YYYY-MM-DD)', required=False, type=str),
+        OpenApiParameter(name='to', description='Дата до включительно (YYYY-MM-DD)', required=False, type=str)
+    ]
+)
+class FleetKPIView(generics.GenericAPIView):
+    """KPI всех компаний платформы для администраторов"""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        date_from = request.query_params.get('from')
+        date_to = request.query_params.get('to')
+        try:
+            start, end = period_bounds(date_from, date_to)
+        except ValueError:
+            return Response(
+                {'error': 'Неверный формат даты. Используйте YYYY-MM-DD'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not date_from and not date_to:
+            # По умолчанию - последние 30 дней
+            start = timezone.now() - timedelta(days=30)
+
+        # В запросе без пула процессов: пул и закрытие соединений - для manage.py fleet_kpis
+        companies, totals = fleet_kpis(start, end, workers=1, ranges=1)
+        return Response({
+            'period': {
+                'from': date_from,
+                'to': date_to
+            },
+            'totals': totals,
+            'companies': companies
+        })
@@ -0,0 +1,51 @@
+"""
+Сжатие ответов: brotli, если пакет установлен и клиент его принимает,
+иначе gzip из Django. Ответы меньше COMPRESSION_MIN_SIZE байт и уже
+сжатые форматы (PDF, PNG, ZIP) отдаются как есть.
+"""
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+re_accepts_brotli = _lazy_re_compile(r'\bbr\b')
+
+INCOMPRESSIBLE_TYPES = ('image/', 'application/pdf', 'application/zip')
+
+
+class CompressionMiddleware(GZipMiddleware):
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        if response.get('Content-Type', '').startswith(INCOMPRESSIBLE_TYPES):
+            return response
+        if not response.streaming and len(response.content) < settings.COMPRESSION_MIN_SIZE:
+            return response
+
+        # HTML (админка с CSRF-токеном) сжимаем только gzip-ом Django:
+        # он добавляет случайные байты против атаки BREACH
+        if (
+            brotli is None
+            or response.streaming
+            or response.get('Content-Type', '').startswith('text/html')
+            or not re_accepts_brotli.search(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        ):
+            return super().process_response(request, response)
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        compressed = brotli.compress(response.content, quality=settings.BROTLI_QUALITY)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = 'br'
+        return response
@@ -0,0 +1,161 @@
+"""
+Профилирование запроса по требованию для staff-пользователей.
+
+Запрос с заголовком X-Profile: 1 или параметром ?_profile=1 выполняется
+под профилировщиком (pyinstrument, если установлен, иначе cProfile),
+все SQL-запросы записываются с временем, для самых медленных строится
+EXPLAIN. Вместо обычного ответа возвращается отчет, который также
+сохраняется в кольцевой буфер файлов PROFILE_DIR.
+"""
+import cProfile
+import io
+import json
+import pstats
+import time
+import uuid
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import FileResponse, Http404, JsonResponse
+from drf_spectacular.utils import extend_schema
+from rest_framework import permissions
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+EXPLAIN_SLOWEST = 5
+
+
+class QueryRecorder:
+    """execute_wrapper, который запоминает каждый SQL-запрос с временем."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'database': context['connection'].alias,
+                'sql': sql,
+                'params': None if many else params,
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+def explain(query):
+    connection = connections[query['database']]
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + query['sql'], query['params'])
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except Exception as exc:
+        return [f'EXPLAIN недоступен: {exc}']
+
+
+def is_staff(request):
+    if request.user.is_authenticated:
+        return request.user.is_staff
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (InvalidToken, TokenError):
+        return False
+    return bool(result and result[0].is_staff)
+
+
+def store_report(report):
+    directory = settings.PROFILE_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{report["id"]}.json'
+    path.write_text(json.dumps(report, ensure_ascii=False, default=str), encoding='utf-8')
+
+    # Кольцевой буфер: удаляем самые старые отчеты сверх лимита
+    reports = sorted(directory.glob('*.json'), key=lambda p: p.stat().st_mtime)
+    for old in reports[:-settings.PROFILE_RING_SIZE]:
+        old.unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        requested = request.headers.get('X-Profile') == '1' or request.GET.get('_profile') == '1'
+        if not requested or not is_staff(request):
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            if SamplingProfiler is not None:
+                profiler = SamplingProfiler()
+                profiler.start()
+                response = self.get_response(request)
+                profiler.stop()
+                profile = profiler.output_text(unicode=True)
+            else:
+                profiler = cProfile.Profile()
+                response = profiler.runcall(self.get_response, request)
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(50)
+                profile = stream.getvalue()
+        duration = time.perf_counter() - started
+
+        slowest = sorted(
+            (q for q in recorder.queries if q['sql'].lstrip().upper().startswith('SELECT')),
+            key=lambda q: q['ms'],
+            reverse=True
+        )[:EXPLAIN_SLOWEST]
+        report = {
+            'id': f'{time.strftime("%Y%m%d%H%M%S")}-{uuid.uuid4().hex[:8]}',
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'profiler': 'pyinstrument' if SamplingProfiler is not None else 'cProfile',
+            'query_count': len(recorder.queries),
+            'query_ms': round(sum(q['ms'] for q in recorder.queries), 3),
+            'queries': recorder.queries,
+            'slowest_queries': [dict(q, plan=explain(q)) for q in slowest],
+            'profile': profile,
+        }
+        store_report(report)
+
+        result = JsonResponse(report, json_dumps_params={'ensure_ascii': False, 'default': str})
+        result['X-Profile-Id'] = report['id']
+        return result
+
+
+@extend_schema(exclude=True)
+class ProfileListView(APIView):
+    """Список сохраненных отчетов профилирования."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        directory = settings.PROFILE_DIR
+        reports = sorted(directory.glob('*.json'), reverse=True) if directory.exists() else []
+        return Response([{'id': path.stem, 'size': path.stat().st_size} for path in reports])
+
+
+@extend_schema(exclude=True)
+class ProfileDownloadView(APIView):
+    """Скачивание сохраненного отчета профилирования."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, profile_id):
+        path = settings.PROFILE_DIR / f'{profile_id}.json'
+        if not path.exists():
+            raise Http404
+        return FileResponse(path.open('rb'), as_attachment=True, filename=path.name)
@@ -0,0 +1,182 @@
+"""
+Статистика SQL-запросов по эндпоинтам.
+
+QueryLogMiddleware ставит execute_wrapper на время запроса, приводит каждый
+SQL к отпечатку (литералы и списки параметров заменены на ?) и копит
+количество, суммарное и максимальное время по паре (имя URL, отпечаток).
+Накопленное раз в QUERY_STATS_FLUSH_INTERVAL секунд сбрасывается в
+QueryStat фоновым потоком, а остаток - при выходе процесса; оттуда
+статистику читает команда query_report. Запросы дольше
+SLOW_QUERY_THRESHOLD_MS пишутся в лог crmlite.slow_queries одной JSON-строкой.
+"""
+import atexit
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+slow_logger = logging.getLogger('crmlite.slow_queries')
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+_PLACEHOLDER = re.compile(r'%s|\?')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_VALUES = re.compile(r'(\(\s*\?(?:\s*,\s*\?)*\s*\))(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(sql):
+    """SQL без литералов: одинаковые по форме запросы дают одну строку."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _VALUES.sub(r'\1, ...', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def fingerprint(normalized_sql):
+    return hashlib.sha1(normalized_sql.encode()).hexdigest()
+
+
+class QueryStats:
+    """Накопитель статистики процесса, общий для всех потоков."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffer = {}
+        self._flusher_pid = None
+
+    def add(self, url_name, view, queries):
+        normalized = [(normalize(sql), ms) for sql, ms in queries]
+        seen = set()
+        with self._lock:
+            for sql, ms in normalized:
+                key = (url_name, fingerprint(sql))
+                entry = self._buffer.get(key)
+                if entry is None:
+                    entry = self._buffer[key] = {
+                        'sql': sql, 'view': view,
+                        'requests': 0, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                    }
+                if key not in seen:
+                    seen.add(key)
+                    entry['requests'] += 1
+                entry['count'] += 1
+                entry['total_ms'] += ms
+                entry['max_ms'] = max(entry['max_ms'], ms)
+        self._start_flusher()
+
+    def _start_flusher(self):
+        # Запись в БД идет в своем потоке, а не внутри чужого запроса.
+        # Поток запускается в каждом процессе: после fork его в дочернем нет
+        pid = os.getpid()
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+        threading.Thread(target=self._flush_periodically, name='query-stats-flush', daemon=True).start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(settings.QUERY_STATS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            finally:
+                # Соединения этого потока не должны висеть между сбросами
+                connections.close_all()
+
+    def flush(self):
+        with self._lock:
+            buffer, self._buffer = self._buffer, {}
+        if not buffer:
+            return
+        try:
+            for (url_name, digest), entry in buffer.items():
+                save_stat(url_name, digest, entry)
+        except DatabaseError:
+            logger.exception('Не удалось сохранить статистику запросов')
+
+
+def save_stat(url_name, digest, entry):
+    from companies.models import QueryStat
+
+    lookup = QueryStat.objects.filter(url_name=url_name, fingerprint=digest)
+    changes = {
+        'requests': F('requests') + entry['requests'],
+        'count': F('count') + entry['count'],
+        'total_ms': F('total_ms') + entry['total_ms'],
+        'max_ms': Greatest('max_ms', Value(entry['max_ms'])),
+        'view': entry['view'],
+    }
+    if lookup.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            QueryStat.objects.create(url_name=url_name, fingerprint=digest, **{
+                field: entry[field] for field in ('sql', 'view', 'requests', 'count', 'total_ms', 'max_ms')
+            })
+    except IntegrityError:
+        # Строку успел создать другой процесс
+        lookup.update(**changes)
+
+
+stats = QueryStats()
+atexit.register(stats.flush)
+
+
+class QueryLogMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append((sql, (time.perf_counter() - started) * 1000))
+
+        # Запросы ко всем базам: справочнику и шардам компаний
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(record))
+            response = self.get_response(request)
+
+        if queries:
+            url_name, view = describe(request)
+            stats.add(url_name, view, queries)
+            threshold = settings.SLOW_QUERY_THRESHOLD_MS
+            for sql, ms in queries:
+                if ms >= threshold:
+                    slow_logger.warning(json.dumps({
+                        'url_name': url_name,
+                        'view': view,
+                        'method': request.method,
+                        'path': request.path,
+                        'ms': round(ms, 3),
+                        'fingerprint': fingerprint(normalize(sql)),
+                        'sql': sql,
+                    }, ensure_ascii=False))
+        return response
+
+
+def describe(request):
+    """Имя URL и путь к view, обработавшему запрос."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return '<unresolved>', ''
+    func = getattr(match.func, 'view_class', match.func)
+    return match.view_name or match.route, f'{func.__module__}.{func.__qualname__}'
@@ -0,0 +1,76 @@
+import hashlib
+import threading
+from contextlib import nullcontext
+
+import yaml
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils import translation
+from drf_spectacular.settings import patched_settings
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import SCHEMA_KWARGS, SpectacularAPIView
+
+
+def _code_mtime():
+    """Время последнего изменения исходников проекта."""
+    return max(
+        (path.stat().st_mtime for path in settings.BASE_DIR.rglob('*.py')),
+        default=0
+    )
+
+
+class CachedSpectacularAPIView(SpectacularAPIView):
+    """
+    Схема OpenAPI, которая строится один раз на процесс.
+
+    Если задан SPECTACULAR_SCHEMA_FILE и файл свежее исходников
+    (python manage.py spectacular --file ...), схема читается из него,
+    иначе генерируется при первом запросе. Ответ отдается с ETag
+    по хэшу содержимого.
+    """
+    _schemas = {}
+    _rendered = {}
+    _lock = threading.Lock()
+
+    @extend_schema(**SCHEMA_KWARGS)
+    def get(self, request, *args, **kwargs):
+        version = self.api_version or request.version or self._get_version_parameter(request)
+        lang = request.GET.get('lang') if settings.USE_I18N else None
+        renderer = request.accepted_renderer
+        key = (version, lang, request.accepted_media_type)
+
+        with self._lock:
+            if key not in self._rendered:
+                data = self._get_schema(request, version, lang)
+                content = renderer.render(data, request.accepted_media_type, self.get_renderer_context())
+                self._rendered[key] = (content, f'"{hashlib.sha256(content).hexdigest()}"')
+        content, etag = self._rendered[key]
+
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(content, content_type=request.accepted_media_type)
+            response['Content-Disposition'] = f'inline; filename="{self._get_filename(request, version)}"'
+        response['ETag'] = etag
+        return response
+
+    def _get_schema(self, request, version, lang):
+        if (version, lang) in self._schemas:
+            return self._schemas[(version, lang)]
+
+        schema = self._load_schema_file() if version is None and lang is None else None
+        if schema is None:
+            with patched_settings(self.custom_settings), (translation.override(lang) if lang else nullcontext()):
+                generator = self.generator_class(urlconf=self.urlconf, api_version=version, patterns=self.patterns)
+                schema = generator.get_schema(request=request, public=self.serve_public)
+
+        self._schemas[(version, lang)] = schema
+        return schema
+
+    @staticmethod
+    def _load_schema_file():
+        path = getattr(settings, 'SPECTACULAR_SCHEMA_FILE', None)
+        if not path or not path.exists() or path.stat().st_mtime < _code_mtime():
+            return None
+        with path.open(encoding='utf-8') as schema_file:
+            return yaml.safe_load(schema_file)
@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,10 +48,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'companies.sharding.CompanyShardMiddleware',
+    'crmlite.compression.CompressionMiddleware',
+    'crmlite.querylog.QueryLogMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'crmlite.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,11 +87,100 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL: читатели (пулы процессов отчетов и KPI) не блокируют запись и наоборот
+            'init_command': 'PRAGMA journal_mode=WAL;',
+        },
     }
 }
 
+# Шарды данных компаний (companies/sharding.py): справочник компаний и
+# пользователи всегда в 'default', он же первый шард. Например,
+# CRMLITE_SHARDS=2 добавляет shard_1.sqlite3 и shard_2.sqlite3
+COMPANY_SHARDS = ['default']
+for index in range(1, int(os.environ.get('CRMLITE_SHARDS', 0)) + 1):
+    DATABASES[f'shard_{index}'] = {**DATABASES['default'], 'NAME': BASE_DIR / f'shard_{index}.sqlite3'}
+    COMPANY_SHARDS.append(f'shard_{index}')
+
+DATABASE_ROUTERS = ['companies.sharding.CompanyShardRouter']
+
 AUTH_USER_MODEL = 'users.User'
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# Файловый кэш общий для всех воркеров на одной машине
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+    }
+}
+
+# Кэш справочников компании (companies/cache.py)
+REFERENCE_CACHE_ALIAS = 'default'
+REFERENCE_CACHE_TIMEOUT = 60 * 60
+
+# Idempotency-Key для создания продаж и поставок (companies/idempotency.py)
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+IDEMPOTENCY_WAIT_TIMEOUT = 30
+
+# Outbox событий продаж и поставок (companies/outbox.py)
+# Например: ['http://127.0.0.1:8099/'] для manage.py outbox_stub_server
+OUTBOX_ENDPOINTS = []
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_REQUEST_TIMEOUT = 5
+OUTBOX_BACKOFF_BASE = 2
+OUTBOX_BACKOFF_MAX = 60 * 60
+# Сколько пачка принадлежит забравшему ее диспетчеру, если он не отметил результат
+OUTBOX_CLAIM_TIMEOUT = 5 * 60
+
+# Файловый кэш PDF-накладных (companies/invoices.py)
+INVOICE_CACHE_DIR = BASE_DIR / 'invoices'
+# Выгрузка накладных ZIP-архивом: процессы общего пула рендеринга и лимит за запрос
+INVOICE_EXPORT_WORKERS = 4
+INVOICE_EXPORT_MAX = 2000
+
+# Процессы для расчета KPI по всем компаниям (manage.py fleet_kpis)
+FLEET_KPI_WORKERS = 4
+
+# Процессы для build_sales_reports (companies/reports.py)
+SALES_REPORT_WORKERS = 4
+
+# Профилирование запросов для staff (crmlite/profiling.py)
+PROFILE_DIR = BASE_DIR / 'profiles'
+PROFILE_RING_SIZE = 50
+
+# Сжатие ответов (crmlite/compression.py): brotli, если установлен, иначе gzip
+COMPRESSION_MIN_SIZE = 1024
+BROTLI_QUALITY = 5
+
+# Статистика SQL по эндпоинтам (crmlite/querylog.py, manage.py query_report)
+SLOW_QUERY_THRESHOLD_MS = 200
+QUERY_STATS_FLUSH_INTERVAL = 10
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json_line': {'format': '%(message)s'},
+    },
+    'handlers': {
+        'slow_queries': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json_line',
+        },
+    },
+    'loggers': {
+        'crmlite.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -129,7 +224,13 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        # JWT-аутентификация, которая выбирает шард компании пользователя
+        'companies.sharding.CompanyJWTAuthentication',
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        # orjson необязателен: без него JSON рендерится стандартно
+        'crmlite.renderers.ORJSONRenderer' if find_spec('orjson') else 'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -148,7 +249,7 @@ SPECTACULAR_SETTINGS = {
     },
     'COMPONENT_SPLIT_REQUEST': True,
     'AUTHENTICATION_WHITELIST': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'companies.sharding.CompanyJWTAuthentication',
     ],
     'SECURITY': [
         {
@@ -158,6 +259,9 @@ SPECTACULAR_SETTINGS = {
     'SCHEMA_PATH_PREFIX': r'/api/',
 }
 
+# Заранее собранная схема: python manage.py spectacular --file schema.yml
+SPECTACULAR_SCHEMA_FILE = BASE_DIR / 'schema.yml'
+
 from datetime import timedelta
 
 SIMPLE_JWT = {
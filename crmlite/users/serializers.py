@@ -7,8 +7,10 @@ class UserSerializer(serializers.ModelSerializer):
     company = serializers.SerializerMethodField()
 
     def get_company(self, obj):
-        from companies.serializers import CompanySerializer  # Ленивый импорт
-        return CompanySerializer(obj.company).data if obj.company else None
+        from companies.cache import get_company  # Ленивый импорт
+        from companies.serializers import CompanySerializer
+        company = get_company(obj.company_id)
+        return CompanySerializer(company).data if company else None
 
     class Meta:
         model = User